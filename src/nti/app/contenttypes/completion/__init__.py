@@ -25,6 +25,9 @@ COMPLETED_ITEMS_PATH_NAME = u'CompletedItems'
 RESET_COMPLETION_VIEW = u'ResetCompletion'
 BUILD_COMPLETION_VIEW = u'BuildCompletion'
 USER_DATA_COMPLETION_VIEW = u'UserCompletionData'
+CONTEXT_PROGRESS_VIEW = u'CompletionContextProgress'
+BUILD_PROGRESS_AGGREGATE_VIEW = u'BuildProgressStatistics'
+COMPLETION_PRINCIPALS_VIEW = u'CompletionPrincipals'
 
 AWARDED_COMPLETED_ITEMS_PATH_NAME = u'AwardedCompletedItems'
 DELETE_AWARDED_COMPLETED_ITEM_VIEW = u'DeleteAwardedCompletedItem'
@@ -15,6 +15,16 @@ from zope.cachedescriptors.property import Lazy
 
 from zope.component.hooks import getSite
 
+from nti.app.contenttypes.completion.cache import query_progress_cache
+from nti.app.contenttypes.completion.cache import is_read_only_request
+from nti.app.contenttypes.completion.cache import get_request_snapshots
+from nti.app.contenttypes.completion.cache import get_provider_versions
+from nti.app.contenttypes.completion.cache import get_requirements_token
+
+from nti.app.contenttypes.completion.interfaces import IVersionedItemProvider
+from nti.app.contenttypes.completion.interfaces import ICompletionContextProgressCache
+from nti.app.contenttypes.completion.interfaces import IUserIndependentCompletableItemProvider
+
 from nti.coremetadata.interfaces import IUser
 
 from nti.contenttypes.completion.interfaces import IProgress
@@ -39,8 +49,8 @@ from nti.site.interfaces import IHostPolicyFolder
 logger = __import__('logging').getLogger(__name__)
 
 
-@interface.implementer(ICompletedItemProvider)
 @component.adapter(IUser, ICompletionContext)
+@interface.implementer(ICompletedItemProvider, IVersionedItemProvider)
 class PrincipalCompletedItemsProvider(object):
     """
     Provides the :class:`ICompletedItem`s from the users completed items container
@@ -63,6 +73,42 @@ class PrincipalCompletedItemsProvider(object):
     def last_modified(self):
         return self.user_completed_items.lastModified
 
+    version = last_modified
+
+
+class _SharedItemProvider(object):
+    """
+    Wraps a :class:`IUserIndependentCompletableItemProvider`, resolving its
+    items once for all users.
+    """
+
+    def __init__(self, provider):
+        self.provider = provider
+        self._items = None
+
+    def iter_items(self, user):
+        if self._items is None:
+            self._items = tuple(self.provider.iter_items(user))
+        return iter(self._items)
+
+    def __getattr__(self, name):
+        return getattr(self.provider, name)
+
+
+def shared_item_providers(providers):
+    """
+    Return the given item providers, wrapping those that declare
+    themselves user independent so that their items are only resolved
+    once when reused across users.
+    """
+    result = []
+    for provider in providers or ():
+        if      IUserIndependentCompletableItemProvider.providedBy(provider) \
+            and not isinstance(provider, _SharedItemProvider):
+            provider = _SharedItemProvider(provider)
+        result.append(provider)
+    return result
+
 
 class CompletionContextProgressFactory(object):
     """
@@ -80,6 +126,7 @@ class CompletionContextProgressFactory(object):
         if not result:
             result = component.subscribers((self.context,),
                                            IRequiredCompletableItemProvider)
+            result = shared_item_providers(result)
         return result
 
     @Lazy
@@ -94,14 +141,19 @@ class CompletionContextProgressFactory(object):
                 result[item.ntiid] = item
         return result
 
+    @Lazy
+    def completed_item_providers(self):
+        return component.subscribers((self.user, self.context),
+                                     ICompletedItemProvider)
+
     @Lazy
     def user_completed_items(self):
         """
         A map of ntiid to all user completed items.
         """
         result = {}
-        for completed_provider in component.subscribers((self.user, self.context),
-                                                        ICompletedItemProvider):
+        # pylint: disable=not-an-iterable
+        for completed_provider in self.completed_item_providers:
             for item in completed_provider.completed_items():
                 result[item.item_ntiid] = item
         return result
@@ -125,40 +177,135 @@ class CompletionContextProgressFactory(object):
             # pylint: disable=no-member
             return max(x.CompletedDate for x in self.user_required_completed_items.values())
 
-    def __call__(self):
-        ntiid = getattr(self.context, 'ntiid', '') \
-             or to_external_ntiid_oid(self.context)
-        last_mod = self._get_last_mod()
-        completed_count = len(self.user_required_completed_items)
-        max_possible = len(self.completable_items)
-        has_progress = bool(completed_count)
+    @Lazy
+    def progress_cache(self):
+        return query_progress_cache(self.context)
 
+    @Lazy
+    def has_shared_requirements(self):
+        """
+        Whether every required item provider is user independent.
+        """
+        # pylint: disable=not-an-iterable
+        return all(IUserIndependentCompletableItemProvider.providedBy(getattr(x, 'provider', x))
+                   for x in self.required_item_providers)
+
+    @Lazy
+    def snapshot_token(self):
+        """
+        The validity token of the progress snapshot of our user: the
+        requirements of the context and the version of every item
+        provider. None if some provider cannot be versioned, in which
+        case snapshots are not persisted.
+        """
+        if not self.has_shared_requirements:
+            return None
+        required = get_provider_versions(self.required_item_providers)
+        if required is None:
+            return None
+        completed = get_provider_versions(self.completed_item_providers)
+        if completed is None:
+            return None
+        return (get_requirements_token(self.context), required, completed)
+
+    def _compute_snapshot(self):
+        completed_count = len(self.user_required_completed_items)
         failed_ntiids = set()
         incomplete_ntiids = set(self.completable_items) - set(self.user_required_completed_items)
         for completed_item in self.user_required_completed_items.values():
             if not completed_item.Success:
                 failed_ntiids.add(completed_item.ItemNTIID)
-        # We probably always want to return this progress, even if there is
-        # none.
-        progress = CompletionContextProgress(NTIID=ntiid,
-                                             AbsoluteProgress=completed_count,
-                                             MaxPossibleProgress=max_possible,
-                                             LastModified=last_mod,
-                                             Item=self.context,
-                                             User=self.user,
-                                             CompletionContext=self.context,
-                                             HasProgress=has_progress,
-                                             UnsuccessfulItemNTIIDs=failed_ntiids,
-                                             IncompleteItemNTIIDs=incomplete_ntiids)
-
-        policy = ICompletionContextCompletionPolicy(self.context, None)
-        if policy is not None:
-            completed_item = policy.is_complete(progress)
-            if completed_item is not None:
-                interface.alsoProvides(completed_item, ICompletionContextCompletedItem)
-                completed_item.__parent__ = progress
-            progress.CompletedItem = completed_item
-        return progress
+        return {'AbsoluteProgress': completed_count,
+                'MaxPossibleProgress': len(self.completable_items),
+                'LastModified': self._get_last_mod(),
+                'UnsuccessfulItemNTIIDs': tuple(failed_ntiids),
+                'IncompleteItemNTIIDs': tuple(incomplete_ntiids)}
+
+    @property
+    def _request_key(self):
+        return (id(self.context), getattr(self.user, 'username', None))
+
+    def query_snapshot(self):
+        """
+        Return the persisted (if still valid) or request scoped progress
+        values of our user, if any.
+        """
+        username = getattr(self.user, 'username', None)
+        if not username:
+            return None
+        cache = self.progress_cache
+        token = self.snapshot_token if cache is not None else None
+        if token is not None:
+            snapshot = cache.get_snapshot(username, token)
+            if snapshot is not None:
+                return snapshot
+        snapshots = get_request_snapshots(create=False)
+        return snapshots.get(self._request_key) if snapshots else None
+
+    def store_snapshot(self, snapshot):
+        """
+        Persist the snapshot if all our providers are versioned and we
+        may write; otherwise keep it for the rest of the request.
+        """
+        username = getattr(self.user, 'username', None)
+        if not username:
+            return
+        token = self.snapshot_token
+        if token is not None and not is_read_only_request():
+            cache = ICompletionContextProgressCache(self.context, None)
+            if cache is not None:
+                cache.set_snapshot(username, snapshot, token,
+                                   self.completable_items)
+                return
+        snapshots = get_request_snapshots()
+        if snapshots is not None:
+            snapshots[self._request_key] = snapshot
+
+    def get_snapshot(self):
+        """
+        Return the progress values for our user, served from the
+        :class:`ICompletionContextProgressCache` or the request when
+        current.
+        """
+        snapshot = self.query_snapshot()
+        if snapshot is None:
+            snapshot = self._compute_snapshot()
+            self.store_snapshot(snapshot)
+        return snapshot
+
+    def __call__(self):
+        return make_context_progress(self.user, self.context, self.get_snapshot())
+
+
+def make_context_progress(user, context, snapshot, policy=None):
+    """
+    Create the :class:`ICompletionContextProgress` from the progress
+    values of a snapshot, applying the context completion policy.
+    """
+    ntiid = getattr(context, 'ntiid', '') \
+         or to_external_ntiid_oid(context)
+    # We probably always want to return this progress, even if there is
+    # none.
+    progress = CompletionContextProgress(NTIID=ntiid,
+                                         AbsoluteProgress=snapshot['AbsoluteProgress'],
+                                         MaxPossibleProgress=snapshot['MaxPossibleProgress'],
+                                         LastModified=snapshot['LastModified'],
+                                         Item=context,
+                                         User=user,
+                                         CompletionContext=context,
+                                         HasProgress=bool(snapshot['AbsoluteProgress']),
+                                         UnsuccessfulItemNTIIDs=set(snapshot['UnsuccessfulItemNTIIDs']),
+                                         IncompleteItemNTIIDs=set(snapshot['IncompleteItemNTIIDs']))
+
+    if policy is None:
+        policy = ICompletionContextCompletionPolicy(context, None)
+    if policy is not None:
+        completed_item = policy.is_complete(progress)
+        if completed_item is not None:
+            interface.alsoProvides(completed_item, ICompletionContextCompletedItem)
+            completed_item.__parent__ = progress
+        progress.CompletedItem = completed_item
+    return progress
 
 
 @component.adapter(IUser, ICompletionContext)
@@ -182,6 +329,7 @@ def _completed_item_to_context(item):
 # catalog
 
 
+@interface.implementer(ISiteAdapter)
 class _Site(object):
 
     __slots__ = ('site',)
@@ -190,14 +338,43 @@ class _Site(object):
         self.site = site
 
 
+#: The volatile attribute of a user container caching the catalog values
+#: shared by its completed items.
+CATALOG_VALUES_ATTR = '_v_completion_catalog_values'
+
+
+def get_item_catalog_values(item):
+    """
+    Return the (context ntiid, host site name) of the given completed
+    item. These are cached on its user container, so the parent walks
+    happen once per container rather than once per item.
+    """
+    container = getattr(item, '__parent__', None)
+    if not IPrincipalCompletedItemContainer.providedBy(container):
+        container = None
+    result = getattr(container, CATALOG_VALUES_ATTR, None)
+    if result is None:
+        context = find_interface(item, ICompletionContext, strict=False)
+        ntiid = getattr(context, 'ntiid', None) or to_external_ntiid_oid(context)
+        site = IHostPolicyFolder(item, None)
+        result = (ntiid, getattr(site, '__name__', None))
+        # Unsaved contexts may not have an ntiid yet
+        if container is not None and ntiid:
+            setattr(container, CATALOG_VALUES_ATTR, result)
+    return result
+
+
 @component.adapter(ICompletedItem)
 @interface.implementer(ISiteAdapter)
 def _completed_item_to_siteadapter(item):
-    site = IHostPolicyFolder(item, None)
-    site = getSite() if site is None else site
-    return _Site(site.__name__) if site is not None else None
+    name = get_item_catalog_values(item)[1]
+    if name is None:
+        site = getSite()
+        name = getattr(site, '__name__', None)
+    return _Site(name) if name is not None else None
 
 
+@interface.implementer(IContextNTIIDAdapter)
 class _NTIID(object):
 
     __slots__ = ('ntiid',)
@@ -209,6 +386,17 @@ class _NTIID(object):
 @component.adapter(ICompletedItem)
 @interface.implementer(IContextNTIIDAdapter)
 def _completed_item_to_context_ntiid(item):
-    context = find_interface(item, ICompletionContext, strict=False)
-    ntiid = getattr(context, 'ntiid', None) or to_external_ntiid_oid(context)
+    ntiid = get_item_catalog_values(item)[0]
     return _NTIID(ntiid) if ntiid else None
+
+
+def get_context_catalog_values(context):
+    """
+    Return the (:class:`IContextNTIIDAdapter`, :class:`ISiteAdapter`)
+    catalog values shared by every completed item of the context.
+    """
+    ntiid = getattr(context, 'ntiid', None) or to_external_ntiid_oid(context)
+    site = find_interface(context, IHostPolicyFolder, strict=False)
+    site = getSite() if site is None else site
+    return (_NTIID(ntiid) if ntiid else None,
+            _Site(site.__name__) if site is not None else None)
@@ -0,0 +1,331 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Resumable, partitioned (re)builds of the completion data of a context.
+
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import time
+import zlib
+
+from BTrees.Length import Length
+
+from BTrees.OOBTree import OOBTree
+from BTrees.OOBTree import OOTreeSet
+
+from persistent import Persistent
+
+from zope import component
+
+from zope.container.contained import Contained
+
+from nti.app.contenttypes.completion.adapters import shared_item_providers
+
+from nti.app.contenttypes.completion.cache import get_requirements_version
+
+from nti.app.contenttypes.completion.interfaces import ICompletionContextCohort
+
+from nti.app.contenttypes.completion.utils import get_annotation
+from nti.app.contenttypes.completion.utils import query_annotation
+
+from nti.contenttypes.completion.interfaces import IProgress
+from nti.contenttypes.completion.interfaces import ICompletableItemProvider
+from nti.contenttypes.completion.interfaces import ICompletableItemCompletionPolicy
+from nti.contenttypes.completion.interfaces import IPrincipalCompletedItemContainer
+
+from nti.contenttypes.completion.utils import update_completion
+
+from nti.dataserver.interfaces import IDataserverTransactionRunner
+
+from nti.dataserver.users.users import User
+
+from nti.ntiids.ntiids import find_object_with_ntiid
+
+BUILD_STATE_KEY = u'nti.app.contenttypes.completion.build.CompletionDataBuildState'
+
+DEFAULT_BATCH_SIZE = 50
+
+DEFAULT_RETRIES = 5
+
+logger = __import__('logging').getLogger(__name__)
+
+
+class _BuildCursor(Persistent):
+    """
+    The checkpoint of one worker partition; partitions are processed
+    independently so that concurrent workers do not conflict. The
+    usernames of the partition are snapshotted once, so that each chunk
+    resumes after `last` rather than walking the whole cohort again.
+    """
+
+    last = None
+    complete = False
+    usernames = None
+
+    def __init__(self):
+        self.count = Length()
+        self.skipped = Length()
+
+
+class CompletionDataBuild(Persistent):
+    """
+    A resumable build of the completion data of a context. Users are
+    split by username hash among `workers` partitions, each with its own
+    cursor over the sorted usernames. Users already built for the current
+    requirements are only skipped if `skip_current`.
+    """
+
+    finished = None
+    skip_current = False
+
+    def __init__(self, reset=False, skip_current=False, workers=1):
+        self.reset = reset
+        self.skip_current = skip_current
+        self.workers = workers
+        self.started = time.time()
+        self._cursors = OOBTree()
+
+    def query_cursor(self, worker):
+        return self._cursors.get(worker)
+
+    def get_cursor(self, worker):
+        result = self._cursors.get(worker)
+        if result is None:
+            result = self._cursors[worker] = _BuildCursor()
+        return result
+
+    @property
+    def complete(self):
+        return self.finished is not None
+
+    @property
+    def count(self):
+        return sum(x.count() for x in self._cursors.values())
+
+    @property
+    def skipped(self):
+        return sum(x.skipped() for x in self._cursors.values())
+
+    def status(self):
+        result = {}
+        for worker, cursor in self._cursors.items():
+            result[str(worker)] = {'Complete': cursor.complete,
+                                   'Last': cursor.last,
+                                   'UserCount': cursor.count(),
+                                   'SkippedCount': cursor.skipped()}
+        return result
+
+
+class CompletionDataBuildState(Persistent, Contained):
+    """
+    The current :class:`CompletionDataBuild` of a context and, per user,
+    the requirements version their completion data was last built for.
+    """
+
+    current = None
+
+    def __init__(self):
+        self._versions = OOBTree()
+
+    def is_current(self, username, version):
+        return self._versions.get(username) == version
+
+    def mark(self, username, version):
+        if self._versions.get(username) != version:
+            self._versions[username] = version
+
+    def forget(self, username):
+        self._versions.pop(username, None)
+
+    def clear(self):
+        self._versions.clear()
+
+
+def query_build_state(context):
+    """
+    Return the :class:`CompletionDataBuildState` of the context without
+    creating it.
+    """
+    return query_annotation(context, BUILD_STATE_KEY)
+
+
+def get_build_state(context):
+    """
+    Return the :class:`CompletionDataBuildState` of the context, creating
+    it if needed.
+    """
+    return get_annotation(context, BUILD_STATE_KEY, CompletionDataBuildState)
+
+
+def get_build_version(context):
+    """
+    The requirements version users are built against; completion data
+    is otherwise kept current by events.
+    """
+    return repr(get_requirements_version(context))
+
+
+def get_item_providers(context):
+    return shared_item_providers(component.subscribers((context,),
+                                                       ICompletableItemProvider))
+
+
+def build_user_completion(user, context, item_providers=None, reset=False):
+    """
+    (Re)build the completion data of the user in the context. Returns the
+    number of completable items.
+    """
+    if reset:
+        user_container = component.getMultiAdapter((user, context),
+                                                   IPrincipalCompletedItemContainer)
+        user_container.clear()
+    if item_providers is None:
+        item_providers = get_item_providers(context)
+    completable_items = set()
+    for item_provider in item_providers:
+        completable_items.update(item_provider.iter_items(user))
+    for item in completable_items:
+        update_completion(item, item.ntiid, user, context)
+    return len(completable_items)
+
+
+def diff_user_completion(user, context, item_providers=None, reset=False):
+    """
+    Compute, without writing, how a (re)build would change the completed
+    items of the user in the context. Returns a map with the number of
+    completed items that would be `Added`, `Removed` and `Changed` (in
+    success).
+    """
+    container = component.queryMultiAdapter((user, context),
+                                            IPrincipalCompletedItemContainer)
+    existing = dict(container.items()) if container is not None else {}
+    if item_providers is None:
+        item_providers = get_item_providers(context)
+    completable_items = set()
+    for item_provider in item_providers:
+        completable_items.update(item_provider.iter_items(user))
+    added = changed = 0
+    computed = set()
+    for item in completable_items:
+        policy = component.queryMultiAdapter((item, context),
+                                             ICompletableItemCompletionPolicy)
+        progress = component.queryMultiAdapter((user, item, context),
+                                               IProgress)
+        if policy is None or progress is None:
+            continue
+        completed_item = policy.is_complete(progress)
+        if completed_item is None:
+            continue
+        computed.add(item.ntiid)
+        current = existing.get(item.ntiid)
+        if current is None:
+            added += 1
+        elif bool(current.Success) != bool(completed_item.Success):
+            changed += 1
+    # Without a reset, nothing is ever removed
+    removed = len(set(existing) - computed) if reset else 0
+    return {'Added': added,
+            'Removed': removed,
+            'Changed': changed}
+
+
+def in_partition(username, worker, workers):
+    return workers <= 1 \
+        or zlib.crc32(username.encode('utf-8')) % workers == worker
+
+
+def start_completion_build(context, reset=False, skip_current=False, workers=1):
+    """
+    Record a new resumable build of the completion data of the context.
+    """
+    state = get_build_state(context)
+    state.current = CompletionDataBuild(reset, skip_current, workers)
+    return state.current
+
+
+def _partition_usernames(context, worker, workers):
+    result = OOTreeSet()
+    for user in ICompletionContextCohort(context, ()):
+        username = user.username
+        if in_partition(username, worker, workers):
+            result.add(username)
+    return result
+
+
+def process_completion_build(context, build, worker=0, max_users=None,
+                             item_providers=None):
+    """
+    Build the completion data of up to `max_users` users (skipping those
+    already up to date if the build says so) of the given worker
+    partition, checkpointing each user. Returns the number of users
+    processed; the build is marked finished once every partition is
+    complete.
+    """
+    state = get_build_state(context)
+    cursor = build.get_cursor(worker)
+    if cursor.complete:
+        return 0
+    if cursor.usernames is None:
+        cursor.usernames = _partition_usernames(context, worker, build.workers)
+    if cursor.last is None:
+        usernames = cursor.usernames.keys()
+    else:
+        usernames = cursor.usernames.keys(cursor.last, excludemin=True)
+    version = get_build_version(context)
+    processed = 0
+    for username in usernames:
+        if build.skip_current and state.is_current(username, version):
+            cursor.skipped.change(1)
+        else:
+            if max_users is not None and processed >= max_users:
+                return processed
+            user = User.get_user(username)
+            if user is not None:
+                if item_providers is None:
+                    item_providers = get_item_providers(context)
+                build_user_completion(user, context,
+                                      item_providers, build.reset)
+                state.mark(username, version)
+                cursor.count.change(1)
+                processed += 1
+        cursor.last = username
+    cursor.complete = True
+    # Do not create the cursors of the partitions not yet started
+    if all(getattr(build.query_cursor(x), 'complete', False)
+           for x in range(build.workers)):
+        build.finished = time.time()
+        logger.info("Finished building completion data for %s users (skipped=%s)",
+                    build.count, build.skipped)
+    return processed
+
+
+def run_completion_build(context_ntiid, worker=0, batch_size=DEFAULT_BATCH_SIZE,
+                         site_names=(), retries=DEFAULT_RETRIES):
+    """
+    Process a worker partition of the current build of the context in
+    batches, each in its own transaction that is retried on conflicts.
+    This must be called outside of a transaction, e.g. from a worker
+    process or greenlet per partition. Returns the number of users built.
+    """
+    runner = component.getUtility(IDataserverTransactionRunner)
+
+    def _do_batch():
+        context = find_object_with_ntiid(context_ntiid)
+        state = get_build_state(context) if context is not None else None
+        build = getattr(state, 'current', None)
+        if build is None or build.complete:
+            return 0
+        return process_completion_build(context, build, worker, batch_size)
+
+    total = 0
+    while True:
+        count = runner(_do_batch, retries=retries, site_names=site_names)
+        if not count:
+            break
+        total += count
+    return total
@@ -0,0 +1,472 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import math
+
+from BTrees.Length import Length
+
+from BTrees.OOBTree import OOBTree
+
+from persistent import Persistent
+
+from pyramid.threadlocal import get_current_request
+
+from zope import component
+from zope import interface
+
+from zope.container.contained import Contained
+
+from nti.app.contenttypes.completion.interfaces import IVersionedItemProvider
+from nti.app.contenttypes.completion.interfaces import ICompletionContextProgressCache
+from nti.app.contenttypes.completion.interfaces import ICompletionContextRequiredState
+from nti.app.contenttypes.completion.interfaces import ICompletionContextProgressAggregate
+
+from nti.app.contenttypes.completion.utils import get_annotation
+from nti.app.contenttypes.completion.utils import query_annotation
+
+from nti.contenttypes.completion.interfaces import ICompletionContext
+from nti.contenttypes.completion.interfaces import ICompletedItemProvider
+from nti.contenttypes.completion.interfaces import ICompletableItemContainer
+from nti.contenttypes.completion.interfaces import ICompletionContextCompletionPolicy
+from nti.contenttypes.completion.interfaces import IRequiredCompletableItemProvider
+from nti.contenttypes.completion.interfaces import ICompletableItemDefaultRequiredPolicy
+from nti.contenttypes.completion.interfaces import IPrincipalAwardedCompletedItemContainer
+
+PROGRESS_CACHE_KEY = u'nti.app.contenttypes.completion.cache.CompletionContextProgressCache'
+PROGRESS_AGGREGATE_KEY = u'nti.app.contenttypes.completion.cache.CompletionContextProgressAggregate'
+REQUIRED_STATE_KEY = u'nti.app.contenttypes.completion.cache.CompletionContextRequiredState'
+
+#: The request attribute holding request scoped progress snapshots
+REQUEST_SNAPSHOTS_ATTR = '_nti_completion_progress_snapshots'
+
+#: The request attribute holding request scoped required state maps
+REQUEST_REQUIRED_STATES_ATTR = '_nti_completion_required_states'
+
+#: Accumulated percentages are kept as integers for conflict-free counters
+_PERCENTAGE_SCALE = 1000000
+
+logger = __import__('logging').getLogger(__name__)
+
+
+@interface.implementer(ICompletionContextProgressCache)
+class CompletionContextProgressCache(Persistent, Contained):
+
+    #: The (version, required ntiids) shared by the snapshots; a valid
+    #: user token implies the current requirements, so these are the
+    #: requirements of every valid snapshot.
+    _required = None
+
+    def __init__(self):
+        self._version = Length()
+        self._snapshots = OOBTree()
+
+    @property
+    def version(self):
+        return self._version()
+
+    def _required_ntiids(self):
+        required = self._required
+        if required is not None and required[0] == self.version:
+            return required[1]
+        return None
+
+    def get_snapshot(self, username, token=None):
+        snapshot = self._snapshots.get(username)
+        if     snapshot is None \
+            or snapshot.get('version') != self.version \
+            or snapshot.get('token') != token:
+            return None
+        snapshot = dict(snapshot)
+        completed = snapshot.pop('CompletedItemNTIIDs', None)
+        if completed is not None:
+            required = self._required_ntiids()
+            if required is None:
+                return None
+            snapshot['IncompleteItemNTIIDs'] = tuple(required - set(completed))
+        return snapshot
+
+    def set_snapshot(self, username, snapshot, token=None, required_ntiids=None):
+        snapshot = dict(snapshot)
+        snapshot['version'] = self.version
+        snapshot['token'] = token
+        if required_ntiids is not None:
+            # Only store what the user completed; the (shared) required
+            # ntiids are stored once.
+            required_ntiids = frozenset(required_ntiids)
+            if self._required_ntiids() != required_ntiids:
+                self._required = (self.version, required_ntiids)
+            incomplete = snapshot.pop('IncompleteItemNTIIDs', ())
+            snapshot['CompletedItemNTIIDs'] = tuple(required_ntiids - set(incomplete))
+        self._snapshots[username] = snapshot
+
+    def invalidate(self, username=None):
+        if username is None:
+            # Lazily drop stale snapshots; bumping is enough to ignore them
+            self._version.change(1)
+        else:
+            self._snapshots.pop(username, None)
+
+    def __len__(self):
+        return len(self._snapshots)
+
+
+def is_read_only_request(request=None):
+    """
+    Return whether we are serving a request that must not write, in which
+    case derived data is only cached for the duration of the request.
+    """
+    request = get_current_request() if request is None else request
+    return request is not None and request.method in ('GET', 'HEAD')
+
+
+def get_request_snapshots(request=None, create=True):
+    """
+    Return the request scoped map of (context, username) to progress
+    snapshots, if there is a request.
+    """
+    request = get_current_request() if request is None else request
+    if request is None:
+        return None
+    result = getattr(request, REQUEST_SNAPSHOTS_ATTR, None)
+    if result is None and create:
+        result = {}
+        setattr(request, REQUEST_SNAPSHOTS_ATTR, result)
+    return result
+
+
+def invalidate_request_snapshots(context, username=None):
+    snapshots = get_request_snapshots(create=False)
+    for key in list(snapshots or ()):
+        if key[0] == id(context) and (username is None or key[1] == username):
+            del snapshots[key]
+
+
+def progress_contribution(progress):
+    """
+    Return the (percentage, started, completed, success) contribution of the
+    given :class:`ICompletionContextProgress` to the cohort counters.
+    """
+    try:
+        percentage = float(progress.AbsoluteProgress) / float(progress.MaxPossibleProgress)
+    except (TypeError, ZeroDivisionError, AttributeError):
+        percentage = 0.0
+    return (percentage,
+            bool(getattr(progress, 'AbsoluteProgress', 0)),
+            bool(getattr(progress, 'Completed', False)),
+            bool(getattr(getattr(progress, 'CompletedItem', None), 'Success', False)))
+
+
+@interface.implementer(ICompletionContextProgressAggregate)
+class CompletionContextProgressAggregate(Persistent, Contained):
+
+    version = None
+
+    def __init__(self):
+        self.reset(None)
+
+    def reset(self, version):
+        self.version = version
+        self._contributions = OOBTree()
+        self._total = Length()
+        self._started = Length()
+        self._completed = Length()
+        self._success = Length()
+        self._accumulated = Length()
+        # percent (0-100) -> Length
+        self._distribution = OOBTree()
+
+    @property
+    def TotalUsers(self):
+        return self._total()
+
+    @property
+    def CountHasProgress(self):
+        return self._started()
+
+    @property
+    def CountCompleted(self):
+        return self._completed()
+
+    @property
+    def CountSuccess(self):
+        return self._success()
+
+    def _apply(self, contribution, sign):
+        percentage, started, completed, success = contribution
+        self._accumulated.change(sign * int(round(percentage * _PERCENTAGE_SCALE)))
+        for flag, counter in ((started, self._started),
+                              (completed, self._completed),
+                              (success, self._success)):
+            if flag:
+                counter.change(sign)
+        percent = min(100, int(math.floor(percentage * 100)))
+        counter = self._distribution.get(percent)
+        if counter is None:
+            counter = self._distribution[percent] = Length()
+        counter.change(sign)
+
+    def update(self, username, contribution):
+        contribution = tuple(contribution)
+        old = self._contributions.get(username)
+        if old == contribution:
+            return
+        if old is None:
+            self._total.change(1)
+        else:
+            self._apply(old, -1)
+        self._apply(contribution, 1)
+        self._contributions[username] = contribution
+
+    def remove(self, username):
+        old = self._contributions.pop(username, None)
+        if old is not None:
+            self._total.change(-1)
+            self._apply(old, -1)
+
+    def usernames(self):
+        return self._contributions.keys()
+
+    def accumulated_progress(self):
+        return self._accumulated() / _PERCENTAGE_SCALE
+
+    def distribution(self, bucket_size):
+        result = {}
+        for lower in range(0, 101, bucket_size):
+            result[lower / 100.0] = 0
+        for percent, counter in self._distribution.items():
+            lower = bucket_size * int(math.floor(percent / bucket_size))
+            result[lower / 100.0] += counter()
+        return result
+
+    def __contains__(self, username):
+        return username in self._contributions
+
+    def __len__(self):
+        return len(self._contributions)
+
+
+@interface.implementer(ICompletionContextRequiredState)
+class CompletionContextRequiredState(Persistent, Contained):
+
+    #: The modification token of the sources the map was built from
+    token = None
+
+    def __init__(self):
+        self._version = Length()
+        self.explicit = {}
+        self.default_mime_types = frozenset()
+
+    @property
+    def version(self):
+        return self._version()
+
+    def reset(self, explicit, default_mime_types, token=None):
+        # A single (small) pickle, so reading the map is one load
+        self.explicit = dict(explicit)
+        self.default_mime_types = frozenset(default_mime_types or ())
+        self.token = token
+        self._version.change(1)
+
+    def get_state(self, item):
+        default_required = getattr(item, 'mime_type', '') in self.default_mime_types
+        required = self.explicit.get(getattr(item, 'ntiid', None))
+        if required is None:
+            return default_required, default_required, True
+        return required, default_required, False
+
+    def is_item_required(self, item):
+        return self.get_state(item)[0]
+
+    def is_default_state(self, ntiid):
+        return ntiid not in self.explicit
+
+
+def _required_state_sources(context):
+    return (ICompletableItemContainer(context, None),
+            ICompletableItemDefaultRequiredPolicy(context, None))
+
+
+def _required_state_token(container, policy):
+    """
+    The modification times of the sources of the required state; changes
+    that bypass the requirements modified event are caught by these.
+    """
+    return (getattr(container, 'lastModified', None),
+            getattr(policy, 'lastModified', None))
+
+
+def rebuild_required_state(context, state, sources=None):
+    """
+    Rebuild the given :class:`ICompletionContextRequiredState` from the
+    requirements of the context.
+    """
+    container, policy = _required_state_sources(context) if sources is None else sources
+    explicit = {}
+    if container is not None:
+        explicit.update((x, False) for x in container.get_optional_keys())
+        # Required wins
+        explicit.update((x, True) for x in container.get_required_keys())
+    state.reset(explicit,
+                getattr(policy, 'mime_types', None),
+                _required_state_token(container, policy))
+    return state
+
+
+def _get_request_required_state(context, token, sources, request=None):
+    """
+    Return a volatile required state of the context, built at most once
+    per request for the given token.
+    """
+    request = get_current_request() if request is None else request
+    states = getattr(request, REQUEST_REQUIRED_STATES_ATTR, None)
+    if states is None:
+        states = {}
+        if request is not None:
+            setattr(request, REQUEST_REQUIRED_STATES_ATTR, states)
+    state = states.get(id(context))
+    if state is None or state.token != token:
+        state = states[id(context)] = \
+            rebuild_required_state(context, CompletionContextRequiredState(), sources)
+    return state
+
+
+def get_required_state(context):
+    """
+    Return the current :class:`ICompletionContextRequiredState` of the
+    context. The stored map is only rebuilt when requirements are modified
+    or on write requests; read-only requests use a request scoped map
+    when the stored one is missing or stale.
+    """
+    sources = _required_state_sources(context)
+    token = _required_state_token(*sources)
+    if is_read_only_request():
+        state = query_required_state(context)
+    else:
+        state = ICompletionContextRequiredState(context, None)
+        if state is not None and (not state.version or state.token != token):
+            rebuild_required_state(context, state, sources)
+    if state is None or not state.version or state.token != token:
+        # Not annotatable, or not to be written
+        state = _get_request_required_state(context, token, sources)
+    return state
+
+
+def get_requirements_version(context):
+    """
+    Return a cheap token that changes whenever the requirements of the
+    context (required items, default required mime types, policy) do.
+    """
+    state = get_required_state(context)
+    cache = query_progress_cache(context)
+    policy = ICompletionContextCompletionPolicy(context, None)
+    return (state.version,
+            state.token,
+            getattr(cache, 'version', None),
+            getattr(policy, 'lastModified', None))
+
+
+def get_requirements_token(context):
+    """
+    Return a token of the requirements of the context, independent of the
+    progress cache version.
+    """
+    state = get_required_state(context)
+    policy = ICompletionContextCompletionPolicy(context, None)
+    return (state.version,
+            state.token,
+            getattr(policy, 'lastModified', None))
+
+
+def get_provider_versions(providers):
+    """
+    Return the versions of the given item providers, or None if any of
+    them cannot be versioned.
+    """
+    result = []
+    for provider in providers:
+        provider = getattr(provider, 'provider', provider)
+        if not IVersionedItemProvider.providedBy(provider):
+            return None
+        result.append(provider.version)
+    return tuple(result)
+
+
+def get_required_items_version(user, context):
+    """
+    Return a cheap token that changes whenever the required items of the
+    user in the context may have, or None if there is no such token.
+    """
+    providers = component.subscribers((context,),
+                                      IRequiredCompletableItemProvider)
+    versions = get_provider_versions(providers)
+    if versions is None:
+        return None
+    return (getattr(user, 'username', None), versions) \
+        + get_requirements_version(context)
+
+
+def get_progress_version(user, context):
+    """
+    Return a cheap token that changes whenever the progress of the user
+    in the context may have, or None if some item provider cannot be
+    versioned; no progress is computed.
+    """
+    required = get_required_items_version(user, context)
+    if required is None:
+        return None
+    providers = component.subscribers((user, context), ICompletedItemProvider)
+    completed = get_provider_versions(providers)
+    if completed is None:
+        return None
+    awarded = component.queryMultiAdapter((user, context),
+                                          IPrincipalAwardedCompletedItemContainer)
+    return (completed, getattr(awarded, 'lastModified', None)) + required
+
+
+def query_progress_cache(context):
+    """
+    Return the progress cache of the context without creating it.
+    """
+    return query_annotation(context, PROGRESS_CACHE_KEY)
+
+
+def query_required_state(context):
+    """
+    Return the required state map of the context without creating it.
+    """
+    return query_annotation(context, REQUIRED_STATE_KEY)
+
+
+def query_progress_aggregate(context):
+    """
+    Return the progress aggregate of the context without creating it.
+    """
+    return query_annotation(context, PROGRESS_AGGREGATE_KEY)
+
+
+@component.adapter(ICompletionContext)
+@interface.implementer(ICompletionContextProgressCache)
+def _context_to_progress_cache(context):
+    return get_annotation(context, PROGRESS_CACHE_KEY,
+                           CompletionContextProgressCache)
+
+
+@component.adapter(ICompletionContext)
+@interface.implementer(ICompletionContextProgressAggregate)
+def _context_to_progress_aggregate(context):
+    return get_annotation(context, PROGRESS_AGGREGATE_KEY,
+                           CompletionContextProgressAggregate)
+
+
+@component.adapter(ICompletionContext)
+@interface.implementer(ICompletionContextRequiredState)
+def _context_to_required_state(context):
+    return get_annotation(context, REQUIRED_STATE_KEY,
+                           CompletionContextRequiredState)
@@ -8,33 +8,232 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import absolute_import
 
+import time
+
+import BTrees
+
+from BTrees import LLBTree
+
+from BTrees.LLBTree import LLTreeSet
+
+from BTrees.Length import Length
+
+from BTrees.OOBTree import OOBTree
+
 from ZODB.POSException import POSError
 
+from persistent import Persistent
+
+import transaction
+
 from zope import component
 
+from zope.annotation.interfaces import IAnnotations
+
 from zope.component.hooks import site as current_site
 
+from zope.container.contained import Contained
+
 from zope.intid.interfaces import IIntIds
 
+from zope.location.location import locate
+
+from nti.app.contenttypes.completion.adapters import get_context_catalog_values
+
+from nti.app.contenttypes.completion.registry import GLOBAL_SITE
+
+from nti.app.contenttypes.completion.registry import query_context_registry
+from nti.app.contenttypes.completion.registry import iter_registered_completion_contexts
+
+from nti.app.contenttypes.completion.utils import query_annotation
+from nti.app.contenttypes.completion.utils import get_dataserver_folder
+
 from nti.dataserver.metadata.index import get_metadata_catalog
 
+from nti.contenttypes.completion.completion import AwardedCompletedItem
+
+from nti.contenttypes.completion.index import IX_SITE
+from nti.contenttypes.completion.index import IX_ITEMS
+from nti.contenttypes.completion.index import IX_CONTEXT
+from nti.contenttypes.completion.index import IX_PRINCIPAL
+
 from nti.contenttypes.completion.index import get_completed_item_catalog
+from nti.contenttypes.completion.index import create_completed_item_catalog
 
 from nti.contenttypes.completion.interfaces import get_completables
 from nti.contenttypes.completion.interfaces import ICompletionContext
 from nti.contenttypes.completion.interfaces import ICompletedItemContainer
 
+from nti.externalization.interfaces import StandardExternalFields
+
+from nti.ntiids.ntiids import find_object_with_ntiid
+
+from nti.ntiids.oids import to_external_ntiid_oid
+
 from nti.site.hostpolicy import get_all_host_sites
 
+from nti.site.site import get_component_hierarchy_names
+
+ITEM_COUNT = StandardExternalFields.ITEM_COUNT
+
+#: Savepoint after indexing this many items to bound memory
+SAVEPOINT_SIZE = 1000
+
+REBUILD_KEY = u'nti.app.contenttypes.completion.catalog.CompletedItemsCatalogRebuild'
+
 logger = __import__('logging').getLogger(__name__)
 
 
-def get_completion_contexts():
+def _scan_completion_contexts():
     for obj in get_completables():
         if ICompletionContext.providedBy(obj):
             yield obj
 
 
+def get_completion_contexts(sites=None):
+    """
+    Return the completion contexts of the given host site names or, by
+    default, of the current site hierarchy, including those outside of
+    any host site. Registered contexts are a direct lookup; without an
+    installed registry every completable is scanned.
+    """
+    registry = query_context_registry()
+    if registry is None:
+        return _scan_completion_contexts()
+    if sites is None:
+        sites = set(get_component_hierarchy_names())
+        sites.add(GLOBAL_SITE)
+    return iter_registered_completion_contexts(sites, registry)
+
+
+def get_host_site_completion_contexts(sites=(), intids=None):
+    """
+    Return a map of doc id to the completion contexts of the given (or
+    all) host sites; contexts visible in many sites appear once.
+    """
+    result = {}
+    intids = component.getUtility(IIntIds) if intids is None else intids
+    registry = query_context_registry()
+    if registry is not None:
+        sites = set(sites) | {GLOBAL_SITE} if sites else None
+        for context in iter_registered_completion_contexts(sites, registry, intids):
+            result[intids.getId(context)] = context
+        return result
+    for host_site in get_all_host_sites():
+        if sites and host_site.__name__ not in sites:
+            continue
+        with current_site(host_site):
+            for context in get_completion_contexts():
+                doc_id = intids.queryId(context)
+                if doc_id is not None and doc_id not in result:
+                    result[doc_id] = context
+    return result
+
+
+def iter_host_site_context_documents(sites=(), after=None, intids=None):
+    """
+    Return an iterator of the sorted doc ids of the completion contexts of
+    the given (or all) host sites after the given doc id. With a context
+    registry no context is loaded.
+    """
+    registry = query_context_registry()
+    if registry is not None:
+        sites = set(sites) | {GLOBAL_SITE} if sites else None
+        return registry.iter_documents(sites, after)
+    contexts = get_host_site_completion_contexts(sites, intids)
+    return iter([x for x in sorted(contexts) if after is None or x > after])
+
+
+def get_index_family(catalog=None, name=IX_PRINCIPAL):
+    """
+    Return the BTrees family the documents of the completed item catalog
+    indexes are stored with.
+    """
+    catalog = get_completed_item_catalog() if catalog is None else catalog
+    return getattr(catalog[name], 'family', BTrees.family64)
+
+
+def get_indexed_documents(users=(), items=(), sites=(), contexts=(), catalog=None):
+    """
+    Return the doc ids of the completed items matching all the given
+    criteria, straight from the index value sets.
+    """
+    result = None
+    catalog = get_completed_item_catalog() if catalog is None else catalog
+    IF = get_index_family(catalog).IF
+    for name, values in ((IX_PRINCIPAL, users),
+                         (IX_ITEMS, items),
+                         (IX_SITE, sites),
+                         (IX_CONTEXT, contexts)):
+        if not values:
+            continue
+        values_to_documents = catalog[name].values_to_documents
+        docs = [values_to_documents.get(x) for x in values]
+        docs = IF.multiunion([x for x in docs if x])
+        result = docs if result is None else IF.intersection(result, docs)
+    return IF.TreeSet() if result is None else result
+
+
+def get_indexed_context_ntiids(users=(), items=(), sites=(), catalog=None):
+    """
+    Return a map of the distinct completion context ntiids of the
+    completed items matching the given criteria to one of their doc ids.
+    No completed items are loaded.
+    """
+    result = {}
+    catalog = get_completed_item_catalog() if catalog is None else catalog
+    documents_to_values = catalog[IX_CONTEXT].documents_to_values
+    for doc_id in get_indexed_documents(users, items, sites, catalog=catalog):
+        ntiid = documents_to_values.get(doc_id)
+        if ntiid and ntiid not in result:
+            result[ntiid] = doc_id
+    return result
+
+
+def get_indexed_completion_contexts(users=(), items=(), sites=(), catalog=None, intids=None):
+    """
+    Return the :class:`ICompletionContext` objects with completed items
+    matching the given criteria. Contexts are looked up by ntiid; only
+    when that fails do we load a single completed item of the context.
+    """
+    result = set()
+    intids = component.getUtility(IIntIds) if intids is None else intids
+    ntiids = get_indexed_context_ntiids(users, items, sites, catalog)
+    for ntiid, doc_id in ntiids.items():
+        context = find_object_with_ntiid(ntiid)
+        if not ICompletionContext.providedBy(context):
+            item = intids.queryObject(doc_id)
+            context = ICompletionContext(item, None)
+        if context is not None:
+            result.add(context)
+    return result
+
+
+def get_context_principal_counts(context, catalog=None, metadata_catalog=None):
+    """
+    Return a map of username to the number of indexed (principal)
+    completed items of the context, from the indexes alone; no user
+    container or completed item is loaded. Awarded items are excluded,
+    as by the cohort progress engine.
+    """
+    result = {}
+    catalog = get_completed_item_catalog() if catalog is None else catalog
+    docs = get_context_completed_item_documents(context, catalog, metadata_catalog)
+    documents_to_values = catalog[IX_PRINCIPAL].documents_to_values
+    for doc_id in docs:
+        username = documents_to_values.get(doc_id)
+        if username is not None:
+            result[username] = result.get(username, 0) + 1
+    return result
+
+
+def get_context_principals(context, catalog=None):
+    """
+    Return the sorted usernames with indexed completed items in the context.
+    """
+    return sorted(get_context_principal_counts(context, catalog))
+
+
 def get_completed_items(context):
     # pylint: disable=too-many-function-args
     container = ICompletedItemContainer(context)
@@ -43,14 +242,258 @@ def get_completed_items(context):
             yield value
 
 
+def get_awarded_item_documents(metadata_catalog=None, family=None):
+    """
+    Return the doc ids of all awarded completed items, from their mime
+    type in the metadata catalog. This is used as an exclusion, so items
+    missing from the metadata catalog are still counted.
+    """
+    family = BTrees.family64 if family is None else family
+    catalog = get_metadata_catalog() if metadata_catalog is None else metadata_catalog
+    index = catalog.get('mimeType') if catalog is not None else None
+    if index is None:
+        return family.IF.TreeSet()
+    return index.apply({'any_of': (AwardedCompletedItem.mimeType,)}) \
+        or family.IF.TreeSet()
+
+
+def get_context_completed_item_documents(context, catalog=None, metadata_catalog=None):
+    """
+    Return the doc ids of the (principal) completed items of the context,
+    straight from the context index value set. Awarded items are indexed
+    by context as well and are excluded.
+    """
+    catalog = get_completed_item_catalog() if catalog is None else catalog
+    family = get_index_family(catalog)
+    ntiid = getattr(context, 'ntiid', None) or to_external_ntiid_oid(context)
+    docs = catalog[IX_CONTEXT].values_to_documents.get(ntiid)
+    if not docs:
+        return family.IF.TreeSet()
+    awarded = get_awarded_item_documents(metadata_catalog, family)
+    return family.IF.difference(docs, awarded) if awarded else family.IF.TreeSet(docs)
+
+
+def reset_context_completed_items(context, catalog=None, metadata=True, intids=None):
+    """
+    Drop all completed items of the context in one operation: the doc ids
+    come from the context index and are unindexed directly, then the
+    :class:`ICompletedItemContainer` annotation of the context is deleted.
+    No removal events are fired, so callers must invalidate any derived
+    state. Returns the number of unindexed items, or None if the container
+    is not an annotation of the context.
+    """
+    container = ICompletedItemContainer(context, None)
+    annotations = IAnnotations(context, None)
+    if container is None or annotations is None:
+        return None
+    for key in list(annotations):
+        if annotations.get(key) is container:
+            break
+    else:
+        return None
+    catalog = get_completed_item_catalog() if catalog is None else catalog
+    metadata_catalog = get_metadata_catalog() if metadata else None
+    intids = component.getUtility(IIntIds) if intids is None else intids
+    docs = get_context_completed_item_documents(context, catalog, metadata_catalog)
+    count = 0
+    for doc_id in list(docs):
+        catalog.unindex_doc(doc_id)
+        if metadata_catalog is not None:
+            metadata_catalog.unindex_doc(doc_id)
+        item = intids.queryObject(doc_id)
+        if item is not None:
+            intids.unregister(item, event=False)
+        count += 1
+        if count % SAVEPOINT_SIZE == 0:
+            transaction.savepoint(optimistic=True)
+    # The user containers may be registered as well
+    for user_container in list(container.values()):  # by definition
+        if intids.queryId(user_container) is not None:
+            intids.unregister(user_container, event=False)
+    del annotations[key]
+    logger.info("Dropped %s completed item(s) of %s", count, context)
+    return count
+
+
+class BulkIndexer(object):
+    """
+    Indexes batches of completed items into a (shadow) catalog and the
+    metadata catalog. Each batch is indexed one index at a time in doc id
+    order, which keeps the index BTree buckets being written hot. Values
+    shared by all the items of a context (see
+    :func:`get_context_catalog_values`) are given per index name rather
+    than adapted for every item.
+    """
+
+    def __init__(self, catalog, metadata_catalog=None, batch_size=SAVEPOINT_SIZE):
+        self.catalog = catalog
+        self.metadata_catalog = metadata_catalog
+        self.batch_size = batch_size
+        self.count = 0
+        self._pending = []
+
+    @property
+    def indexes(self):
+        # Either a catalog or a :class:`ShadowCatalog`
+        return getattr(self.catalog, 'indexes', self.catalog)
+
+    def add(self, doc_id, item, values=None):
+        self._pending.append((doc_id, item, values or {}))
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+            transaction.savepoint(optimistic=True)
+
+    def _index(self, index, doc_id, obj, failed):
+        if doc_id in failed:
+            return
+        try:
+            index.index_doc(doc_id, obj)
+        except POSError:
+            logger.error("Error while indexing object %s/%s",
+                         doc_id, type(obj))
+            failed.add(doc_id)
+
+    def flush(self):
+        pending = sorted(self._pending, key=lambda x: x[0])
+        self._pending = []
+        failed = set()
+        for name, index in list(self.indexes.items()):
+            for doc_id, item, values in pending:
+                self._index(index, doc_id, values.get(name, item), failed)
+        if self.metadata_catalog is not None:
+            for doc_id, item, _ in pending:
+                self._index(self.metadata_catalog, doc_id, item, failed)
+        result = len(pending) - len(failed)
+        self.count += result
+        return result
+
+
+def get_context_index_values(context):
+    """
+    Return a map of index name to the value all completed items of the
+    context are indexed with.
+    """
+    ntiid, site = get_context_catalog_values(context)
+    result = {}
+    if ntiid is not None:
+        result[IX_CONTEXT] = ntiid
+    if site is not None:
+        result[IX_SITE] = site
+    return result
+
+
+def _index_context_items(context, catalog, metadata_catalog, intids, seen=None):
+    """
+    Index all completed items of the given context, returning the count.
+    """
+    indexer = BulkIndexer(catalog, metadata_catalog)
+    values = get_context_index_values(context)
+    for item in get_completed_items(context):
+        doc_id = intids.queryId(item)
+        if doc_id is None or (seen is not None and doc_id in seen):
+            continue
+        if seen is not None:
+            seen.add(doc_id)
+        indexer.add(doc_id, item, values)
+    indexer.flush()
+    return indexer.count
+
+
+# shadow indexes
+
+
+def create_shadow_indexes(catalog):
+    """
+    Return a map of name to a new, empty index for every index of the
+    given catalog, built by the same factories that install the catalog
+    (some indexes are normalization wrappers that cannot be cloned from
+    their type). Indexes we know nothing about are left out, and thus
+    stay live.
+    """
+    fresh = create_completed_item_catalog(family=get_index_family(catalog))
+    result = OOBTree()
+    for name in catalog:
+        index = fresh.get(name)
+        if index is None:
+            logger.warning("Cannot rebuild unknown index %s", name)
+            continue
+        index.__parent__ = None
+        result[name] = index
+    return result
+
+
+class ShadowCatalog(object):
+    """
+    Indexes documents into a map of shadow indexes, as the catalog they
+    were created from would.
+    """
+
+    def __init__(self, indexes):
+        self.indexes = indexes
+
+    def index_doc(self, doc_id, obj):
+        for index in self.indexes.values():
+            index.index_doc(doc_id, obj)
+
+    def unindex_doc(self, doc_id):
+        for index in self.indexes.values():
+            index.unindex_doc(doc_id)
+
+
+def _indexed_ids(indexes):
+    result = LLTreeSet()
+    for index in indexes:
+        ids = getattr(index, 'ids', None)
+        if ids is not None:
+            result.update(ids())
+    return result
+
+
+def swap_catalog_indexes(catalog, indexes, intids=None, modified=()):
+    """
+    Replace the indexes of the live catalog with the given shadow indexes.
+    Documents (un)indexed in the live catalog while the shadow indexes were
+    being built, and the `modified` doc ids reindexed meanwhile, are
+    reconciled first. Concurrent readers see either the old or the new
+    indexes as this happens in a single transaction.
+    """
+    intids = component.getUtility(IIntIds) if intids is None else intids
+    shadow = ShadowCatalog(indexes)
+    for doc_id in modified or ():
+        obj = intids.queryObject(doc_id)
+        if obj is not None:
+            shadow.index_doc(doc_id, obj)
+    live_ids = _indexed_ids(catalog.values())
+    shadow_ids = _indexed_ids(indexes.values())
+    for doc_id in LLBTree.difference(live_ids, shadow_ids):
+        obj = intids.queryObject(doc_id)
+        if obj is not None:
+            shadow.index_doc(doc_id, obj)
+    for doc_id in LLBTree.difference(shadow_ids, live_ids):
+        if intids.queryObject(doc_id) is None:
+            shadow.unindex_doc(doc_id)
+    for name, new_index in list(indexes.items()):
+        old_index = catalog.get(name)
+        if old_index is not None:
+            if intids.queryId(old_index) is not None:
+                intids.unregister(old_index)
+            del catalog[name]
+        locate(new_index, catalog, name)
+        catalog[name] = new_index
+        if intids.queryId(new_index) is None:
+            intids.register(new_index)
+
+
 def rebuild_completed_items_catalog(seen=None, metadata=True):
     catalog = get_completed_item_catalog()
-    for index in catalog.values():
-        index.clear()
+    indexes = create_shadow_indexes(catalog)
+    shadow = ShadowCatalog(indexes)
     # reindex
     items = dict()
-    seen = set() if seen is None else seen
-    metadata_catalog = get_metadata_catalog()
+    # The doc ids of all contexts and items visited; a compact integer
+    # set rather than a python set of (tens of millions of) ints
+    seen = LLTreeSet() if seen is None else seen
+    metadata_catalog = get_metadata_catalog() if metadata else None
     intids = component.getUtility(IIntIds)
     for host_site in get_all_host_sites():  # check all sites
         with current_site(host_site):
@@ -60,21 +503,159 @@ def rebuild_completed_items_catalog(seen=None, metadata=True):
                 if doc_id is None or doc_id in seen:
                     continue
                 seen.add(doc_id)
-                for item in get_completed_items(context):
-                    doc_id = intids.queryId(item)
-                    if doc_id is None or doc_id in seen:
-                        continue
-                    try:
-                        seen.add(doc_id)
-                        catalog.index_doc(doc_id, item)
-                        if metadata:
-                            metadata_catalog.index_doc(doc_id, item)
-                    except POSError:
-                        logger.error("Error while indexing object %s/%s",
-                                     doc_id, type(item))
-                    else:
-                        count += 1
+                count += _index_context_items(context, shadow, metadata_catalog,
+                                              intids, seen)
             logger.info("%s object(s) indexed in site %s",
                         count, host_site.__name__)
             items[host_site.__name__] = count
+    swap_catalog_indexes(catalog, indexes, intids)
     return items
+
+
+# resumable rebuild
+
+
+class _SiteCatalogRebuild(Persistent):
+    """
+    The checkpoint of a single site.
+    """
+
+    complete = False
+
+    def __init__(self):
+        self.count = Length()
+
+
+class CompletedItemsCatalogRebuild(Persistent, Contained):
+    """
+    A persistent, resumable rebuild of the completed items catalog. Items
+    are indexed into shadow indexes that replace the live ones once the
+    rebuild finishes; until then the live catalog is left intact.
+
+    Chunks must be processed one at a time: they all write the same
+    shadow index trees, which concurrent transactions cannot merge.
+    Every chunk bumps `chunks` so that a concurrent chunk conflicts (and
+    is retried after this one commits) rather than corrupting them.
+    """
+
+    finished = None
+
+    #: The number of chunks processed; deliberately not a conflict
+    #: resolving counter
+    chunks = 0
+
+    def __init__(self, indexes, metadata=True):
+        self.indexes = indexes
+        self.metadata = metadata
+        self.started = time.time()
+        self._sites = OOBTree()
+        # The doc ids of the completion contexts already indexed, since
+        # contexts may be visible in many sites.
+        self.contexts = LLTreeSet()
+        # The doc ids reindexed in the live catalog during the rebuild
+        self.modified = LLTreeSet()
+
+    def get_site(self, name):
+        result = self._sites.get(name)
+        if result is None:
+            result = self._sites[name] = _SiteCatalogRebuild()
+        return result
+
+    def query_site(self, name):
+        return self._sites.get(name)
+
+    @property
+    def complete(self):
+        return self.finished is not None
+
+    def record_modified(self, doc_id):
+        if not self.complete:
+            self.modified.add(doc_id)
+
+    @property
+    def count(self):
+        return sum(x.count() for x in self._sites.values())
+
+    def status(self):
+        result = {}
+        for name, state in self._sites.items():
+            result[name] = {'Complete': state.complete,
+                            ITEM_COUNT: state.count()}
+        return result
+
+
+def get_catalog_rebuild(folder):
+    """
+    Return the current :class:`CompletedItemsCatalogRebuild` stored in
+    the given dataserver folder, if any.
+    """
+    return query_annotation(folder, REBUILD_KEY)
+
+
+def query_catalog_rebuild():
+    """
+    Return the unfinished :class:`CompletedItemsCatalogRebuild`, if any.
+    """
+    result = get_catalog_rebuild(get_dataserver_folder())
+    return result if result is not None and not result.complete else None
+
+
+def start_catalog_rebuild(folder, metadata=True):
+    """
+    Record a new resumable rebuild of the completed item catalog.
+    """
+    catalog = get_completed_item_catalog()
+    result = CompletedItemsCatalogRebuild(create_shadow_indexes(catalog),
+                                          metadata)
+    annotations = IAnnotations(folder)
+    annotations[REBUILD_KEY] = result
+    result.__name__ = REBUILD_KEY
+    result.__parent__ = folder
+    return result
+
+
+def process_catalog_rebuild(rebuild, sites=(), max_contexts=None):
+    """
+    Index up to `max_contexts` completion contexts of the given (or all)
+    sites, checkpointing every context in the rebuild. Returns the number
+    of contexts processed; the rebuild is marked finished once every host
+    site is complete, at which point the shadow indexes are swapped in.
+    Chunks of a rebuild are serialized (see
+    :class:`CompletedItemsCatalogRebuild`).
+    """
+    rebuild.chunks += 1
+    catalog = get_completed_item_catalog()
+    shadow = ShadowCatalog(rebuild.indexes)
+    metadata_catalog = get_metadata_catalog() if rebuild.metadata else None
+    intids = component.getUtility(IIntIds)
+    processed = 0
+    host_sites = get_all_host_sites()
+    for host_site in host_sites:
+        name = host_site.__name__
+        if sites and name not in sites:
+            continue
+        state = rebuild.get_site(name)
+        if state.complete:
+            continue
+        with current_site(host_site):
+            for context in get_completion_contexts():
+                doc_id = intids.queryId(context)
+                if doc_id is None or doc_id in rebuild.contexts:
+                    continue
+                if max_contexts is not None and processed >= max_contexts:
+                    return processed
+                count = _index_context_items(context, shadow, metadata_catalog,
+                                             intids)
+                state.count.change(count)
+                rebuild.contexts.add(doc_id)
+                processed += 1
+        state.complete = True
+        logger.info("%s object(s) indexed in site %s",
+                    state.count(), name)
+    if all(getattr(rebuild.query_site(x.__name__), 'complete', False) for x in host_sites):
+        swap_catalog_indexes(catalog, rebuild.indexes, intids,
+                             rebuild.modified)
+        rebuild.indexes = None
+        rebuild.modified.clear()
+        rebuild.finished = time.time()
+    return processed
@@ -0,0 +1,355 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+A persistent queue of the completed item cleanups triggered by deletions.
+
+Removing the completed items of a deleted user or completable item may
+touch many containers; rather than doing so in the deleting transaction
+we queue the work and drain it in small, independently retried
+transactions, either through the `CompletedItemCleanupQueue` admin view
+(e.g. from a cron job) or with :func:`drain_cleanup_queue` from a script.
+
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import time
+
+from itertools import islice
+
+from BTrees.Length import Length
+
+from BTrees.OOBTree import OOBTree
+
+from persistent import Persistent
+
+from zope import component
+
+from zope.component.hooks import site as current_site
+
+from zope.container.contained import Contained
+
+from zope.intid.interfaces import IIntIds
+
+from nti.app.contenttypes.completion.catalog import get_indexed_documents
+from nti.app.contenttypes.completion.catalog import get_indexed_completion_contexts
+
+from nti.app.contenttypes.completion.utils import get_annotation
+from nti.app.contenttypes.completion.utils import query_annotation
+from nti.app.contenttypes.completion.utils import get_dataserver_folder
+
+from nti.contenttypes.completion.index import IX_PRINCIPAL
+
+from nti.contenttypes.completion.index import get_completed_item_catalog
+
+from nti.contenttypes.completion.interfaces import ICompletedItemContainer
+
+from nti.coremetadata.interfaces import IMarkedForDeletion
+
+from nti.dataserver.interfaces import IDataserverTransactionRunner
+
+from nti.dataserver.users.users import User
+
+from nti.site.hostpolicy import get_host_site
+
+#: Remove all completed items of a (deleted) user
+USER_CLEANUP = u'user'
+
+#: Remove all completed items of a (deleted) completable item
+ITEM_CLEANUP = u'item'
+
+DEFAULT_BATCH_SIZE = 100
+
+DEFAULT_RETRIES = 5
+
+CLEANUP_QUEUE_KEY = u'nti.app.contenttypes.completion.cleanup.CompletedItemCleanupQueue'
+
+logger = __import__('logging').getLogger(__name__)
+
+
+class CompletedItemCleanupQueue(Persistent, Contained):
+    """
+    The pending cleanups, keyed by (kind, key, site name) so that queueing
+    the same cleanup twice is a no-op and concurrent deletions only
+    touch distinct BTree keys.
+    """
+
+    def __init__(self):
+        self._entries = OOBTree()
+        self._count = Length()
+
+    def put(self, kind, key, site_name=None):
+        entry = (kind, key, site_name or u'')
+        if entry in self._entries:
+            return False
+        self._entries[entry] = time.time()
+        self._count.change(1)
+        return True
+
+    def remove(self, entry):
+        if self._entries.pop(entry, None) is None:
+            return False
+        self._count.change(-1)
+        return True
+
+    def items(self, limit=None):
+        """
+        Return the (entry, queued time) pairs, oldest keys first.
+        """
+        return islice(self._entries.items(), limit)
+
+    def clear(self):
+        count = len(self)
+        for entry in list(self._entries.keys()):
+            self.remove(entry)
+        return count
+
+    def __contains__(self, entry):
+        return entry in self._entries
+
+    def __len__(self):
+        return self._count()
+
+
+def query_cleanup_queue(folder=None):
+    """
+    Return the :class:`CompletedItemCleanupQueue`, if any.
+    """
+    folder = get_dataserver_folder() if folder is None else folder
+    return query_annotation(folder, CLEANUP_QUEUE_KEY)
+
+
+def get_cleanup_queue(folder=None):
+    """
+    Return the :class:`CompletedItemCleanupQueue`, creating it if needed.
+    """
+    folder = get_dataserver_folder() if folder is None else folder
+    return get_annotation(folder, CLEANUP_QUEUE_KEY, CompletedItemCleanupQueue)
+
+
+class _DeletedItem(object):
+    """
+    Stands in for a deleted :class:`ICompletableItem` when removing its
+    completed items from the context containers.
+    """
+
+    def __init__(self, ntiid):
+        self.ntiid = ntiid
+
+    def __repr__(self):
+        return '<%s %s>' % (self.__class__.__name__, self.ntiid)
+
+
+def _get_containers(contexts):
+    containers = {ICompletedItemContainer(x, None) for x in contexts}
+    containers.discard(None)
+    return containers
+
+
+def user_exists(username, memo=None):
+    """
+    Return whether the user exists, memoized in the given dict since the
+    same usernames recur across many contexts.
+    """
+    if memo is None:
+        return User.get_user(username) is not None
+    try:
+        result = memo[username]
+    except KeyError:
+        result = memo[username] = User.get_user(username) is not None
+    return result
+
+
+def remove_indexed_completed_items(username, sites=()):
+    """
+    Remove the completed items of the given user in the given (or all)
+    sites. Returns the number of affected contexts.
+    """
+    # Find the user's contexts from the index values; this does not
+    # load any of the (potentially many) completed items.
+    contexts = get_indexed_completion_contexts(users=(username,), sites=sites)
+    containers = _get_containers(contexts)
+    for container in containers:
+        container.remove_principal(username)
+    return len(containers)
+
+
+def iter_indexed_ghost_usernames(sites=(), after=None, catalog=None, memo=None):
+    """
+    Yield, in order, the usernames after `after` with indexed completed
+    items (in the given sites) that no longer exist. Usernames come from
+    the principal index values; no completion context is walked.
+    """
+    catalog = get_completed_item_catalog() if catalog is None else catalog
+    values_to_documents = catalog[IX_PRINCIPAL].values_to_documents
+    if after:
+        usernames = values_to_documents.keys(min=after, excludemin=True)
+    else:
+        usernames = values_to_documents.keys()
+    for username in usernames:
+        if user_exists(username, memo):
+            continue
+        if     sites \
+           and not get_indexed_documents(users=(username,), sites=sites,
+                                         catalog=catalog):
+            continue
+        yield username
+
+
+def remove_ghost_user_containers(context, memo=None):
+    """
+    Clear the user containers of the context whose users no longer
+    exist. Returns their usernames.
+    """
+    result = []
+    container = ICompletedItemContainer(context)
+    # pylint: disable=too-many-function-args
+    for username, user_container in list(container.items()):
+        if not user_exists(username, memo):
+            result.append(username)
+            user_container.clear()
+    return result
+
+
+def user_cleanup_key(user):
+    """
+    The cleanup key of a user: the username along with the creation time
+    of the principal, so that a user later created with the same username
+    is told apart from the deleted one.
+    """
+    return (user.username, getattr(user, 'createdTime', None))
+
+
+def remove_indexed_completed_items_before(username, created_before, sites=()):
+    """
+    Remove the completed items of the given username created before the
+    given time, i.e. those of a previous principal with that username.
+    Returns the number of removed items.
+    """
+    intids = component.getUtility(IIntIds)
+    count = 0
+    for doc_id in list(get_indexed_documents(users=(username,), sites=sites)):
+        item = intids.queryObject(doc_id)
+        container = getattr(item, '__parent__', None)
+        created = getattr(item, 'createdTime', None)
+        if container is None or created is None or created >= created_before:
+            continue
+        del container[item.__name__]
+        count += 1
+    return count
+
+
+def cleanup_user(key, unused_site_name=None):
+    """
+    Remove the completed items of the given (deleted) user, identified by
+    its :func:`user_cleanup_key`.
+    """
+    username, created = key if isinstance(key, tuple) else (key, None)
+    user = User.get_user(username)
+    if user is None:
+        logger.info("Removing completed items data for user %s", username)
+        remove_indexed_completed_items(username)
+        return
+    user_created = getattr(user, 'createdTime', None)
+    if created is None or user_created is None or user_created <= created:
+        # Still the principal we were queued for
+        logger.warning("Not removing completed items data for existing user %s",
+                       username)
+        return
+    # The username was reused before we got to it; only drop the items
+    # of the deleted principal
+    count = remove_indexed_completed_items_before(username, user_created)
+    logger.info("Removed %s completed item(s) of deleted user %s",
+                count, username)
+
+
+def cleanup_item(ntiid, site_name=None):
+    """
+    Remove the completed items of the given (deleted) completable item.
+    """
+    logger.info("Removing completed items data for %s", ntiid)
+    sites = (site_name,) if site_name else ()
+    # The distinct contexts come straight from the index values; no
+    # completed items are loaded.
+    contexts = get_indexed_completion_contexts(items=(ntiid,), sites=sites)
+    # We only need to individually remove items if their contexts
+    # are not also being deleted. Deleting the contexts will clean
+    # these containers anyway, much more efficiently.
+    contexts = {x for x in contexts if not IMarkedForDeletion.providedBy(x)}
+    item = _DeletedItem(ntiid)
+    for container in _get_containers(contexts):
+        container.remove_item(item)
+
+
+_HANDLERS = {
+    USER_CLEANUP: cleanup_user,
+    ITEM_CLEANUP: cleanup_item,
+}
+
+
+def _process_entry(entry):
+    kind, key, site_name = entry
+    handler = _HANDLERS.get(kind)
+    if handler is None:
+        logger.warning("Ignoring unknown cleanup %s", entry)
+        return
+    site = get_host_site(site_name, safe=True) if site_name else None
+    if site is None:
+        handler(key, site_name)
+    else:
+        with current_site(site):
+            handler(key, site_name)
+
+
+def queue_cleanup(kind, key, site_name=None):
+    """
+    Queue a cleanup; without a queue (no dataserver) it is done right away.
+    Returns whether the cleanup was queued.
+    """
+    queue = get_cleanup_queue()
+    if queue is None:
+        _process_entry((kind, key, site_name or u''))
+        return False
+    return queue.put(kind, key, site_name)
+
+
+def process_cleanup_queue(queue, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Process and dequeue up to `batch_size` cleanups in the current
+    transaction. Returns the processed entries.
+    """
+    entries = [entry for entry, _ in queue.items(batch_size)]
+    for entry in entries:
+        _process_entry(entry)
+        queue.remove(entry)
+    return entries
+
+
+def drain_cleanup_queue(batch_size=DEFAULT_BATCH_SIZE, max_batches=None,
+                        retries=DEFAULT_RETRIES):
+    """
+    Drain the cleanup queue in batches, each in its own transaction that
+    is retried on conflicts. This must be called outside of a transaction,
+    e.g. from a worker or a script. Returns the number of processed entries.
+    """
+    runner = component.getUtility(IDataserverTransactionRunner)
+
+    def _do_batch():
+        queue = query_cleanup_queue()
+        if queue is None:
+            return 0
+        return len(process_cleanup_queue(queue, batch_size))
+
+    batches = total = 0
+    while max_batches is None or batches < max_batches:
+        count = runner(_do_batch, retries=retries)
+        if not count:
+            break
+        total += count
+        batches += 1
+        logger.info("%s completed item cleanup(s) processed", total)
+    return total
+
@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Cohort-wide progress computed directly from the completed item catalog.
+
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+from zope import component
+
+from zope.cachedescriptors.property import Lazy
+
+from zope.intid.interfaces import IIntIds
+
+from nti.app.contenttypes.completion.adapters import shared_item_providers
+from nti.app.contenttypes.completion.adapters import PrincipalCompletedItemsProvider
+from nti.app.contenttypes.completion.adapters import make_context_progress
+from nti.app.contenttypes.completion.adapters import CompletionContextProgressFactory
+
+from nti.app.contenttypes.completion.cache import progress_contribution
+from nti.app.contenttypes.completion.cache import get_provider_versions
+from nti.app.contenttypes.completion.cache import get_requirements_token
+
+from nti.app.contenttypes.completion.catalog import get_index_family
+from nti.app.contenttypes.completion.catalog import get_awarded_item_documents
+
+from nti.app.contenttypes.completion.interfaces import ICompletionContextCohort
+
+from nti.app.contenttypes.completion.interfaces import IUserIndependentCompletableItemProvider
+
+from nti.contenttypes.completion.index import IX_ITEMS
+from nti.contenttypes.completion.index import IX_CONTEXT
+from nti.contenttypes.completion.index import IX_SUCCESS
+from nti.contenttypes.completion.index import IX_PRINCIPAL
+from nti.contenttypes.completion.index import IX_COMPLETIONTIME
+
+from nti.contenttypes.completion.index import get_completed_item_catalog
+
+from nti.contenttypes.completion.interfaces import ICompletedItemProvider
+from nti.contenttypes.completion.interfaces import IRequiredCompletableItemProvider
+from nti.contenttypes.completion.interfaces import ICompletionContextCompletionPolicy
+
+from nti.dataserver.interfaces import IPrincipal
+
+from nti.ntiids.oids import to_external_ntiid_oid
+
+logger = __import__('logging').getLogger(__name__)
+
+
+class CohortProgressEngine(object):
+    """
+    Computes the progress values (see
+    :meth:`CompletionContextProgressFactory.get_snapshot`) of many users in
+    a :class:`ICompletionContext` from the doc id sets of the completed item
+    catalog. No :class:`ICompletedItem` or user containers are loaded; each
+    user costs a few lookups per completed item of the user.
+
+    The required item ntiids must be the same for every user. Like the
+    :class:`PrincipalCompletedItemsProvider`, only the items the users
+    completed count; awarded items are indexed by context as well and
+    are excluded.
+    """
+
+    def __init__(self, context, required_ntiids, catalog=None,
+                 metadata_catalog=None, intids=None):
+        self.context = context
+        self.required_ntiids = frozenset(required_ntiids or ())
+        self.catalog = get_completed_item_catalog() if catalog is None else catalog
+        self.metadata_catalog = metadata_catalog
+        self.intids = intids
+
+    @Lazy
+    def context_ntiid(self):
+        return getattr(self.context, 'ntiid', None) \
+            or to_external_ntiid_oid(self.context)
+
+    @Lazy
+    def family(self):
+        return get_index_family(self.catalog)
+
+    def _documents(self, name, value):
+        index = self.catalog.get(name)
+        if index is None:
+            return None
+        return index.values_to_documents.get(value)
+
+    def _values(self, name):
+        index = self.catalog.get(name)
+        return getattr(index, 'documents_to_values', None)
+
+    @Lazy
+    def context_documents(self):
+        return self._documents(IX_CONTEXT, self.context_ntiid)
+
+    @Lazy
+    def failed_documents(self):
+        return self._documents(IX_SUCCESS, False)
+
+    @Lazy
+    def awarded_documents(self):
+        return get_awarded_item_documents(self.metadata_catalog, self.family)
+
+    def user_documents(self, username):
+        """
+        The doc ids of the completed items of our required items of the
+        given user in our context. Only the (few) docs of the user are
+        visited, so a single user is as cheap as a user of a cohort.
+        """
+        IF = self.family.IF
+        user_docs = self._documents(IX_PRINCIPAL, username)
+        context_docs = self.context_documents
+        if not user_docs or not context_docs or not self.required_ntiids:
+            return IF.TreeSet()
+        item_values = self._item_values
+        awarded_docs = self.awarded_documents
+        return IF.TreeSet(x for x in user_docs
+                          if      x in context_docs
+                              and x not in awarded_docs
+                              and item_values.get(x) in self.required_ntiids)
+
+    @Lazy
+    def _item_values(self):
+        return self._values(IX_ITEMS) or {}
+
+    @Lazy
+    def _time_values(self):
+        # The completion time index is a normalization wrapper; the
+        # (order preserving) normalized values are in the wrapped index
+        index = self.catalog.get(IX_COMPLETIONTIME)
+        index = getattr(index, 'index', index)
+        return getattr(index, 'documents_to_values', None)
+
+    def _completed_date(self, doc_id):
+        if self.intids is None:
+            self.intids = component.getUtility(IIntIds)
+        item = self.intids.queryObject(doc_id)
+        return getattr(item, 'CompletedDate', None)
+
+    def _last_modified(self, docs):
+        """
+        The completion date of the most recent of the given docs. Only
+        that one item is loaded, when the completion times are indexed.
+        """
+        if not docs:
+            return None
+        time_values = self._time_values
+        if time_values is None:
+            dates = [self._completed_date(x) for x in docs]
+            dates = [x for x in dates if x is not None]
+            return max(dates) if dates else None
+        latest = None
+        latest_value = None
+        for doc_id in docs:
+            value = time_values.get(doc_id)
+            if value is not None and (latest_value is None or value > latest_value):
+                latest, latest_value = doc_id, value
+        return self._completed_date(latest) if latest is not None else None
+
+    def get_snapshot(self, username):
+        mine = self.user_documents(username)
+        item_values = self._item_values
+        completed = {item_values.get(x) for x in mine}
+        completed.discard(None)
+        failed_docs = self.failed_documents
+        failed = {item_values.get(x) for x in mine if x in failed_docs} \
+            if failed_docs else set()
+        failed.discard(None)
+        return {'AbsoluteProgress': len(completed),
+                'MaxPossibleProgress': len(self.required_ntiids),
+                'LastModified': self._last_modified(mine),
+                'UnsuccessfulItemNTIIDs': tuple(failed),
+                'IncompleteItemNTIIDs': tuple(self.required_ntiids - completed)}
+
+    def __call__(self, usernames):
+        return {x: self.get_snapshot(x) for x in usernames}
+
+
+def is_user_independent(providers):
+    """
+    Return whether every given (possibly shared) item provider declares
+    its items to be user independent.
+    """
+    for provider in providers:
+        provider = getattr(provider, 'provider', provider)
+        if not IUserIndependentCompletableItemProvider.providedBy(provider):
+            return False
+    return True
+
+
+def has_principal_completed_items_only(user, context):
+    """
+    Return whether the completed items of the user in the context only
+    come from the :class:`PrincipalCompletedItemsProvider`, i.e. what the
+    catalog (without awarded items) knows about.
+    """
+    providers = component.subscribers((user, context), ICompletedItemProvider)
+    return all(isinstance(x, PrincipalCompletedItemsProvider) for x in providers)
+
+
+def iter_cohort_progress(context, users, required_item_providers=None):
+    """
+    Yield a (user, :class:`ICompletionContextProgress`) tuple for each of the
+    given users. When the required items are the same for everyone and
+    the completed items all come from the user containers, progress is
+    computed in one batch by the :class:`CohortProgressEngine`; otherwise
+    we fall back to the (cached) per-user progress factory, sharing the
+    required item providers across users.
+    """
+    if required_item_providers is None:
+        required_item_providers = component.subscribers((context,),
+                                                        IRequiredCompletableItemProvider)
+    required_item_providers = shared_item_providers(required_item_providers)
+    engine = None
+    policy = ICompletionContextCompletionPolicy(context, None)
+    use_engine = bool(required_item_providers) \
+             and is_user_independent(required_item_providers)
+    for user in users:
+        if use_engine and engine is None:
+            # Completed item providers are registered for all users alike
+            use_engine = has_principal_completed_items_only(user, context)
+        if not use_engine:
+            factory = CompletionContextProgressFactory(user, context,
+                                                       required_item_providers)
+            yield user, factory()
+            continue
+        if engine is None:
+            required_ntiids = set()
+            for provider in required_item_providers:
+                required_ntiids.update(x.ntiid for x in provider.iter_items(user))
+            engine = CohortProgressEngine(context, required_ntiids)
+        snapshot = engine.get_snapshot(IPrincipal(user).id)
+        yield user, make_context_progress(user, context, snapshot, policy)
+
+
+def update_cohort_aggregate(aggregate, context, users):
+    """
+    Fold the current progress of the given users into the
+    :class:`ICompletionContextProgressAggregate`. Full builds and
+    incremental updates both go through here, so contributions are
+    always computed the same way.
+    """
+    for user, progress in iter_cohort_progress(context, users):
+        aggregate.update(IPrincipal(user).id, progress_contribution(progress))
+
+
+def get_aggregate_token(context):
+    """
+    The validity token of the cohort aggregate of the context: the
+    requirements of the context and the version of every required item
+    provider, as for the progress snapshots. None if some provider cannot
+    be versioned, in which case no aggregate is ever current.
+    """
+    providers = component.subscribers((context,),
+                                      IRequiredCompletableItemProvider)
+    versions = get_provider_versions(providers)
+    if versions is None:
+        return None
+    return (get_requirements_token(context), versions)
+
+
+def is_current_aggregate(aggregate, context, token=None):
+    token = get_aggregate_token(context) if token is None else token
+    return token is not None and aggregate.version == token
+
+
+def build_cohort_aggregate(aggregate, context, version=None, cohort=None):
+    """
+    Rebuild the aggregate of the context from all of its cohort, for the
+    given (or current) validity token.
+    """
+    cohort = ICompletionContextCohort(context, ()) if cohort is None else cohort
+    version = get_aggregate_token(context) if version is None else version
+    aggregate.reset(version)
+    update_cohort_aggregate(aggregate, context, cohort)
+
+
+def reconcile_cohort_aggregate(aggregate, context, cohort=None):
+    """
+    Bring the users accounted for by the aggregate in line with the
+    cohort, after enrollments or drops (for which we get no events).
+    Only the users that joined are computed. Returns whether anything
+    changed.
+    """
+    cohort = ICompletionContextCohort(context, ()) if cohort is None else cohort
+    members = {IPrincipal(x).id: x for x in cohort}
+    departed = [x for x in aggregate.usernames() if x not in members]
+    for username in departed:
+        aggregate.remove(username)
+    joined = [user for username, user in members.items() if username not in aggregate]
+    update_cohort_aggregate(aggregate, context, joined)
+    return bool(departed or joined)
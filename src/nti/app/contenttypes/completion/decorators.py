@@ -24,6 +24,8 @@ from nti.app.contenttypes.completion import DEFAULT_REQUIRED_POLICY_PATH_NAME
 from nti.app.contenttypes.completion import AWARDED_COMPLETED_ITEMS_PATH_NAME
 from nti.app.contenttypes.completion import DELETE_AWARDED_COMPLETED_ITEM_VIEW
 
+from nti.app.contenttypes.completion.cache import get_required_state
+
 from nti.app.renderers.decorators import AbstractRequestAwareDecorator
 from nti.app.renderers.decorators import AbstractAuthenticatedRequestAwareDecorator
 
@@ -37,15 +39,12 @@ from nti.contenttypes.completion.interfaces import IAwardedCompletedItem
 from nti.contenttypes.completion.interfaces import ICompletionContext
 from nti.contenttypes.completion.interfaces import ICompletionSubContext
 from nti.contenttypes.completion.interfaces import ICompletionContextProvider
-from nti.contenttypes.completion.interfaces import ICompletableItemContainer
 from nti.contenttypes.completion.interfaces import ICompletableItemCompletionPolicy
 from nti.contenttypes.completion.interfaces import ICompletionContextCompletionPolicy
-from nti.contenttypes.completion.interfaces import ICompletableItemDefaultRequiredPolicy
+from nti.contenttypes.completion.interfaces import IPrincipalCompletedItemContainer
+from nti.contenttypes.completion.interfaces import IPrincipalAwardedCompletedItemContainer
 from nti.contenttypes.completion.interfaces import ICompletionContextCompletionPolicyConfigurationUtility
 
-from nti.contenttypes.completion.utils import get_completed_item
-from nti.contenttypes.completion.utils import get_awarded_completed_item
-
 from nti.dataserver.authorization import ACT_CONTENT_EDIT
 
 from nti.dataserver.authorization import is_admin_or_content_admin
@@ -164,6 +163,91 @@ class _CompletionContextSettingsDecorator(AbstractAuthenticatedRequestAwareDecor
             _links.append(self._make_default_required_link(context, 'UpdateDefaultRequiredPolicy', 'PUT'))
 
 
+class CompletionDecorationState(object):
+    """
+    What we need to decorate the :class:`ICompletableItem` objects of a
+    :class:`ICompletionContext` for a user, resolved at most once per
+    request.
+    """
+
+    def __init__(self, completion_context, user, request, remote_user=None):
+        self.completion_context = completion_context
+        self.user = user
+        self.request = request
+        self.remote_user = remote_user
+
+    @Lazy
+    def completion_policy(self):
+        return ICompletionContextCompletionPolicy(self.completion_context, None)
+
+    @Lazy
+    def required_state(self):
+        return get_required_state(self.completion_context)
+
+    @Lazy
+    def can_view_progress(self):
+        # If the user is not ourselves, we are another user viewing
+        # a user's progress; we *must* have the ACT_VIEW_PROGRESS
+        # permission then.
+        return self.user == self.remote_user \
+            or has_permission(ACT_VIEW_PROGRESS, self.request.context, self.request)
+
+    def _load_items(self, provided):
+        container = component.queryMultiAdapter((self.user, self.completion_context),
+                                                provided)
+        return dict(container.items()) if container is not None else {}
+
+    @Lazy
+    def completed_items(self):
+        """
+        The user's completed items in the context, by item ntiid.
+        """
+        return self._load_items(IPrincipalCompletedItemContainer)
+
+    @Lazy
+    def awarded_items(self):
+        """
+        The user's awarded completed items in the context, by item ntiid.
+        """
+        return self._load_items(IPrincipalAwardedCompletedItemContainer)
+
+    def prefetch(self):
+        """
+        Load the user's completed and awarded items up front, so that
+        decorating each item is an in-memory lookup.
+        """
+        return self.completed_items, self.awarded_items
+
+    def get_completed_item(self, item):
+        return self.completed_items.get(getattr(item, 'ntiid', None))
+
+    def get_awarded_completed_item(self, item):
+        return self.awarded_items.get(getattr(item, 'ntiid', None))
+
+
+#: The request attribute holding the :class:`CompletionDecorationState` objects
+_DECORATION_STATES = '_nti_completion_decoration_states'
+
+
+def get_decoration_state(completion_context, user, request, remote_user=None):
+    """
+    Return the request scoped :class:`CompletionDecorationState` for the
+    given context and user.
+    """
+    states = getattr(request, _DECORATION_STATES, None)
+    if states is None:
+        states = {}
+        setattr(request, _DECORATION_STATES, states)
+    key = (completion_context, user)
+    result = states.get(key)
+    if result is None:
+        result = states[key] = CompletionDecorationState(completion_context,
+                                                         user,
+                                                         request,
+                                                         remote_user)
+    return result
+
+
 @component.adapter(ICompletableItem)
 @interface.implementer(IExternalMappingDecorator)
 class CompletableItemDecorator(AbstractAuthenticatedRequestAwareDecorator):
@@ -186,45 +270,36 @@ class CompletableItemDecorator(AbstractAuthenticatedRequestAwareDecorator):
         provider =  ICompletionContextProvider(item, None)
         return provider() if provider else None
 
+    def get_decoration_state(self, completion_context):
+        # See if we have a user from our request context
+        user = IUser(self.request.context, self.remoteUser)
+        return get_decoration_state(completion_context, user,
+                                    self.request, self.remoteUser)
+
     def has_completion_policy(self, completion_context):
-        completion_policy = ICompletionContextCompletionPolicy(completion_context,
-                                                               None)
-        return completion_policy is not None
+        if completion_context is None:
+            return False
+        state = self.get_decoration_state(completion_context)
+        return state.completion_policy is not None
 
     def _do_decorate_external(self, context, result):
         completion_context = self.get_completion_context(context)
+        if completion_context is None:
+            return
+        state = self.get_decoration_state(completion_context)
         if self.has_completion_policy(completion_context):
-            required_container = ICompletableItemContainer(completion_context)
-            default_policy = ICompletableItemDefaultRequiredPolicy(completion_context)
-            is_required = required_container.is_item_required(context)
-            is_not_required = required_container.is_item_optional(context)
             # We're default if we are not explicitly required/not-required
-            is_default_state = not is_required and not is_not_required
-            item_mime_type = getattr(context, 'mime_type', '')
-            default_required_state = item_mime_type in default_policy.mime_types
-            if is_default_state:
-                is_required = default_required_state
+            is_required, default_required_state, is_default_state = \
+                state.required_state.get_state(context)
             result['CompletionRequired'] = is_required
             result['CompletionDefaultState'] = default_required_state
             result['IsCompletionDefaultState'] = is_default_state
 
-        if completion_context is not None:
-            # See if we have a user from our request context
-            # If so, and it is not ourselves, that means we are another user
-            # viewing a user's progress; that user *must* have the ACT_VIEW_PROGRESS
-            # permission then.
-            user = IUser(self.request.context, self.remoteUser)
-            if     user == self.remoteUser \
-                or has_permission(ACT_VIEW_PROGRESS, self.request.context, self.request):
-                completed_item = get_completed_item(user,
-                                                    completion_context,
-                                                    context)
-                result['CompletedItem'] = completed_item
-                result['CompletedDate'] = getattr(completed_item, 'CompletedDate', None)
-                awarded_item = get_awarded_completed_item(user, 
-                                                          completion_context,
-                                                          context)
-                result['AwardedItem'] = awarded_item            
+        if state.can_view_progress:
+            completed_item = state.get_completed_item(context)
+            result['CompletedItem'] = completed_item
+            result['CompletedDate'] = getattr(completed_item, 'CompletedDate', None)
+            result['AwardedItem'] = state.get_awarded_completed_item(context)
 
 
 @component.adapter(ICompletableItem)
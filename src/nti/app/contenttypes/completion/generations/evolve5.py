@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+from zope import component
+from zope import interface
+
+from zope.component.hooks import site
+from zope.component.hooks import setHooks
+
+from zope.intid.interfaces import IIntIds
+
+from nti.app.contenttypes.completion.registry import install_context_registry
+from nti.app.contenttypes.completion.registry import register_completion_context
+
+from nti.contenttypes.completion.interfaces import get_completables
+from nti.contenttypes.completion.interfaces import ICompletionContext
+
+from nti.dataserver.interfaces import IDataserver
+from nti.dataserver.interfaces import IOIDResolver
+
+from nti.site.hostpolicy import get_all_host_sites
+
+generation = 5
+
+logger = __import__('logging').getLogger(__name__)
+
+
+@interface.implementer(IDataserver)
+class MockDataserver(object):
+
+    root = None
+
+    def get_by_oid(self, oid, ignore_creator=False):
+        resolver = component.queryUtility(IOIDResolver)
+        if resolver is None:
+            logger.warning("Using dataserver without a proper ISiteManager.")
+        else:
+            return resolver.get_object_by_oid(oid, ignore_creator=ignore_creator)
+        return None
+
+
+def _register_contexts(registry, intids):
+    count = 0
+    for obj in get_completables():
+        if     ICompletionContext.providedBy(obj) \
+           and register_completion_context(obj, registry, intids):
+            count += 1
+    return count
+
+
+def do_evolve(context):
+    setHooks()
+    conn = context.connection
+    root = conn.root()
+    ds_folder = root['nti.dataserver']
+
+    mock_ds = MockDataserver()
+    mock_ds.root = ds_folder
+    component.provideUtility(mock_ds, IDataserver)
+
+    with site(ds_folder):
+        assert component.getSiteManager() == ds_folder.getSiteManager(), \
+               "Hooks not installed?"
+
+        lsm = ds_folder.getSiteManager()
+        intids = lsm.getUtility(IIntIds)
+        registry = install_context_registry(ds_folder)
+        count = _register_contexts(registry, intids)
+        for host_site in get_all_host_sites():  # check all sites
+            with site(host_site):
+                count += _register_contexts(registry, intids)
+
+    component.getGlobalSiteManager().unregisterUtility(mock_ds, IDataserver)
+    logger.info('Contenttype completion evolution %s done (contexts=%s)',
+                generation, count)
+
+
+def evolve(context):
+    """
+    Evolve to gen 5 by registering the completion contexts of each site.
+    """
+    do_evolve(context)
@@ -16,9 +16,11 @@ from zope.generations.interfaces import IInstallableSchemaManager
 
 from zope.intid.interfaces import IIntIds
 
+from nti.app.contenttypes.completion.registry import install_context_registry
+
 from nti.contenttypes.completion.index import install_completed_item_catalog
 
-generation = 4
+generation = 5
 
 logger = __import__('logging').getLogger(__name__)
 
@@ -46,3 +48,4 @@ def evolve(context):
     lsm = dataserver_folder.getSiteManager()
     intids = lsm.getUtility(IIntIds)
     install_completed_item_catalog(dataserver_folder, intids)
+    install_context_registry(dataserver_folder)
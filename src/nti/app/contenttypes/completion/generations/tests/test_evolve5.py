@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+# pylint: disable=protected-access,too-many-public-methods,arguments-differ
+
+from hamcrest import is_
+from hamcrest import none
+from hamcrest import has_length
+from hamcrest import assert_that
+
+import fudge
+
+from zope import component
+from zope import interface
+
+from zope.annotation.interfaces import IAnnotations
+
+from zope.intid.interfaces import IIntIds
+
+from nti.app.contenttypes.completion.generations.evolve5 import do_evolve
+
+from nti.app.contenttypes.completion.registry import CONTEXT_REGISTRY_KEY
+
+from nti.app.contenttypes.completion.registry import get_context_site_name
+from nti.app.contenttypes.completion.registry import query_context_registry
+
+from nti.app.contenttypes.completion.tests import CompletionTestLayer
+
+from nti.app.contenttypes.completion.tests.models import PersistentCompletionContext
+
+from nti.app.testing.application_webtest import ApplicationLayerTest
+
+from nti.app.testing.decorators import WithSharedApplicationMockDS
+
+from nti.contenttypes.completion.interfaces import ICompletionContext
+
+from nti.coremetadata.interfaces import IContained
+
+from nti.dataserver.interfaces import IDataserver
+
+from nti.dataserver.tests import mock_dataserver
+
+from nti.dataserver.users.users import User
+
+
+class TestEvolve5(ApplicationLayerTest):
+
+    layer = CompletionTestLayer
+
+    @WithSharedApplicationMockDS(users=True, testapp=False)
+    @fudge.patch('nti.app.contenttypes.completion.generations.evolve5.get_completables')
+    def test_do_evolve(self, mock_completables):
+        with mock_dataserver.mock_db_trans(self.ds) as conn:
+            admin = User.get_user('sjohnson@nextthought.com')
+            for container_id in ('evolve5_container1', 'evolve5_container2'):
+                completion_context = PersistentCompletionContext()
+                completion_context.containerId = container_id
+                interface.alsoProvides(completion_context, IContained)
+                admin.addContainedObject(completion_context)
+
+            intids = component.getUtility(IIntIds)
+            contexts = {}
+            for doc_id in intids:
+                obj = intids.queryObject(doc_id)
+                if ICompletionContext.providedBy(obj):
+                    contexts[doc_id] = obj
+            assert_that(contexts, has_length(2))
+            mock_completables.is_callable().returns(list(contexts.values()))
+
+            ds_folder = conn.root()['nti.dataserver']
+            IAnnotations(ds_folder).pop(CONTEXT_REGISTRY_KEY)
+            assert_that(query_context_registry(ds_folder), is_(none()))
+
+            dataserver = component.getUtility(IDataserver)
+            context = fudge.Fake().has_attr(connection=conn)
+            try:
+                do_evolve(context)
+            finally:
+                # The evolution registers and drops its own dataserver
+                component.provideUtility(dataserver, IDataserver)
+
+            registry = query_context_registry(ds_folder)
+            assert_that(registry, has_length(len(contexts)))
+            for doc_id, completion_context in contexts.items():
+                assert_that(registry.site_name(doc_id),
+                            is_(get_context_site_name(completion_context)))
@@ -12,6 +12,10 @@ from __future__ import absolute_import
 
 from zope import interface
 
+from zope.interface.interfaces import IObjectEvent
+from zope.interface.interfaces import ObjectEvent
+
+from nti.schema.field import Int
 from nti.schema.field import Object
 
 from nti.contenttypes.completion.interfaces import ICompletionContext
@@ -33,7 +37,7 @@ class ICompletedItemsContext(ICompletionContextContained):
     user = Object(IUser,
                   title=u'The user we are scoped to',
                   required=False)
-    
+
 
 class IAwardedCompletedItemsContext(ICompletionContextContained):
 
@@ -64,3 +68,156 @@ class ICompletionContextCohort(IEnumerableEntityContainer):
     An entity container that is treated as a cohort when aggregating
     completion information or listing completion details
     """
+
+
+class IUserIndependentCompletableItemProvider(interface.Interface):
+    """
+    A marker for :class:`ICompletableItemProvider` and
+    :class:`IRequiredCompletableItemProvider` subscribers whose items do
+    not depend on the user passed to `iter_items`. Cohort-wide loops
+    resolve the items of these providers once and share them across
+    users.
+    """
+
+
+class IVersionedItemProvider(interface.Interface):
+    """
+    A marker for :class:`ICompletableItemProvider`,
+    :class:`IRequiredCompletableItemProvider` and
+    :class:`ICompletedItemProvider` subscribers whose `version` changes
+    whenever the items they provide may have. Progress is only persisted
+    when every provider it depends on can be versioned.
+    """
+
+    version = interface.Attribute(u"A comparable, picklable version token")
+
+
+class ICompletionContextProgressCache(interface.Interface):
+    """
+    A persistent store of per-user progress snapshots for an
+    :class:`ICompletionContext`. Snapshots are only valid for the
+    requirements `version` and the validity `token` they were computed
+    against.
+    """
+
+    version = Int(title=u"The current requirements version of the context",
+                  required=True,
+                  readonly=True)
+
+    def get_snapshot(username, token=None):
+        """
+        Return the snapshot for the given username if it is current and
+        was stored with the given token, or None.
+        """
+
+    def set_snapshot(username, snapshot, token=None, required_ntiids=None):
+        """
+        Store the snapshot (a mapping of progress values) for the username.
+        If the (user independent) `required_ntiids` are given, they are
+        stored once for all users rather than per snapshot.
+        """
+
+    def invalidate(username=None):
+        """
+        Invalidate the snapshot of the given username or, if no username
+        is given, every snapshot by bumping the version.
+        """
+
+
+class ICompletionContextProgressAggregate(interface.Interface):
+    """
+    Incrementally maintained cohort progress counters for an
+    :class:`ICompletionContext`; only valid for the requirements
+    `version` they were built against.
+    """
+
+    version = interface.Attribute(u"The requirements validity token the counters were built for")
+
+    TotalUsers = Int(title=u"The number of users accounted for",
+                     readonly=True)
+
+    CountHasProgress = Int(title=u"The number of users with progress",
+                           readonly=True)
+
+    CountCompleted = Int(title=u"The number of users that completed",
+                         readonly=True)
+
+    CountSuccess = Int(title=u"The number of users that successfully completed",
+                       readonly=True)
+
+    def reset(version):
+        """
+        Clear all counters and mark them as built for the given version.
+        """
+
+    def update(username, contribution):
+        """
+        Replace the contribution tuple of the username in the counters.
+        """
+
+    def remove(username):
+        """
+        Remove the contribution of the username from the counters.
+        """
+
+    def usernames():
+        """
+        Return the (sorted) usernames accounted for.
+        """
+
+    def accumulated_progress():
+        """
+        Return the sum of the percentage progress of all users.
+        """
+
+    def distribution(bucket_size):
+        """
+        Return a map of lower bucket bound (as a fraction) to user count.
+        """
+
+
+class ICompletionContextRequiredState(interface.Interface):
+    """
+    A precomputed map of the explicitly required/not required item ntiids
+    of an :class:`ICompletionContext`, plus its default required mime
+    types. It is rebuilt whenever the requirements change.
+    """
+
+    version = Int(title=u"The number of times the map was built",
+                  required=True,
+                  readonly=True)
+
+    def reset(explicit, default_mime_types, token=None):
+        """
+        Replace the map of item ntiid to explicitly required (bool) and
+        the default required mime types.
+        """
+
+    def get_state(item):
+        """
+        Return a (required, default required, is default state) tuple for
+        the given :class:`ICompletableItem`.
+        """
+
+    def is_item_required(item):
+        """
+        Return whether the given :class:`ICompletableItem` is required.
+        """
+
+    def is_default_state(ntiid):
+        """
+        Return whether the item ntiid is neither explicitly required nor
+        explicitly not required.
+        """
+
+
+class ICompletionContextRequirementsModifiedEvent(IObjectEvent):
+    """
+    Fired when the required/optional state or a completion policy of a
+    :class:`ICompletionContext` changes.
+    """
+
+
+@interface.implementer(ICompletionContextRequirementsModifiedEvent)
+class CompletionContextRequirementsModifiedEvent(ObjectEvent):
+    pass
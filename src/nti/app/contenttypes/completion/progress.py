@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+The progress of one user across many completion contexts.
+
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+from zope import component
+
+from zope.intid.interfaces import IIntIds
+
+from nti.app.contenttypes.completion.adapters import make_context_progress
+from nti.app.contenttypes.completion.adapters import PrincipalCompletedItemsProvider
+from nti.app.contenttypes.completion.adapters import CompletionContextProgressFactory
+
+from nti.app.contenttypes.completion.catalog import get_indexed_documents
+
+from nti.contenttypes.completion.index import IX_CONTEXT
+
+from nti.contenttypes.completion.index import get_completed_item_catalog
+
+from nti.contenttypes.completion.interfaces import IAwardedCompletedItem
+from nti.contenttypes.completion.interfaces import ICompletedItemProvider
+
+from nti.ntiids.oids import to_external_ntiid_oid
+
+logger = __import__('logging').getLogger(__name__)
+
+
+def _context_ntiid(context):
+    return getattr(context, 'ntiid', None) or to_external_ntiid_oid(context)
+
+
+def get_user_completed_items_by_context(username, context_ntiids,
+                                        catalog=None, intids=None):
+    """
+    Return a map of context ntiid to a map of item ntiid to the user's
+    completed items in that context, from a single principal index query.
+    """
+    result = {x: {} for x in context_ntiids}
+    if not result:
+        return result
+    catalog = get_completed_item_catalog() if catalog is None else catalog
+    intids = component.getUtility(IIntIds) if intids is None else intids
+    documents_to_values = catalog[IX_CONTEXT].documents_to_values
+    docs = get_indexed_documents(users=(username,),
+                                 contexts=tuple(result),
+                                 catalog=catalog)
+    for doc_id in docs:
+        item = intids.queryObject(doc_id)
+        # Awarded items are indexed too, but are not completed items
+        if item is None or IAwardedCompletedItem.providedBy(item):
+            continue
+        ntiid = documents_to_values.get(doc_id)
+        result.setdefault(ntiid, {})[item.item_ntiid] = item
+    return result
+
+
+def _has_indexed_completed_items(user, context):
+    """
+    Whether the user's completed items in the context all come from the
+    (indexed) principal completed item container.
+    """
+    providers = component.subscribers((user, context), ICompletedItemProvider)
+    return all(isinstance(x, PrincipalCompletedItemsProvider) for x in providers)
+
+
+def get_user_context_progress(user, contexts):
+    """
+    Return a list of (context, :class:`ICompletionContextProgress`) tuples
+    for the user in each of the given contexts. Valid cached snapshots
+    are used as is; the completed items of the other contexts are
+    fetched in one catalog query rather than one container walk each.
+    """
+    result = []
+    pending = []
+    username = getattr(user, 'username', None)
+    for context in contexts:
+        factory = CompletionContextProgressFactory(user, context)
+        snapshot = factory.query_snapshot()
+        if snapshot is None and _has_indexed_completed_items(user, context):
+            pending.append(factory)
+        result.append((context, factory, snapshot))
+
+    completed_items = get_user_completed_items_by_context(
+        username, [_context_ntiid(x.context) for x in pending])
+    for factory in pending:
+        factory.user_completed_items = completed_items.get(_context_ntiid(factory.context),
+                                                           {})
+
+    return [(context,
+             factory() if snapshot is None else make_context_progress(user, context, snapshot))
+            for context, factory, snapshot in result]
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+A registry of the intids of the completion contexts of each host site,
+so that enumerating the contexts of a site is a direct lookup rather
+than a scan of every completable.
+
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import heapq
+
+from BTrees.LLBTree import LLTreeSet
+from BTrees.LLBTree import multiunion
+
+from BTrees.LOBTree import LOBTree
+
+from BTrees.OOBTree import OOBTree
+
+from BTrees.Length import Length
+
+from persistent import Persistent
+
+from zope import component
+
+from zope.container.contained import Contained
+
+from zope.intid.interfaces import IIntIds
+
+from nti.app.contenttypes.completion.utils import get_annotation
+from nti.app.contenttypes.completion.utils import query_annotation
+from nti.app.contenttypes.completion.utils import get_dataserver_folder
+
+from nti.contenttypes.completion.interfaces import ICompletionContext
+
+from nti.site.interfaces import IHostPolicyFolder
+
+#: The registry bucket of the contexts outside of any host site; these
+#: are visible from every site.
+GLOBAL_SITE = u''
+
+CONTEXT_REGISTRY_KEY = u'nti.app.contenttypes.completion.registry.CompletionContextRegistry'
+
+logger = __import__('logging').getLogger(__name__)
+
+
+class CompletionContextRegistry(Persistent, Contained):
+    """
+    The intids of the registered completion contexts, bucketed by the
+    name of their host site.
+    """
+
+    def __init__(self):
+        self._sites = OOBTree()
+        self._doc_sites = LOBTree()
+        self._count = Length()
+
+    def register(self, doc_id, site_name=None):
+        site_name = site_name or GLOBAL_SITE
+        old = self._doc_sites.get(doc_id)
+        if old == site_name:
+            return False
+        if old is not None:
+            self._sites[old].remove(doc_id)
+        else:
+            self._count.change(1)
+        docs = self._sites.get(site_name)
+        if docs is None:
+            docs = self._sites[site_name] = LLTreeSet()
+        docs.add(doc_id)
+        self._doc_sites[doc_id] = site_name
+        return True
+
+    def unregister(self, doc_id):
+        site_name = self._doc_sites.pop(doc_id, None)
+        if site_name is None:
+            return False
+        self._sites[site_name].remove(doc_id)
+        self._count.change(-1)
+        return True
+
+    def site_name(self, doc_id):
+        return self._doc_sites.get(doc_id)
+
+    def site_names(self):
+        return list(self._sites.keys())
+
+    def documents(self, site_names=None):
+        """
+        Return the sorted doc ids of the contexts of the given (or all)
+        site names.
+        """
+        if site_names is None:
+            site_names = self._sites.keys()
+        docs = [self._sites.get(x) for x in site_names]
+        return multiunion([x for x in docs if x])
+
+    def iter_documents(self, site_names=None, after=None):
+        """
+        Yield, in order, the doc ids of the contexts of the given (or all)
+        site names after the given doc id, merging the sorted sets of the
+        sites lazily.
+        """
+        if site_names is None:
+            site_names = self._sites.keys()
+        docs = [self._sites.get(x) for x in site_names]
+        if after is None:
+            keys = [x.keys() for x in docs if x]
+        else:
+            keys = [x.keys(min=after, excludemin=True) for x in docs if x]
+        return heapq.merge(*keys)
+
+    def __contains__(self, doc_id):
+        return doc_id in self._doc_sites
+
+    def __len__(self):
+        return self._count()
+
+
+def query_context_registry(folder=None):
+    """
+    Return the :class:`CompletionContextRegistry`, if installed.
+    """
+    folder = get_dataserver_folder() if folder is None else folder
+    return query_annotation(folder, CONTEXT_REGISTRY_KEY)
+
+
+def install_context_registry(folder):
+    """
+    Return the :class:`CompletionContextRegistry` of the given dataserver
+    folder, creating it if needed.
+    """
+    return get_annotation(folder, CONTEXT_REGISTRY_KEY, CompletionContextRegistry)
+
+
+def get_context_site_name(context):
+    site = IHostPolicyFolder(context, None)
+    return site.__name__ if site is not None else GLOBAL_SITE
+
+
+def register_completion_context(context, registry=None, intids=None):
+    registry = query_context_registry() if registry is None else registry
+    if registry is None:
+        return False
+    intids = component.getUtility(IIntIds) if intids is None else intids
+    doc_id = intids.queryId(context)
+    if doc_id is None:
+        return False
+    return registry.register(doc_id, get_context_site_name(context))
+
+
+def unregister_completion_context(context, registry=None, intids=None):
+    registry = query_context_registry() if registry is None else registry
+    if registry is None:
+        return False
+    intids = component.getUtility(IIntIds) if intids is None else intids
+    doc_id = intids.queryId(context)
+    return registry.unregister(doc_id) if doc_id is not None else False
+
+
+def iter_registered_completion_contexts(site_names=None, registry=None, intids=None):
+    """
+    Yield the registered completion contexts of the given (or all) site
+    names, in doc id order.
+    """
+    registry = query_context_registry() if registry is None else registry
+    if registry is None:
+        return
+    intids = component.getUtility(IIntIds) if intids is None else intids
+    for doc_id in registry.documents(site_names):
+        context = intids.queryObject(doc_id)
+        if ICompletionContext.providedBy(context):
+            yield context
@@ -8,71 +8,206 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import absolute_import
 
+import transaction
+
 from zope import component
 
 from zope.component.hooks import getSite
 
+from zope.intid.interfaces import IIntIds
+from zope.intid.interfaces import IIntIdAddedEvent
+from zope.intid.interfaces import IIntIdRemovedEvent
+
 from zope.lifecycleevent.interfaces import IObjectRemovedEvent
 
+from zope.lifecycleevent.interfaces import IObjectAddedEvent
+from zope.lifecycleevent.interfaces import IObjectModifiedEvent
+
 from zope.security.management import queryInteraction
 
+from nti.app.contenttypes.completion.cache import query_progress_cache
+from nti.app.contenttypes.completion.cache import rebuild_required_state
+from nti.app.contenttypes.completion.cache import invalidate_request_snapshots
+from nti.app.contenttypes.completion.cache import query_progress_aggregate
+
+from nti.app.contenttypes.completion.catalog import query_catalog_rebuild
+
+from nti.app.contenttypes.completion.cleanup import ITEM_CLEANUP
+from nti.app.contenttypes.completion.cleanup import USER_CLEANUP
+
+from nti.app.contenttypes.completion.cleanup import queue_cleanup
+from nti.app.contenttypes.completion.cleanup import user_cleanup_key
+
+from nti.app.contenttypes.completion.cohort import get_aggregate_token
+from nti.app.contenttypes.completion.cohort import build_cohort_aggregate
+from nti.app.contenttypes.completion.cohort import update_cohort_aggregate
+
+from nti.app.contenttypes.completion.interfaces import ICompletionContextCohort
+from nti.app.contenttypes.completion.interfaces import ICompletionContextRequirementsModifiedEvent
+from nti.app.contenttypes.completion.interfaces import ICompletionContextRequiredState
+
+from nti.app.contenttypes.completion.registry import register_completion_context
+from nti.app.contenttypes.completion.registry import unregister_completion_context
+
+from nti.contenttypes.completion.interfaces import ICompletedItem
 from nti.contenttypes.completion.interfaces import ICompletableItem
 from nti.contenttypes.completion.interfaces import ICompletionContext
-from nti.contenttypes.completion.interfaces import ICompletedItemContainer
-
-from nti.contenttypes.completion.utils import get_indexed_completed_items
 
 from nti.coremetadata.interfaces import IUser
-from nti.coremetadata.interfaces import IMarkedForDeletion
+
+from nti.dataserver.users.users import User
 
 from nti.site.interfaces import IHostPolicyFolder
 
+from nti.traversal.traversal import find_interface
+
 logger = __import__('logging').getLogger(__name__)
 
 
 @component.adapter(IUser, IObjectRemovedEvent)
 def _on_user_deleted(user, unused_event=None):
     """
-    When a user is deleted delete its completed items.
+    When a user is deleted queue the removal of its completed items.
     This should be done after all progress events have been fired.
     """
-    logger.info("Removing completed items data for user %s", user)
-    username = user.username
-    # FIXME: Why do we query this potentially large set?
-    # Let's do so based on enrollment if we can. That might be a subscriber
-    # order issue (use enrollment deletion if necessary).
-    items = get_indexed_completed_items((username,))
-    # get completed item containers
-    contexts = {ICompletionContext(x, None) for x in items}
-    containers = {ICompletedItemContainer(x, None) for x in contexts}
-    containers.discard(None)
-    # remove user data
-    for container in containers:
-        container.remove_principal(username)
+    logger.info("Queueing removal of completed items data for user %s", user)
+    queue_cleanup(USER_CLEANUP, user_cleanup_key(user))
 
 
 @component.adapter(ICompletableItem, IObjectRemovedEvent)
 def _on_completable_item_deleted(item, unused_event=None):
     """
-    When a completable item is deleted delete its completed items
+    When a completable item is deleted queue the removal of its completed items
     """
     # We don't want to remove any items during a sync
     if queryInteraction() is not None:
-        logger.info("Removing completed items data for %s", item)
+        logger.info("Queueing removal of completed items data for %s", item)
         site = IHostPolicyFolder(item, None) or getSite()
-        # Don't we just need the completion contexts?
-        items = get_indexed_completed_items(items=(item.ntiid,),
-                                            sites=(site.__name__,))
-        # get completed item containers
-        contexts = {ICompletionContext(x, None) for x in items}
-        # We only need to individually remove items if their contexts
-        # are not also being deleted. Deleting the contexts will clean
-        # these containers anyway, much more efficiently.
-        # Note: the subscriber to clean up a context's completed items
-        # is not yet registered for all completion contexts (for some reason).
-        contexts = {x for x in contexts if not IMarkedForDeletion.providedBy(x)}
-        containers = {ICompletedItemContainer(x, None) for x in contexts}
-        containers.discard(None)
-        # remove item data
-        for container in containers:
-            container.remove_item(item)
+        queue_cleanup(ITEM_CLEANUP, item.ntiid, site.__name__)
+
+
+@component.adapter(ICompletionContext, IIntIdAddedEvent)
+def _on_completion_context_added(context, unused_event=None):
+    register_completion_context(context)
+
+
+@component.adapter(ICompletionContext, IIntIdRemovedEvent)
+def _on_completion_context_removed(context, unused_event=None):
+    unregister_completion_context(context)
+
+
+@component.adapter(ICompletedItem, IObjectModifiedEvent)
+def _on_completed_item_modified(item, unused_event=None):
+    """
+    Remember items reindexed during a catalog rebuild, whose shadow index
+    entries may be stale by the time they are swapped in.
+    """
+    rebuild = query_catalog_rebuild()
+    if rebuild is not None:
+        doc_id = component.getUtility(IIntIds).queryId(item)
+        if doc_id is not None:
+            rebuild.record_modified(doc_id)
+
+
+def _apply_aggregate_updates(pending):
+    """
+    Fold the new progress of every user touched in this transaction into
+    the (current) cohort aggregate of each context.
+    """
+    for context, usernames in pending.values():
+        aggregate = query_progress_aggregate(context)
+        if     aggregate is None \
+            or aggregate.version != get_aggregate_token(context):
+            # Stale aggregates are only rebuilt as a whole
+            continue
+        cohort = None
+        users = []
+        for username in sorted(usernames):
+            user = User.get_user(username)
+            if user is None:
+                aggregate.remove(username)
+                continue
+            cohort = ICompletionContextCohort(context, ()) if cohort is None else cohort
+            if user in cohort:
+                users.append(user)
+            else:
+                # Dropped users no longer count
+                aggregate.remove(username)
+        update_cohort_aggregate(aggregate, context, users)
+
+
+def _queue_aggregate_update(context, username):
+    if query_progress_aggregate(context) is None:
+        return
+    txn = transaction.get()
+    try:
+        pending = txn.data(_apply_aggregate_updates)
+    except KeyError:
+        pending = {}
+        txn.set_data(_apply_aggregate_updates, pending)
+        txn.addBeforeCommitHook(_apply_aggregate_updates, (pending,))
+    pending.setdefault(id(context), (context, set()))[1].add(username)
+
+
+def _rebuild_aggregates(pending):
+    """
+    Rebuild the cohort aggregates of the contexts whose requirements
+    changed in this transaction, once they are settled.
+    """
+    for context in pending.values():
+        aggregate = query_progress_aggregate(context)
+        if aggregate is not None:
+            build_cohort_aggregate(aggregate, context)
+
+
+def _queue_aggregate_rebuild(context):
+    if query_progress_aggregate(context) is None:
+        return
+    txn = transaction.get()
+    try:
+        pending = txn.data(_rebuild_aggregates)
+    except KeyError:
+        pending = {}
+        txn.set_data(_rebuild_aggregates, pending)
+        txn.addBeforeCommitHook(_rebuild_aggregates, (pending,))
+    pending[id(context)] = context
+
+
+def _invalidate_user_progress(container):
+    """
+    Invalidate the progress snapshot of the user owning the given
+    principal completed item container.
+    """
+    context = find_interface(container, ICompletionContext, strict=False)
+    cache = query_progress_cache(context) if context is not None else None
+    username = getattr(container, '__name__', None)
+    if context is not None and username:
+        invalidate_request_snapshots(context, username)
+    if cache is not None and username:
+        cache.invalidate(username)
+        _queue_aggregate_update(context, username)
+
+
+@component.adapter(ICompletedItem, IObjectAddedEvent)
+def _on_completed_item_added(item, event):
+    # Events dispatched to sublocations are about one of our ancestors
+    container = event.newParent if event.object is item else item.__parent__
+    _invalidate_user_progress(container)
+
+
+@component.adapter(ICompletedItem, IObjectRemovedEvent)
+def _on_completed_item_removed(item, event):
+    container = event.oldParent if event.object is item else item.__parent__
+    _invalidate_user_progress(container)
+
+
+@component.adapter(ICompletionContext, ICompletionContextRequirementsModifiedEvent)
+def _on_requirements_modified(context, unused_event=None):
+    state = ICompletionContextRequiredState(context, None)
+    if state is not None:
+        rebuild_required_state(context, state)
+    invalidate_request_snapshots(context)
+    cache = query_progress_cache(context)
+    if cache is not None:
+        cache.invalidate()
+    _queue_aggregate_rebuild(context)
@@ -7,12 +7,45 @@ from __future__ import absolute_import
 
 # pylint: disable=protected-access,too-many-public-methods,arguments-differ
 
+from datetime import datetime
+
+from zope import component
+from zope import interface
+
 from nti.testing.layers import GCLayerMixin
 from nti.testing.layers import ZopeComponentLayer
 from nti.testing.layers import ConfiguringLayerMixin
 
+from nti.app.contenttypes.completion import PROGRESS_PATH_NAME
+from nti.app.contenttypes.completion import COMPLETION_PATH_NAME
+from nti.app.contenttypes.completion import COMPLETION_POLICY_VIEW_NAME
+
+from nti.app.contenttypes.completion.interfaces import IVersionedItemProvider
+from nti.app.contenttypes.completion.interfaces import ICompletionContextCohort
+from nti.app.contenttypes.completion.interfaces import IUserIndependentCompletableItemProvider
+
+from nti.app.contenttypes.completion.tests.interfaces import ITestPersistentCompletionContext
+
+from nti.app.contenttypes.completion.tests.models import PersistentCompletableItem
+from nti.app.contenttypes.completion.tests.models import PersistentCompletionContext
+
 from nti.app.testing.application_webtest import ApplicationTestLayer
 
+from nti.contenttypes.completion.completion import CompletedItem
+
+from nti.contenttypes.completion.interfaces import IPrincipalCompletedItemContainer
+from nti.contenttypes.completion.interfaces import IRequiredCompletableItemProvider
+
+from nti.contenttypes.completion.policies import CompletableItemAggregateCompletionPolicy
+
+from nti.coremetadata.interfaces import IContained
+
+from nti.dataserver.users.users import User
+
+from nti.ntiids.ntiids import find_object_with_ntiid
+
+from nti.ntiids.oids import to_external_ntiid_oid
+
 import zope.testing.cleanup
 
 
@@ -68,3 +101,113 @@ class CompletionTestLayer(ApplicationTestLayer):
     def testTearDown(cls):
         pass
 
+
+#: The usernames of the test cohort and the ntiids of the required items
+COHORT = set()
+REQUIRED = []
+
+
+@interface.implementer(ICompletionContextCohort)
+class _Cohort(object):
+
+    def __init__(self, context):
+        self.context = context
+
+    def iter_entities(self):
+        for username in sorted(COHORT):
+            user = User.get_user(username)
+            if user is not None:
+                yield user
+
+    __iter__ = iter_entities
+
+    def __contains__(self, user):
+        return getattr(user, 'username', user) in COHORT
+
+    def __len__(self):
+        return len(COHORT)
+
+
+@interface.implementer(IRequiredCompletableItemProvider,
+                       IUserIndependentCompletableItemProvider,
+                       IVersionedItemProvider)
+class _RequiredItemProvider(object):
+
+    def __init__(self, context):
+        self.context = context
+
+    @property
+    def version(self):
+        return tuple(REQUIRED)
+
+    def iter_items(self, unused_user):
+        for ntiid in REQUIRED:
+            yield find_object_with_ntiid(ntiid)
+
+
+class CohortTestMixin(object):
+    """
+    Registers a mutable cohort and user independent required items for
+    the test completion contexts.
+    """
+
+    def _register_cohort(self):
+        COHORT.clear()
+        del REQUIRED[:]
+        gsm = component.getGlobalSiteManager()
+        gsm.registerAdapter(_Cohort,
+                            (ITestPersistentCompletionContext,),
+                            ICompletionContextCohort)
+        gsm.registerSubscriptionAdapter(_RequiredItemProvider,
+                                        (ITestPersistentCompletionContext,),
+                                        IRequiredCompletableItemProvider)
+
+    def _unregister_cohort(self):
+        COHORT.clear()
+        del REQUIRED[:]
+        gsm = component.getGlobalSiteManager()
+        gsm.unregisterAdapter(_Cohort,
+                              (ITestPersistentCompletionContext,),
+                              ICompletionContextCohort)
+        gsm.unregisterSubscriptionAdapter(_RequiredItemProvider,
+                                          (ITestPersistentCompletionContext,),
+                                          IRequiredCompletableItemProvider)
+
+    def _create_context(self, container_id, item_count=2):
+        """
+        Create a context and its required items, returning their ntiids.
+        """
+        completion_context = PersistentCompletionContext()
+        completion_context.containerId = container_id
+        interface.alsoProvides(completion_context, IContained)
+        admin = User.get_user('sjohnson@nextthought.com')
+        admin.addContainedObject(completion_context)
+        for idx in range(item_count):
+            item = PersistentCompletableItem('ntiid%s' % idx)
+            item.containerId = container_id
+            admin.addContainedObject(item)
+            item.ntiid = to_external_ntiid_oid(item)
+            REQUIRED.append(item.ntiid)
+        return to_external_ntiid_oid(completion_context), tuple(REQUIRED)
+
+    def _complete(self, username, context_ntiid, item_ntiid, success=True):
+        user = User.get_user(username)
+        completion_context = find_object_with_ntiid(context_ntiid)
+        container = component.getMultiAdapter((user, completion_context),
+                                              IPrincipalCompletedItemContainer)
+        container.add_completed_item(CompletedItem(Principal=user,
+                                                   Item=find_object_with_ntiid(item_ntiid),
+                                                   Success=success,
+                                                   CompletedDate=datetime.utcnow()))
+
+    def _set_policy(self, context_ntiid):
+        policy_url = '/dataserver2/Objects/%s/%s/%s' % (context_ntiid,
+                                                        COMPLETION_PATH_NAME,
+                                                        COMPLETION_POLICY_VIEW_NAME)
+        self.testapp.put_json(policy_url,
+                              {u'MimeType': CompletableItemAggregateCompletionPolicy.mime_type})
+
+    def _progress_url(self, context_ntiid):
+        return '/dataserver2/Objects/%s/%s/%s' % (context_ntiid,
+                                                  COMPLETION_PATH_NAME,
+                                                  PROGRESS_PATH_NAME)
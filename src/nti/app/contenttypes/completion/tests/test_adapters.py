@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+# pylint: disable=protected-access,too-many-public-methods,arguments-differ
+
+from hamcrest import is_
+from hamcrest import contains
+from hamcrest import assert_that
+from hamcrest import same_instance
+
+import unittest
+
+from zope import interface
+
+from nti.app.contenttypes.completion.adapters import shared_item_providers
+from nti.app.contenttypes.completion.adapters import get_item_catalog_values
+
+from nti.app.contenttypes.completion.interfaces import IUserIndependentCompletableItemProvider
+
+from nti.contenttypes.completion.interfaces import ICompletionContext
+from nti.contenttypes.completion.interfaces import IPrincipalCompletedItemContainer
+
+
+class _Provider(object):
+
+    def __init__(self):
+        self.calls = 0
+
+    def iter_items(self, unused_user):
+        self.calls += 1
+        return iter((u'item1', u'item2'))
+
+
+class TestSharedItemProviders(unittest.TestCase):
+
+    def test_shared_item_providers(self):
+        per_user = _Provider()
+        independent = _Provider()
+        interface.alsoProvides(independent, IUserIndependentCompletableItemProvider)
+
+        providers = shared_item_providers((per_user, independent))
+        assert_that(providers[0], same_instance(per_user))
+        for user in (u'user1', u'user2', u'user3'):
+            for provider in providers:
+                assert_that(list(provider.iter_items(user)),
+                            contains(u'item1', u'item2'))
+        assert_that(per_user.calls, is_(3))
+        assert_that(independent.calls, is_(1))
+
+        # Re-wrapping is a no-op
+        assert_that(shared_item_providers(providers)[1],
+                    same_instance(providers[1]))
+
+
+class _Contained(object):
+
+    def __init__(self, parent=None):
+        self.__parent__ = parent
+
+
+class TestItemCatalogValues(unittest.TestCase):
+
+    def test_cached_on_container(self):
+        context = _Contained()
+        context.ntiid = u'tag:nextthought.com,2011-10:context'
+        interface.alsoProvides(context, ICompletionContext)
+        container = _Contained(context)
+        interface.alsoProvides(container, IPrincipalCompletedItemContainer)
+        item1 = _Contained(container)
+        item2 = _Contained(container)
+
+        assert_that(get_item_catalog_values(item1),
+                    is_((context.ntiid, None)))
+        # The second item does not walk its parents
+        context.ntiid = u'tag:nextthought.com,2011-10:other'
+        assert_that(get_item_catalog_values(item2)[0],
+                    is_(u'tag:nextthought.com,2011-10:context'))
@@ -8,15 +8,21 @@ from __future__ import absolute_import
 # pylint: disable=protected-access,too-many-public-methods,arguments-differ
 
 from hamcrest import is_
+from hamcrest import none
+from hamcrest import is_not
 from hamcrest import contains
 from hamcrest import not_none
 from hamcrest import has_entry
+from hamcrest import has_entries
+from hamcrest import has_properties
 from hamcrest import has_length
 from hamcrest import has_key
 from hamcrest import assert_that
 
 import fudge
 
+import json
+
 from datetime import datetime
 
 from zope import interface
@@ -27,12 +33,22 @@ from nti.app.contenttypes.completion import BUILD_COMPLETION_VIEW
 from nti.app.contenttypes.completion import RESET_COMPLETION_VIEW
 from nti.app.contenttypes.completion import USER_DATA_COMPLETION_VIEW
 from nti.app.contenttypes.completion import COMPLETED_ITEMS_PATH_NAME
+from nti.app.contenttypes.completion import COMPLETION_PRINCIPALS_VIEW
+
+from nti.app.contenttypes.completion.build import query_build_state
+from nti.app.contenttypes.completion.build import run_completion_build
+from nti.app.contenttypes.completion.build import start_completion_build
+
+from nti.app.contenttypes.completion.catalog import get_indexed_completion_contexts
 
 from nti.app.contenttypes.completion.tests import CompletionTestLayer
 
 from nti.app.contenttypes.completion.tests.models import PersistentCompletableItem
 from nti.app.contenttypes.completion.tests.models import PersistentCompletionContext
 
+from nti.app.contenttypes.completion.tests import COHORT
+from nti.app.contenttypes.completion.tests import CohortTestMixin
+
 from nti.app.testing.application_webtest import ApplicationLayerTest
 
 from nti.app.testing.decorators import WithSharedApplicationMockDS
@@ -52,6 +68,8 @@ from nti.dataserver.users.users import User
 
 from nti.externalization.interfaces import StandardExternalFields
 
+from nti.ntiids.ntiids import find_object_with_ntiid
+
 from nti.ntiids.oids import to_external_ntiid_oid
 from hamcrest.library.number.ordering_comparison import greater_than
 
@@ -114,6 +132,14 @@ class TestAdminViews(ApplicationLayerTest):
                                                 user2_username,
                                                 USER_DATA_COMPLETION_VIEW)
         
+        # Users with completion data
+        principals_url = '%s/@@%s' % (root_url, COMPLETION_PRINCIPALS_VIEW)
+        res = self.testapp.get(principals_url).json_body
+        assert_that(res[ITEMS], has_entries(user1_username, 1))
+        assert_that(res[ITEMS], is_not(has_key(user2_username)))
+        res = self.testapp.get(principals_url, {'ghosts': True}).json_body
+        assert_that(res[TOTAL], is_(0))
+
         res = self.testapp.get(user1_stats_url).json_body
         assert_that(res['CompletableItems'], has_length(0))
         assert_that(res['CompletedItems'], has_length(1))
@@ -129,6 +155,15 @@ class TestAdminViews(ApplicationLayerTest):
         assert_that(res['CompletedRequiredItems'], has_length(0))
         assert_that(res['IncompleteRequiredItems'], has_length(0))
 
+        # Conditional requests
+        user1_items_url = '%s/users/%s' % (root_url, user1_username)
+        res = self.testapp.get(user1_items_url)
+        etag = res.headers.get('ETag')
+        assert_that(etag, not_none())
+        self.testapp.get(user1_items_url,
+                         headers={'If-None-Match': etag},
+                         status=304)
+
         # check index
         with mock_dataserver.mock_db_trans(self.ds):
             items = get_indexed_completed_items(user1_username)
@@ -139,6 +174,27 @@ class TestAdminViews(ApplicationLayerTest):
         res = self.testapp.post(rebuild_url)
         assert_that(res.json_body,
                     has_entry('Items', has_length(greater_than(1))))
+        assert_that(res.json_body, has_key('MaxRSS'))
+
+        # resumable rebuild
+        self.testapp.get(rebuild_url, status=404)
+        res = self.testapp.post_json(rebuild_url, {'batchSize': 1}).json_body
+        # The live catalog stays intact while the shadow indexes are built
+        with mock_dataserver.mock_db_trans(self.ds):
+            items = get_indexed_completed_items(user1_username)
+            assert_that(items, has_length(1))
+        for _ in range(100):
+            if res['Complete']:
+                break
+            assert_that(res['Processed'], is_(1))
+            res = self.testapp.post_json(rebuild_url, {'batchSize': 1}).json_body
+        assert_that(res['Complete'], is_(True))
+        res = self.testapp.get(rebuild_url).json_body
+        assert_that(res, has_entry('Complete', True))
+        assert_that(res, has_entry(ITEM_COUNT, 1))
+        with mock_dataserver.mock_db_trans(self.ds):
+            items = get_indexed_completed_items(user1_username)
+            assert_that(items, has_length(1))
 
         # Build data
         build_url = '/dataserver2/Objects/%s/%s/%s/@@%s' % (context_ntiid,
@@ -163,6 +219,30 @@ class TestAdminViews(ApplicationLayerTest):
         assert_that(res['UserCount'], is_(0))
         assert_that(res[ITEM_COUNT], is_(0))
 
+        # Resumable build
+        self.testapp.get(build_url, status=404)
+        res = self.testapp.post_json(build_url, {'batchSize': 10}).json_body
+        assert_that(res['Complete'], is_(True))
+        assert_that(res['Processed'], is_(0))
+        res = self.testapp.get(build_url).json_body
+        assert_that(res['Complete'], is_(True))
+
+        # Dry run
+        res = self.testapp.post_json(user1_build_url,
+                                     {'dryRun': True, 'reset': True})
+        assert_that(res.content_type, is_('application/x-ndjson'))
+        lines = [json.loads(x) for x in res.text.splitlines()]
+        assert_that(lines, has_length(2))
+        assert_that(lines[0], has_entries('Username', user1_username,
+                                          'Added', 0,
+                                          'Removed', 1,
+                                          'Changed', 0))
+        assert_that(lines[1]['Total'], has_entries('UserCount', 1,
+                                                   'Removed', 1))
+        # Nothing was written
+        res = self.testapp.get(user1_stats_url).json_body
+        assert_that(res['CompletedItems'], has_length(1))
+
         res = self.testapp.get(user1_stats_url).json_body
         assert_that(res['CompletedItems'], has_length(1))
         assert_that(res['CompletedItems'], contains(item_ntiid1))
@@ -252,6 +332,24 @@ class TestAdminViews(ApplicationLayerTest):
         self.testapp.post_json(reset_url)
         res = self.testapp.get(user1_stats_url).json_body
         assert_that(res['CompletedItems'], has_length(0))
+
+        # Bulk whole context reset
+        with mock_dataserver.mock_db_trans(self.ds):
+            user1 = User.get_user(user1_username)
+            user_container = component.queryMultiAdapter((user1, completion_context),
+                                                         IPrincipalCompletedItemContainer)
+            user_container.add_completed_item(CompletedItem(Principal=user1,
+                                                            Item=item1,
+                                                            CompletedDate=now))
+            items = get_indexed_completed_items(user1_username)
+            assert_that(items, has_length(1))
+
+        self.testapp.post_json(reset_url, {'bulk': True})
+        res = self.testapp.get(user1_stats_url).json_body
+        assert_that(res['CompletedItems'], has_length(0))
+        with mock_dataserver.mock_db_trans(self.ds):
+            items = get_indexed_completed_items(user1_username)
+            assert_that(items, has_length(0))
     
 
     @WithSharedApplicationMockDS(users=True, testapp=True, default_authenticate=True)
@@ -284,8 +382,173 @@ class TestAdminViews(ApplicationLayerTest):
         with mock_dataserver.mock_db_trans(self.ds):
             items = get_indexed_completed_items(user1_username)
             assert_that(items, has_length(1))
+            contexts = get_indexed_completion_contexts(users=(user1_username,))
+            assert_that(contexts, has_length(1))
 
         with mock_dataserver.mock_db_trans(self.ds):
             User.delete_entity(user1_username)
+            # Cleanup is deferred
+            items = get_indexed_completed_items(user1_username)
+            assert_that(items, has_length(1))
+
+        queue_url = '/dataserver2/@@CompletedItemCleanupQueue'
+        res = self.testapp.get(queue_url).json_body
+        assert_that(res[TOTAL], is_(1))
+        assert_that(res[ITEMS][0], has_entries('Kind', 'user',
+                                               'Key', user1_username,
+                                               'CreatedTime', not_none()))
+
+        # Ghosts found from the principal index
+        ghost_url = '/dataserver2/@@RemoveGhostCompletedItemContainers'
+        res = self.testapp.post_json(ghost_url, {'indexed': True,
+                                                 'batchSize': 1}).json_body
+        assert_that(res[ITEMS], contains(user1_username))
+        assert_that(res['Complete'], is_(False))
+        res = self.testapp.post_json(ghost_url, {'indexed': True,
+                                                 'batchSize': 1,
+                                                 'cursor': res['Cursor']}).json_body
+        assert_that(res[ITEMS], has_length(0))
+        assert_that(res['Complete'], is_(True))
+        with mock_dataserver.mock_db_trans(self.ds):
             items = get_indexed_completed_items(user1_username)
             assert_that(items, has_length(0))
+
+        res = self.testapp.post(ghost_url).json_body
+        assert_that(res['Complete'], is_(True))
+
+        res = self.testapp.post(queue_url).json_body
+        assert_that(res[ITEM_COUNT], is_(1))
+        assert_that(res[TOTAL], is_(0))
+
+        with mock_dataserver.mock_db_trans(self.ds):
+            items = get_indexed_completed_items(user1_username)
+            assert_that(items, has_length(0))
+
+    @WithSharedApplicationMockDS(users=True, testapp=True, default_authenticate=True)
+    def test_user_recreated(self):
+        now = datetime.utcnow()
+        username = u'recreated_user'
+        with mock_dataserver.mock_db_trans(self.ds):
+            self._create_user(username)
+            completion_context = PersistentCompletionContext()
+            completion_context.containerId = 'recreated_container'
+            interface.alsoProvides(completion_context, IContained)
+            item1 = PersistentCompletableItem('ntiid1')
+            item2 = PersistentCompletableItem('ntiid2')
+            item1.containerId = item2.containerId = 'recreated_container'
+            admin = User.get_user('sjohnson@nextthought.com')
+            for x in (completion_context, item1, item2):
+                admin.addContainedObject(x)
+            item1.ntiid = to_external_ntiid_oid(item1)
+            item2.ntiid = item2_ntiid = to_external_ntiid_oid(item2)
+            context_ntiid = to_external_ntiid_oid(completion_context)
+            user = User.get_user(username)
+            container = component.getMultiAdapter((user, completion_context),
+                                                  IPrincipalCompletedItemContainer)
+            container.add_completed_item(CompletedItem(Principal=user,
+                                                       Item=item1,
+                                                       CompletedDate=now))
+
+        with mock_dataserver.mock_db_trans(self.ds):
+            User.delete_entity(username)
+
+        # The username is reused before the cleanup runs
+        with mock_dataserver.mock_db_trans(self.ds):
+            user = self._create_user(username)
+            completion_context = find_object_with_ntiid(context_ntiid)
+            container = component.getMultiAdapter((user, completion_context),
+                                                  IPrincipalCompletedItemContainer)
+            container.add_completed_item(CompletedItem(Principal=user,
+                                                       Item=find_object_with_ntiid(item2_ntiid),
+                                                       CompletedDate=now))
+            assert_that(get_indexed_completed_items(username), has_length(2))
+
+        res = self.testapp.post('/dataserver2/@@CompletedItemCleanupQueue').json_body
+        assert_that(res[ITEM_COUNT], is_(1))
+
+        # Only the items of the deleted principal are gone
+        with mock_dataserver.mock_db_trans(self.ds):
+            items = get_indexed_completed_items(username)
+            assert_that([x.item_ntiid for x in items], contains(item2_ntiid))
+
+
+class TestResumableBuild(ApplicationLayerTest, CohortTestMixin):
+
+    layer = CompletionTestLayer
+
+    def setUp(self):
+        super(TestResumableBuild, self).setUp()
+        self._register_cohort()
+
+    def tearDown(self):
+        self._unregister_cohort()
+        super(TestResumableBuild, self).tearDown()
+
+    @WithSharedApplicationMockDS(users=True, testapp=True, default_authenticate=True)
+    def test_resumable_build(self):
+        usernames = (u'build_user1', u'build_user2', u'build_user3')
+        with mock_dataserver.mock_db_trans(self.ds):
+            for username in usernames:
+                self._create_user(username)
+            context_ntiid, unused_items = self._create_context('build_container')
+        COHORT.update(usernames)
+        build_url = '/dataserver2/Objects/%s/%s/%s/@@%s' % (context_ntiid,
+                                                            COMPLETION_PATH_NAME,
+                                                            COMPLETED_ITEMS_PATH_NAME,
+                                                            BUILD_COMPLETION_VIEW)
+        self.testapp.post_json(build_url, {'batchSize': 2, 'workers': 'many'},
+                               status=422)
+        self.testapp.get(build_url, status=404)
+
+        # The cursor resumes over the usernames snapshotted by the first
+        # chunk; later cohort changes are not picked up
+        res = self.testapp.post_json(build_url, {'batchSize': 2}).json_body
+        assert_that(res, has_entries('Complete', False,
+                                     'Processed', 2,
+                                     'SkipCurrent', False))
+        COHORT.add(u'build_user4')
+        res = self.testapp.post_json(build_url, {'batchSize': 2}).json_body
+        assert_that(res, has_entries('Complete', True,
+                                     'Processed', 1,
+                                     'UserCount', 3))
+        assert_that(res[ITEMS], has_entry('0', has_entry('Last', u'build_user3')))
+
+        # Users are rebuilt unless asked to skip the current ones
+        res = self.testapp.post_json(build_url, {'batchSize': 5}).json_body
+        assert_that(res, has_entries('Processed', 3,
+                                     'SkippedCount', 0))
+        res = self.testapp.post_json(build_url, {'batchSize': 5,
+                                                 'skipCurrent': True}).json_body
+        assert_that(res, has_entries('Complete', True,
+                                     'Processed', 0,
+                                     'SkippedCount', 3,
+                                     'SkipCurrent', True))
+
+    @WithSharedApplicationMockDS(users=True, testapp=False)
+    def test_run_completion_build(self):
+        usernames = (u'run_build_user1', u'run_build_user2', u'run_build_user3')
+        with mock_dataserver.mock_db_trans(self.ds):
+            for username in usernames:
+                self._create_user(username)
+            context_ntiid, unused_items = self._create_context('run_build_container')
+            COHORT.update(usernames)
+            start_completion_build(find_object_with_ntiid(context_ntiid),
+                                   workers=2)
+
+        first = run_completion_build(context_ntiid, worker=0, batch_size=1)
+        with mock_dataserver.mock_db_trans(self.ds):
+            build = query_build_state(find_object_with_ntiid(context_ntiid)).current
+            assert_that(build.query_cursor(0).complete, is_(True))
+            # The other partition is left alone
+            assert_that(build.query_cursor(1), is_(none()))
+            assert_that(build.complete, is_(False))
+
+        second = run_completion_build(context_ntiid, worker=1, batch_size=1)
+        assert_that(first + second, is_(len(usernames)))
+        with mock_dataserver.mock_db_trans(self.ds):
+            build = query_build_state(find_object_with_ntiid(context_ntiid)).current
+            assert_that(build, has_properties('complete', True,
+                                              'count', len(usernames)))
+
+        # Nothing left to build
+        assert_that(run_completion_build(context_ntiid, worker=0), is_(0))
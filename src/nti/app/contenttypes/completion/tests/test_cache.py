@@ -0,0 +1,291 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+# pylint: disable=protected-access,too-many-public-methods,arguments-differ
+
+from hamcrest import is_
+from hamcrest import none
+from hamcrest import is_not
+from hamcrest import same_instance
+from hamcrest import not_none
+from hamcrest import assert_that
+from hamcrest import has_length
+from hamcrest import has_entries
+
+import fudge
+import unittest
+
+from datetime import datetime
+
+from zope import component
+from zope import interface
+
+from zope.event import notify
+
+from nti.app.contenttypes.completion.adapters import CompletionContextProgressFactory
+
+from nti.app.contenttypes.completion.cache import get_required_state
+from nti.app.contenttypes.completion.cache import query_required_state
+from nti.app.contenttypes.completion.cache import CompletionContextRequiredState
+from nti.app.contenttypes.completion.cache import CompletionContextProgressAggregate
+
+from nti.app.contenttypes.completion.interfaces import ICompletionContextProgressCache
+from nti.app.contenttypes.completion.interfaces import IUserIndependentCompletableItemProvider
+from nti.app.contenttypes.completion.interfaces import CompletionContextRequirementsModifiedEvent
+
+from nti.app.contenttypes.completion.tests import CompletionTestLayer
+
+from nti.app.contenttypes.completion.tests.models import PersistentCompletableItem
+from nti.app.contenttypes.completion.tests.models import PersistentCompletionContext
+
+from nti.app.testing.application_webtest import ApplicationLayerTest
+
+from nti.app.testing.decorators import WithSharedApplicationMockDS
+
+from nti.contenttypes.completion.completion import CompletedItem
+
+from nti.contenttypes.completion.interfaces import ICompletionContext
+from nti.contenttypes.completion.interfaces import ICompletedItemProvider
+from nti.contenttypes.completion.interfaces import IRequiredCompletableItemProvider
+from nti.contenttypes.completion.interfaces import IPrincipalCompletedItemContainer
+
+from nti.coremetadata.interfaces import IContained
+
+from nti.dataserver.interfaces import IUser
+
+from nti.dataserver.tests import mock_dataserver
+
+from nti.dataserver.users.users import User
+
+
+class TestProgressCache(ApplicationLayerTest):
+
+    layer = CompletionTestLayer
+
+    @WithSharedApplicationMockDS(users=True, testapp=False)
+    def test_progress_cache(self):
+        admin_username = 'sjohnson@nextthought.com'
+        user1_username = 'cache_user1'
+        with mock_dataserver.mock_db_trans(self.ds):
+            user1 = self._create_user(user1_username)
+            completion_context = PersistentCompletionContext()
+            completion_context.containerId = 'container_id'
+            interface.alsoProvides(completion_context, IContained)
+            item1 = PersistentCompletableItem('ntiid1')
+            item1.containerId = 'container_id'
+            user = User.get_user(admin_username)
+            for x in (completion_context, item1):
+                user.addContainedObject(x)
+
+            cache = ICompletionContextProgressCache(completion_context)
+            factory = CompletionContextProgressFactory(user1, completion_context)
+            token = factory.snapshot_token
+            assert_that(token, not_none())
+            assert_that(cache.get_snapshot(user1_username, token), none())
+
+            factory()
+            assert_that(cache.get_snapshot(user1_username, token), not_none())
+            # Snapshots are only valid for their token
+            assert_that(cache.get_snapshot(user1_username), none())
+
+            # Completing an item invalidates the user snapshot
+            user_container = component.getMultiAdapter((user1, completion_context),
+                                                       IPrincipalCompletedItemContainer)
+            user_container.add_completed_item(CompletedItem(Principal=user1,
+                                                            Item=item1,
+                                                            CompletedDate=datetime.utcnow()))
+            assert_that(cache.get_snapshot(user1_username, token), none())
+
+            # Requirement changes invalidate everything
+            factory = CompletionContextProgressFactory(user1, completion_context)
+            factory()
+            token = factory.snapshot_token
+            assert_that(cache.get_snapshot(user1_username, token), not_none())
+            version = cache.version
+            notify(CompletionContextRequirementsModifiedEvent(completion_context))
+            assert_that(cache.version, is_(version + 1))
+            assert_that(cache.get_snapshot(user1_username, token), none())
+            factory = CompletionContextProgressFactory(user1, completion_context)
+            assert_that(factory.snapshot_token, is_not(token))
+
+    @WithSharedApplicationMockDS(users=True, testapp=False)
+    def test_unversioned_provider(self):
+        admin_username = 'sjohnson@nextthought.com'
+        user1_username = 'cache_user2'
+        with mock_dataserver.mock_db_trans(self.ds):
+            user1 = self._create_user(user1_username)
+            completion_context = PersistentCompletionContext()
+            completion_context.containerId = 'container_id2'
+            interface.alsoProvides(completion_context, IContained)
+            User.get_user(admin_username).addContainedObject(completion_context)
+
+            @interface.implementer(ICompletedItemProvider)
+            class _Provider(object):
+
+                def __init__(self, *args):
+                    pass
+
+                def completed_items(self):
+                    return ()
+
+            gsm = component.getGlobalSiteManager()
+            gsm.registerSubscriptionAdapter(_Provider,
+                                            (IUser, ICompletionContext),
+                                            ICompletedItemProvider)
+            try:
+                factory = CompletionContextProgressFactory(user1, completion_context)
+                assert_that(factory.snapshot_token, none())
+                factory()
+                cache = ICompletionContextProgressCache(completion_context)
+                assert_that(cache, has_length(0))
+            finally:
+                gsm.unregisterSubscriptionAdapter(_Provider,
+                                                  (IUser, ICompletionContext),
+                                                  ICompletedItemProvider)
+
+
+    @WithSharedApplicationMockDS(users=True, testapp=False)
+    def test_unversioned_required_provider(self):
+        admin_username = 'sjohnson@nextthought.com'
+        user1_username = 'cache_user3'
+        with mock_dataserver.mock_db_trans(self.ds):
+            user1 = self._create_user(user1_username)
+            completion_context = PersistentCompletionContext()
+            completion_context.containerId = 'container_id3'
+            interface.alsoProvides(completion_context, IContained)
+            admin = User.get_user(admin_username)
+            admin.addContainedObject(completion_context)
+            items = []
+            for ntiid in ('ntiid1', 'ntiid2'):
+                item = PersistentCompletableItem(ntiid)
+                item.containerId = 'container_id3'
+                admin.addContainedObject(item)
+                items.append(item)
+            required = [items[0]]
+
+            @interface.implementer(IRequiredCompletableItemProvider,
+                                   IUserIndependentCompletableItemProvider)
+            class _Provider(object):
+
+                def __init__(self, *args):
+                    pass
+
+                def iter_items(self, unused_user):
+                    return list(required)
+
+            gsm = component.getGlobalSiteManager()
+            gsm.registerSubscriptionAdapter(_Provider,
+                                            (ICompletionContext,),
+                                            IRequiredCompletableItemProvider)
+            try:
+                factory = CompletionContextProgressFactory(user1, completion_context)
+                assert_that(factory.snapshot_token, none())
+                max_progress = factory().MaxPossibleProgress
+                cache = ICompletionContextProgressCache(completion_context)
+                assert_that(cache, has_length(0))
+
+                # New provider items are never hidden by a snapshot
+                required.append(items[1])
+                factory = CompletionContextProgressFactory(user1, completion_context)
+                assert_that(factory().MaxPossibleProgress, is_(max_progress + 1))
+            finally:
+                gsm.unregisterSubscriptionAdapter(_Provider,
+                                                  (ICompletionContext,),
+                                                  IRequiredCompletableItemProvider)
+
+
+class TestProgressAggregate(unittest.TestCase):
+
+    def test_counters(self):
+        aggregate = CompletionContextProgressAggregate()
+        aggregate.reset(1)
+        aggregate.update(u'user1', (0.5, True, False, False))
+        aggregate.update(u'user2', (1.0, True, True, True))
+        aggregate.update(u'user3', (0.0, False, False, False))
+        assert_that(aggregate.TotalUsers, is_(3))
+        assert_that(aggregate.CountHasProgress, is_(2))
+        assert_that(aggregate.CountCompleted, is_(1))
+        assert_that(aggregate.CountSuccess, is_(1))
+        assert_that(aggregate.accumulated_progress(), is_(1.5))
+        assert_that(aggregate.distribution(50),
+                    has_entries(0.0, 1, 0.5, 1, 1.0, 1))
+
+        # Replacing a contribution moves the user between buckets
+        aggregate.update(u'user1', (1.0, True, True, False))
+        assert_that(aggregate.TotalUsers, is_(3))
+        assert_that(aggregate.CountCompleted, is_(2))
+        assert_that(aggregate.distribution(50),
+                    has_entries(0.0, 1, 0.5, 0, 1.0, 2))
+
+        aggregate.remove(u'user2')
+        assert_that(aggregate.TotalUsers, is_(2))
+        assert_that(aggregate.CountSuccess, is_(0))
+        assert_that(aggregate.accumulated_progress(), is_(1.0))
+
+
+class TestRequiredState(unittest.TestCase):
+
+    def test_get_state(self):
+        item1 = PersistentCompletableItem(u'ntiid1')
+        item2 = PersistentCompletableItem(u'ntiid2')
+        item3 = PersistentCompletableItem(u'ntiid3')
+        for item in (item1, item2, item3):
+            item.mime_type = u'application/vnd.nextthought.completion.test'
+        state = CompletionContextRequiredState()
+        state.reset({u'ntiid1': True, u'ntiid2': False},
+                    (u'application/vnd.nextthought.completion.test',))
+        assert_that(state.version, is_(1))
+        assert_that(state.get_state(item1), is_((True, True, False)))
+        assert_that(state.get_state(item2), is_((False, True, False)))
+        assert_that(state.get_state(item3), is_((True, True, True)))
+        assert_that(state.is_default_state(u'ntiid3'), is_(True))
+
+        state.reset({}, ())
+        assert_that(state.version, is_(2))
+        assert_that(state.is_item_required(item1), is_(False))
+
+
+class _Request(object):
+    method = 'GET'
+
+
+class TestStoredRequiredState(ApplicationLayerTest):
+
+    layer = CompletionTestLayer
+
+    @WithSharedApplicationMockDS(users=True, testapp=False)
+    @fudge.patch('nti.app.contenttypes.completion.cache.get_current_request')
+    def test_read_only_requests(self, mock_request):
+        request = _Request()
+        mock_request.is_callable().returns(request)
+        with mock_dataserver.mock_db_trans(self.ds):
+            completion_context = PersistentCompletionContext()
+            completion_context.containerId = 'container_id'
+            interface.alsoProvides(completion_context, IContained)
+            User.get_user('sjohnson@nextthought.com').addContainedObject(completion_context)
+
+            # Reads do not store the map, but build it once per request
+            state = get_required_state(completion_context)
+            assert_that(state.version, is_(1))
+            assert_that(query_required_state(completion_context), none())
+            assert_that(get_required_state(completion_context),
+                        same_instance(state))
+
+            # Writes store it
+            request.method = 'POST'
+            stored = get_required_state(completion_context)
+            assert_that(query_required_state(completion_context),
+                        same_instance(stored))
+
+            # And reads use the current stored map
+            request.method = 'GET'
+            assert_that(get_required_state(completion_context),
+                        same_instance(stored))
+
+            # Modified requirements rebuild the stored map
+            notify(CompletionContextRequirementsModifiedEvent(completion_context))
+            assert_that(stored.version, is_(2))
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+# pylint: disable=protected-access,too-many-public-methods,arguments-differ
+
+from hamcrest import is_
+from hamcrest import none
+from hamcrest import contains
+from hamcrest import not_none
+from hamcrest import assert_that
+from hamcrest import instance_of
+
+import unittest
+
+from datetime import datetime
+
+from zope import component
+from zope import interface
+
+from zope.event import notify
+
+from zope.intid.interfaces import IIntIds
+
+from zope.lifecycleevent import ObjectModifiedEvent
+
+from nti.app.contenttypes.completion.catalog import BulkIndexer
+from nti.app.contenttypes.completion.catalog import ShadowCatalog
+
+from nti.app.contenttypes.completion.catalog import start_catalog_rebuild
+from nti.app.contenttypes.completion.catalog import process_catalog_rebuild
+from nti.app.contenttypes.completion.catalog import reset_context_completed_items
+from nti.app.contenttypes.completion.catalog import get_context_principal_counts
+from nti.app.contenttypes.completion.catalog import get_context_completed_item_documents
+
+from nti.app.contenttypes.completion.tests import CompletionTestLayer
+
+from nti.app.contenttypes.completion.tests.models import PersistentCompletableItem
+from nti.app.contenttypes.completion.tests.models import PersistentCompletionContext
+
+from nti.app.testing.application_webtest import ApplicationLayerTest
+
+from nti.app.testing.decorators import WithSharedApplicationMockDS
+
+from nti.contenttypes.completion.completion import CompletedItem
+from nti.contenttypes.completion.completion import AwardedCompletedItem
+
+from nti.contenttypes.completion.index import IX_SUCCESS
+from nti.contenttypes.completion.index import IX_COMPLETIONTIME
+
+from nti.contenttypes.completion.index import get_completed_item_catalog
+
+from nti.contenttypes.completion.interfaces import IPrincipalCompletedItemContainer
+from nti.contenttypes.completion.interfaces import IPrincipalAwardedCompletedItemContainer
+
+from nti.coremetadata.interfaces import IContained
+
+from nti.dataserver.interfaces import IDataserver
+
+from nti.dataserver.tests import mock_dataserver
+
+from nti.dataserver.users.users import User
+
+from nti.ntiids.oids import to_external_ntiid_oid
+
+
+class _Index(object):
+
+    def __init__(self):
+        self.docs = []
+
+    def index_doc(self, doc_id, obj):
+        self.docs.append((doc_id, obj))
+
+
+class TestBulkIndexer(unittest.TestCase):
+
+    def test_indexer(self):
+        catalog = {'a': _Index(), 'b': _Index()}
+        metadata = _Index()
+        indexer = BulkIndexer(catalog, metadata, batch_size=10)
+        indexer.add(3, 'three', {'b': 'shared'})
+        indexer.add(1, 'one', {'b': 'shared'})
+        assert_that(catalog['a'].docs, is_([]))
+
+        assert_that(indexer.flush(), is_(2))
+        assert_that(indexer.count, is_(2))
+        # In doc id order, with the shared values
+        assert_that(catalog['a'].docs, contains((1, 'one'), (3, 'three')))
+        assert_that(catalog['b'].docs, contains((1, 'shared'), (3, 'shared')))
+        assert_that(metadata.docs, contains((1, 'one'), (3, 'three')))
+        assert_that(indexer.flush(), is_(0))
+
+
+class TestShadowRebuild(ApplicationLayerTest):
+
+    layer = CompletionTestLayer
+
+    @WithSharedApplicationMockDS(users=True, testapp=False)
+    def test_rebuild(self):
+        with mock_dataserver.mock_db_trans(self.ds):
+            user1 = self._create_user(u'shadow_user1')
+            completion_context = PersistentCompletionContext()
+            completion_context.containerId = 'shadow_container'
+            interface.alsoProvides(completion_context, IContained)
+            item1 = PersistentCompletableItem('ntiid1')
+            item1.containerId = 'shadow_container'
+            admin = User.get_user(u'sjohnson@nextthought.com')
+            for x in (completion_context, item1):
+                admin.addContainedObject(x)
+            item1.ntiid = to_external_ntiid_oid(item1)
+            container = component.getMultiAdapter((user1, completion_context),
+                                                  IPrincipalCompletedItemContainer)
+            completed_item = CompletedItem(Principal=user1,
+                                           Item=item1,
+                                           Success=True,
+                                           CompletedDate=datetime.utcnow())
+            container.add_completed_item(completed_item)
+            doc_id = component.getUtility(IIntIds).getId(completed_item)
+
+            catalog = get_completed_item_catalog()
+            folder = component.getUtility(IDataserver).dataserver_folder
+            rebuild = start_catalog_rebuild(folder)
+            # Shadows are built like the live indexes
+            for name, index in catalog.items():
+                assert_that(rebuild.indexes[name], instance_of(type(index)))
+            assert_that(rebuild.indexes[IX_COMPLETIONTIME].index, not_none())
+
+            # As a chunk would
+            ShadowCatalog(rebuild.indexes).index_doc(doc_id, completed_item)
+
+            # Items reindexed meanwhile are reconciled when swapping
+            completed_item.Success = False
+            notify(ObjectModifiedEvent(completed_item))
+            assert_that(list(rebuild.modified), contains(doc_id))
+
+            process_catalog_rebuild(rebuild)
+            assert_that(rebuild.complete, is_(True))
+            assert_that(catalog[IX_SUCCESS].documents_to_values.get(doc_id),
+                        is_(False))
+
+
+class TestContextDocuments(ApplicationLayerTest):
+
+    layer = CompletionTestLayer
+
+    @WithSharedApplicationMockDS(users=True, testapp=False)
+    def test_awarded_excluded(self):
+        username = u'documents_user1'
+        now = datetime.utcnow()
+        with mock_dataserver.mock_db_trans(self.ds):
+            user = self._create_user(username)
+            completion_context = PersistentCompletionContext()
+            completion_context.containerId = 'documents_container'
+            interface.alsoProvides(completion_context, IContained)
+            item1 = PersistentCompletableItem('ntiid1')
+            item2 = PersistentCompletableItem('ntiid2')
+            item1.containerId = item2.containerId = 'documents_container'
+            admin = User.get_user(u'sjohnson@nextthought.com')
+            for x in (completion_context, item1, item2):
+                admin.addContainedObject(x)
+            item1.ntiid = to_external_ntiid_oid(item1)
+            item2.ntiid = to_external_ntiid_oid(item2)
+
+            completed = CompletedItem(Principal=user, Item=item1,
+                                      CompletedDate=now)
+            container = component.getMultiAdapter((user, completion_context),
+                                                  IPrincipalCompletedItemContainer)
+            container.add_completed_item(completed)
+            awarded = AwardedCompletedItem(Principal=user, Item=item2,
+                                           CompletedDate=now,
+                                           awarder=admin,
+                                           reason=u'awarded')
+            container = component.getMultiAdapter((user, completion_context),
+                                                  IPrincipalAwardedCompletedItemContainer)
+            container.add_completed_item(awarded)
+
+            intids = component.getUtility(IIntIds)
+            assert_that(list(get_context_completed_item_documents(completion_context)),
+                        contains(intids.getId(completed)))
+            assert_that(get_context_principal_counts(completion_context),
+                        is_({username: 1}))
+
+            # Only the completed items are dropped
+            assert_that(reset_context_completed_items(completion_context), is_(1))
+            assert_that(intids.queryId(completed), is_(none()))
+            assert_that(intids.queryId(awarded), not_none())
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+# pylint: disable=protected-access,too-many-public-methods,arguments-differ
+
+from hamcrest import is_
+from hamcrest import contains
+from hamcrest import has_length
+from hamcrest import assert_that
+from hamcrest import contains_string
+
+from datetime import datetime
+
+from zope import component
+from zope import interface
+
+from nti.app.contenttypes.completion.cleanup import ITEM_CLEANUP
+
+from nti.app.contenttypes.completion.cleanup import _DeletedItem
+from nti.app.contenttypes.completion.cleanup import queue_cleanup
+from nti.app.contenttypes.completion.cleanup import query_cleanup_queue
+from nti.app.contenttypes.completion.cleanup import drain_cleanup_queue
+
+from nti.app.contenttypes.completion.tests import CompletionTestLayer
+
+from nti.app.contenttypes.completion.tests.models import PersistentCompletableItem
+from nti.app.contenttypes.completion.tests.models import PersistentCompletionContext
+
+from nti.app.testing.application_webtest import ApplicationLayerTest
+
+from nti.app.testing.decorators import WithSharedApplicationMockDS
+
+from nti.contenttypes.completion.completion import CompletedItem
+
+from nti.contenttypes.completion.interfaces import IPrincipalCompletedItemContainer
+
+from nti.contenttypes.completion.utils import get_indexed_completed_items
+
+from nti.coremetadata.interfaces import IContained
+
+from nti.dataserver.tests import mock_dataserver
+
+from nti.dataserver.users.users import User
+
+from nti.ntiids.ntiids import find_object_with_ntiid
+
+from nti.ntiids.oids import to_external_ntiid_oid
+
+
+class TestCleanup(ApplicationLayerTest):
+
+    layer = CompletionTestLayer
+
+    @WithSharedApplicationMockDS(users=True, testapp=False)
+    def test_item_cleanup(self):
+        username = u'cleanup_user1'
+        with mock_dataserver.mock_db_trans(self.ds):
+            user = self._create_user(username)
+            completion_context = PersistentCompletionContext()
+            completion_context.containerId = 'cleanup_container'
+            interface.alsoProvides(completion_context, IContained)
+            item1 = PersistentCompletableItem('ntiid1')
+            item2 = PersistentCompletableItem('ntiid2')
+            item1.containerId = item2.containerId = 'cleanup_container'
+            admin = User.get_user(u'sjohnson@nextthought.com')
+            for x in (completion_context, item1, item2):
+                admin.addContainedObject(x)
+            item1.ntiid = item1_ntiid = to_external_ntiid_oid(item1)
+            item2.ntiid = item2_ntiid = to_external_ntiid_oid(item2)
+            context_ntiid = to_external_ntiid_oid(completion_context)
+            container = component.getMultiAdapter((user, completion_context),
+                                                  IPrincipalCompletedItemContainer)
+            for item in (item1, item2):
+                container.add_completed_item(CompletedItem(Principal=user,
+                                                           Item=item,
+                                                           CompletedDate=datetime.utcnow()))
+
+        # Queued as when item1 is deleted
+        with mock_dataserver.mock_db_trans(self.ds):
+            assert_that(queue_cleanup(ITEM_CLEANUP, item1_ntiid), is_(True))
+            assert_that(queue_cleanup(ITEM_CLEANUP, item1_ntiid), is_(False))
+            assert_that(query_cleanup_queue(), has_length(1))
+
+        # Nothing drains the queue until asked to
+        with mock_dataserver.mock_db_trans(self.ds):
+            assert_that(query_cleanup_queue(), has_length(1))
+
+        assert_that(drain_cleanup_queue(), is_(1))
+
+        with mock_dataserver.mock_db_trans(self.ds):
+            assert_that(query_cleanup_queue(), has_length(0))
+            items = get_indexed_completed_items(username)
+            assert_that(items, has_length(1))
+            user = User.get_user(username)
+            completion_context = find_object_with_ntiid(context_ntiid)
+            container = component.getMultiAdapter((user, completion_context),
+                                                  IPrincipalCompletedItemContainer)
+            assert_that(list(container), contains(item2_ntiid))
+
+        assert_that(repr(_DeletedItem(item1_ntiid)),
+                    contains_string(item1_ntiid))
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+# pylint: disable=protected-access,too-many-public-methods,arguments-differ
+
+from hamcrest import is_
+from hamcrest import none
+from hamcrest import contains
+from hamcrest import not_none
+from hamcrest import has_length
+from hamcrest import assert_that
+
+from datetime import datetime
+
+from zope import component
+from zope import interface
+
+from nti.app.contenttypes.completion.adapters import CompletionContextProgressFactory
+
+from nti.app.contenttypes.completion.cohort import CohortProgressEngine
+from nti.app.contenttypes.completion.cohort import iter_cohort_progress
+from nti.app.contenttypes.completion.cohort import has_principal_completed_items_only
+
+from nti.app.contenttypes.completion.tests import CompletionTestLayer
+
+from nti.app.contenttypes.completion.tests.models import PersistentCompletableItem
+from nti.app.contenttypes.completion.tests.models import PersistentCompletionContext
+
+from nti.app.contenttypes.completion.tests import COHORT
+from nti.app.contenttypes.completion.tests import CohortTestMixin
+
+from nti.app.testing.application_webtest import ApplicationLayerTest
+
+from nti.app.testing.decorators import WithSharedApplicationMockDS
+
+from nti.contenttypes.completion.completion import CompletedItem
+from nti.contenttypes.completion.completion import AwardedCompletedItem
+
+from nti.contenttypes.completion.interfaces import ICompletionContext
+from nti.contenttypes.completion.interfaces import ICompletedItemProvider
+from nti.contenttypes.completion.interfaces import IPrincipalCompletedItemContainer
+from nti.contenttypes.completion.interfaces import IPrincipalAwardedCompletedItemContainer
+
+from nti.coremetadata.interfaces import IContained
+
+from nti.dataserver.interfaces import IUser
+
+from nti.dataserver.tests import mock_dataserver
+
+from nti.dataserver.users.users import User
+
+from nti.ntiids.ntiids import find_object_with_ntiid
+
+from nti.ntiids.oids import to_external_ntiid_oid
+
+
+class TestCohortProgressEngine(ApplicationLayerTest):
+
+    layer = CompletionTestLayer
+
+    @WithSharedApplicationMockDS(users=True, testapp=False)
+    def test_engine(self):
+        now = datetime.utcnow()
+        admin_username = 'sjohnson@nextthought.com'
+        with mock_dataserver.mock_db_trans(self.ds):
+            user1 = self._create_user(u'cohort_user1')
+            user2 = self._create_user(u'cohort_user2')
+            completion_context = PersistentCompletionContext()
+            completion_context.containerId = 'container_id'
+            interface.alsoProvides(completion_context, IContained)
+            item1 = PersistentCompletableItem('ntiid1')
+            item2 = PersistentCompletableItem('ntiid2')
+            item1.containerId = item2.containerId = 'container_id'
+            admin = User.get_user(admin_username)
+            for x in (completion_context, item1, item2):
+                admin.addContainedObject(x)
+            item1.ntiid = to_external_ntiid_oid(item1)
+            item2.ntiid = to_external_ntiid_oid(item2)
+
+            for user, success in ((user1, True), (user2, False)):
+                container = component.getMultiAdapter((user, completion_context),
+                                                      IPrincipalCompletedItemContainer)
+                container.add_completed_item(CompletedItem(Principal=user,
+                                                           Item=item1,
+                                                           Success=success,
+                                                           CompletedDate=now))
+
+            engine = CohortProgressEngine(completion_context,
+                                          (item1.ntiid, item2.ntiid))
+            result = engine((u'cohort_user1', u'cohort_user2', u'dne'))
+
+            snapshot = result[u'cohort_user1']
+            assert_that(snapshot['AbsoluteProgress'], is_(1))
+            assert_that(snapshot['MaxPossibleProgress'], is_(2))
+            assert_that(snapshot['UnsuccessfulItemNTIIDs'], has_length(0))
+            assert_that(snapshot['IncompleteItemNTIIDs'], contains(item2.ntiid))
+
+            snapshot = result[u'cohort_user2']
+            assert_that(snapshot['AbsoluteProgress'], is_(1))
+            assert_that(snapshot['UnsuccessfulItemNTIIDs'], contains(item1.ntiid))
+
+            snapshot = result[u'dne']
+            assert_that(snapshot['AbsoluteProgress'], is_(0))
+            assert_that(snapshot['IncompleteItemNTIIDs'], has_length(2))
+
+
+class TestCohortProgress(ApplicationLayerTest, CohortTestMixin):
+
+    layer = CompletionTestLayer
+
+    def setUp(self):
+        super(TestCohortProgress, self).setUp()
+        self._register_cohort()
+
+    def tearDown(self):
+        self._unregister_cohort()
+        super(TestCohortProgress, self).tearDown()
+
+    @WithSharedApplicationMockDS(users=True, testapp=True, default_authenticate=True)
+    def test_engine_matches_factory(self):
+        usernames = (u'engine_user1', u'engine_user2', u'engine_user3')
+        with mock_dataserver.mock_db_trans(self.ds):
+            for username in usernames:
+                self._create_user(username)
+            context_ntiid, (item1, item2) = self._create_context('engine_container')
+            self._complete(usernames[0], context_ntiid, item1)
+            self._complete(usernames[0], context_ntiid, item2, success=False)
+            self._complete(usernames[1], context_ntiid, item1)
+        COHORT.update(usernames)
+        self._set_policy(context_ntiid)
+
+        with mock_dataserver.mock_db_trans(self.ds):
+            # Awarded items are not user completed items
+            user2 = User.get_user(usernames[1])
+            completion_context = find_object_with_ntiid(context_ntiid)
+            container = component.getMultiAdapter((user2, completion_context),
+                                                  IPrincipalAwardedCompletedItemContainer)
+            container.add_completed_item(AwardedCompletedItem(Principal=user2,
+                                                              Item=find_object_with_ntiid(item2),
+                                                              CompletedDate=datetime.utcnow(),
+                                                              awarder=User.get_user(u'sjohnson@nextthought.com'),
+                                                              reason=u'awarded'))
+
+        with mock_dataserver.mock_db_trans(self.ds):
+            completion_context = find_object_with_ntiid(context_ntiid)
+            users = [User.get_user(x) for x in usernames]
+            engine = dict(iter_cohort_progress(completion_context, users))
+            for user in users:
+                expected = CompletionContextProgressFactory(user, completion_context)()
+                progress = engine[user]
+                assert_that(progress.AbsoluteProgress,
+                            is_(expected.AbsoluteProgress))
+                assert_that(progress.PercentageProgress,
+                            is_(expected.PercentageProgress))
+                assert_that(progress.Completed, is_(expected.Completed))
+                assert_that(progress.LastModified, is_(expected.LastModified))
+                assert_that(progress.UnsuccessfulItemNTIIDs,
+                            is_(expected.UnsuccessfulItemNTIIDs))
+            assert_that(engine[users[0]].AbsoluteProgress, is_(2))
+            assert_that(engine[users[0]].LastModified, not_none())
+            assert_that(engine[users[1]].AbsoluteProgress, is_(1))
+            assert_that(engine[users[2]].LastModified, none())
+
+            # Other completed item providers make us use the factory
+            @interface.implementer(ICompletedItemProvider)
+            class _Provider(object):
+
+                def __init__(self, *args):
+                    pass
+
+                def completed_items(self):
+                    return ()
+
+            gsm = component.getGlobalSiteManager()
+            gsm.registerSubscriptionAdapter(_Provider,
+                                            (IUser, ICompletionContext),
+                                            ICompletedItemProvider)
+            try:
+                assert_that(has_principal_completed_items_only(users[0],
+                                                               completion_context),
+                            is_(False))
+            finally:
+                gsm.unregisterSubscriptionAdapter(_Provider,
+                                                  (IUser, ICompletionContext),
+                                                  ICompletedItemProvider)
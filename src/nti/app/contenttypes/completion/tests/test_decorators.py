@@ -13,6 +13,9 @@ from hamcrest import not_none
 from hamcrest import has_key
 from hamcrest import has_length
 from hamcrest import assert_that
+from hamcrest import same_instance
+
+from datetime import datetime
 
 from zope import component
 from zope import interface
@@ -21,12 +24,22 @@ from nti.app.contenttypes.completion.tests import CompletionTestLayer
 from nti.app.contenttypes.completion.tests.models import PersistentCompletableItem
 from nti.app.contenttypes.completion.tests.models import PersistentCompletionContext
 
+from nti.app.contenttypes.completion.decorators import get_decoration_state
 from nti.app.contenttypes.completion.decorators import _CompletableItemCompletionPolicyDecorator
 
 from nti.app.testing.application_webtest import ApplicationLayerTest
 
+from nti.app.testing.decorators import WithSharedApplicationMockDS
+
+from nti.contenttypes.completion.completion import CompletedItem
+
 from nti.contenttypes.completion.interfaces import ICompletableItem
 from nti.contenttypes.completion.interfaces import ICompletionContext
+from nti.contenttypes.completion.interfaces import IPrincipalCompletedItemContainer
+
+from nti.coremetadata.interfaces import IContained
+
+from nti.dataserver.tests import mock_dataserver
 
 from nti.dataserver.tests.mock_dataserver import WithMockDSTrans
 
@@ -59,3 +72,44 @@ class TestDecorators(ApplicationLayerTest):
         component.globalSiteManager.unregisterAdapter(_content_provider,
                                                       (ICompletableItem,),
                                                       ICompletionContext)
+
+    @WithMockDSTrans
+    def test_decoration_state(self):
+        class _Request(object):
+            context = None
+        request = _Request()
+        context = PersistentCompletionContext()
+        state = get_decoration_state(context, u'user1', request)
+        assert_that(get_decoration_state(context, u'user1', request),
+                    same_instance(state))
+        assert_that(get_decoration_state(context, u'user2', request),
+                    is_not(same_instance(state)))
+        assert_that(get_decoration_state(context, u'user1', _Request()),
+                    is_not(same_instance(state)))
+
+    @WithSharedApplicationMockDS(users=True, testapp=False)
+    def test_decoration_state_prefetch(self):
+        class _Request(object):
+            context = None
+        with mock_dataserver.mock_db_trans(self.ds):
+            user = self._create_user(u'decorator_user1')
+            context = PersistentCompletionContext()
+            context.containerId = 'container_id'
+            interface.alsoProvides(context, IContained)
+            item1 = PersistentCompletableItem(u'ntiid1')
+            item2 = PersistentCompletableItem(u'ntiid2')
+            item1.containerId = item2.containerId = 'container_id'
+            for x in (context, item1, item2):
+                user.addContainedObject(x)
+            container = component.getMultiAdapter((user, context),
+                                                  IPrincipalCompletedItemContainer)
+            container.add_completed_item(CompletedItem(Principal=user,
+                                                       Item=item1,
+                                                       CompletedDate=datetime.utcnow()))
+
+            state = get_decoration_state(context, user, _Request())
+            state.prefetch()
+            assert_that(state.completed_items, has_length(1))
+            assert_that(state.get_completed_item(item1), not_none())
+            assert_that(state.get_completed_item(item2), is_(None))
+            assert_that(state.get_awarded_completed_item(item1), is_(None))
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+# pylint: disable=protected-access,too-many-public-methods,arguments-differ
+
+from hamcrest import has_key
+from hamcrest import has_length
+from hamcrest import assert_that
+
+from datetime import datetime
+
+from zope import component
+from zope import interface
+
+from nti.app.contenttypes.completion.progress import _context_ntiid
+from nti.app.contenttypes.completion.progress import get_user_completed_items_by_context
+
+from nti.app.contenttypes.completion.tests import CompletionTestLayer
+
+from nti.app.contenttypes.completion.tests.models import PersistentCompletableItem
+from nti.app.contenttypes.completion.tests.models import PersistentCompletionContext
+
+from nti.app.testing.application_webtest import ApplicationLayerTest
+
+from nti.app.testing.decorators import WithSharedApplicationMockDS
+
+from nti.contenttypes.completion.completion import CompletedItem
+
+from nti.contenttypes.completion.interfaces import IPrincipalCompletedItemContainer
+
+from nti.coremetadata.interfaces import IContained
+
+from nti.dataserver.tests import mock_dataserver
+
+from nti.dataserver.users.users import User
+
+
+class TestUserContextProgress(ApplicationLayerTest):
+
+    layer = CompletionTestLayer
+
+    @WithSharedApplicationMockDS(users=True, testapp=False)
+    def test_completed_items_by_context(self):
+        admin_username = 'sjohnson@nextthought.com'
+        with mock_dataserver.mock_db_trans(self.ds):
+            user1 = self._create_user(u'progress_user1')
+            admin = User.get_user(admin_username)
+            contexts = []
+            for ntiid in (u'ntiid1', u'ntiid2'):
+                context = PersistentCompletionContext()
+                context.containerId = 'container_id'
+                interface.alsoProvides(context, IContained)
+                item = PersistentCompletableItem(ntiid)
+                item.containerId = 'container_id'
+                for x in (context, item):
+                    admin.addContainedObject(x)
+                container = component.getMultiAdapter((user1, context),
+                                                      IPrincipalCompletedItemContainer)
+                container.add_completed_item(CompletedItem(Principal=user1,
+                                                           Item=item,
+                                                           CompletedDate=datetime.utcnow()))
+                contexts.append(context)
+
+            ntiids = [_context_ntiid(x) for x in contexts]
+            result = get_user_completed_items_by_context(u'progress_user1', ntiids)
+            assert_that(result, has_length(2))
+            assert_that(result[ntiids[0]], has_key(u'ntiid1'))
+            assert_that(result[ntiids[0]], has_length(1))
+            assert_that(result[ntiids[1]], has_key(u'ntiid2'))
+
+            result = get_user_completed_items_by_context(u'progress_user1', ntiids[:1])
+            assert_that(result, has_length(1))
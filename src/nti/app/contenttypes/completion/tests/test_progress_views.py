@@ -0,0 +1,393 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+# pylint: disable=protected-access,too-many-public-methods,arguments-differ
+
+from hamcrest import is_
+from hamcrest import contains
+from hamcrest import close_to
+from hamcrest import not_none
+from hamcrest import has_length
+from hamcrest import has_entries
+from hamcrest import assert_that
+
+import json
+
+from zope.event import notify
+
+from nti.app.contenttypes.completion import CONTEXT_PROGRESS_VIEW
+from nti.app.contenttypes.completion import BUILD_PROGRESS_AGGREGATE_VIEW
+
+from nti.app.contenttypes.completion.cache import query_progress_aggregate
+
+from nti.app.contenttypes.completion.interfaces import CompletionContextRequirementsModifiedEvent
+
+from nti.app.contenttypes.completion.tests import COHORT
+from nti.app.contenttypes.completion.tests import REQUIRED
+from nti.app.contenttypes.completion.tests import CohortTestMixin
+from nti.app.contenttypes.completion.tests import CompletionTestLayer
+
+from nti.app.contenttypes.completion.tests.models import PersistentCompletableItem
+
+from nti.app.contenttypes.completion.views.progress_views import MAX_BATCH_USERS
+
+from nti.app.testing.application_webtest import ApplicationLayerTest
+
+from nti.app.testing.decorators import WithSharedApplicationMockDS
+
+from nti.dataserver.tests import mock_dataserver
+
+from nti.dataserver.users.users import User
+
+from nti.externalization.interfaces import StandardExternalFields
+
+from nti.ntiids.ntiids import find_object_with_ntiid
+
+from nti.ntiids.oids import to_external_ntiid_oid
+
+
+ITEMS = StandardExternalFields.ITEMS
+TOTAL = StandardExternalFields.TOTAL
+ITEM_COUNT = StandardExternalFields.ITEM_COUNT
+
+class TestAggregateStats(ApplicationLayerTest, CohortTestMixin):
+
+    layer = CompletionTestLayer
+
+    def setUp(self):
+        super(TestAggregateStats, self).setUp()
+        self._register_cohort()
+
+    def tearDown(self):
+        self._unregister_cohort()
+        super(TestAggregateStats, self).tearDown()
+
+    @WithSharedApplicationMockDS(users=True, testapp=True, default_authenticate=True)
+    def test_aggregate_stats(self):
+        usernames = (u'stats_user1', u'stats_user2', u'stats_user3')
+        with mock_dataserver.mock_db_trans(self.ds):
+            for username in usernames:
+                self._create_user(username)
+            context_ntiid, (item1, item2) = self._create_context('stats_container')
+        COHORT.update(usernames[:2])
+        self._set_policy(context_ntiid)
+        stats_url = self._progress_url(context_ntiid)
+        build_url = '%s/@@%s' % (stats_url, BUILD_PROGRESS_AGGREGATE_VIEW)
+
+        # Nothing is built on read
+        self.testapp.get(stats_url, status=202)
+        res = self.testapp.post(build_url).json_body
+        assert_that(res, has_entries('TotalUsers', 2,
+                                     'CountHasProgress', 0,
+                                     'AbsoluteProgress', 0,
+                                     'Stale', False))
+
+        # Completing items updates the aggregate before commit
+        with mock_dataserver.mock_db_trans(self.ds):
+            self._complete(usernames[0], context_ntiid, item1)
+        with mock_dataserver.mock_db_trans(self.ds):
+            aggregate = query_progress_aggregate(find_object_with_ntiid(context_ntiid))
+            assert_that(aggregate, not_none())
+            assert_that(aggregate.TotalUsers, is_(2))
+            assert_that(aggregate.CountHasProgress, is_(1))
+            assert_that(aggregate.accumulated_progress(), is_(0.5))
+
+        with mock_dataserver.mock_db_trans(self.ds):
+            self._complete(usernames[0], context_ntiid, item2)
+            # Not in the cohort
+            self._complete(usernames[2], context_ntiid, item1)
+        res = self.testapp.get(stats_url).json_body
+        assert_that(res, has_entries('TotalUsers', 2,
+                                     'CountHasProgress', 1,
+                                     'AbsoluteProgress', 1.0,
+                                     'PercentageProgress', 0.5,
+                                     'Stale', False))
+
+        # Enrollments and drops are reported stale until reconciled
+        COHORT.add(usernames[2])
+        res = self.testapp.get(stats_url).json_body
+        assert_that(res, has_entries('TotalUsers', 2,
+                                     'Stale', True))
+        res = self.testapp.post(build_url).json_body
+        assert_that(res, has_entries('TotalUsers', 3,
+                                     'CountHasProgress', 2,
+                                     'AbsoluteProgress', 1.5))
+
+        COHORT.discard(usernames[0])
+        res = self.testapp.post(build_url).json_body
+        assert_that(res, has_entries('TotalUsers', 2,
+                                     'CountHasProgress', 1,
+                                     'AbsoluteProgress', 0.5))
+
+        # A full rebuild agrees with the incremental counters
+        res = self.testapp.post(build_url, {'refresh': True}).json_body
+        assert_that(res, has_entries('TotalUsers', 2,
+                                     'CountHasProgress', 1,
+                                     'AbsoluteProgress', 0.5))
+
+        # New provider items make the aggregate stale; modifying the
+        # requirements rebuilds it
+        with mock_dataserver.mock_db_trans(self.ds):
+            admin = User.get_user('sjohnson@nextthought.com')
+            item3 = PersistentCompletableItem('ntiid3')
+            item3.containerId = 'stats_container'
+            admin.addContainedObject(item3)
+            item3.ntiid = to_external_ntiid_oid(item3)
+            REQUIRED.append(item3.ntiid)
+        res = self.testapp.get(stats_url).json_body
+        assert_that(res, has_entries('AbsoluteProgress', 0.5,
+                                     'Stale', True))
+        with mock_dataserver.mock_db_trans(self.ds):
+            notify(CompletionContextRequirementsModifiedEvent(find_object_with_ntiid(context_ntiid)))
+        res = self.testapp.get(stats_url).json_body
+        assert_that(res, has_entries('TotalUsers', 2,
+                                     'AbsoluteProgress', close_to(1 / 3, 1e-6),
+                                     'Stale', False))
+
+        # Only admins build
+        with mock_dataserver.mock_db_trans(self.ds):
+            self._create_user(u'stats_outsider')
+        outsider_environ = self._make_extra_environ(username=u'stats_outsider')
+        self.testapp.post(build_url, extra_environ=outsider_environ, status=403)
+
+
+class TestListUsers(ApplicationLayerTest, CohortTestMixin):
+
+    layer = CompletionTestLayer
+
+    def setUp(self):
+        super(TestListUsers, self).setUp()
+        self._register_cohort()
+
+    def tearDown(self):
+        self._unregister_cohort()
+        super(TestListUsers, self).tearDown()
+
+    @WithSharedApplicationMockDS(users=True, testapp=True, default_authenticate=True)
+    def test_list_users(self):
+        usernames = (u'list_user3', u'list_user1', u'list_user2')
+        with mock_dataserver.mock_db_trans(self.ds):
+            for username in usernames:
+                self._create_user(username)
+            context_ntiid, (item1, unused_item2) = self._create_context('list_container')
+            self._complete(u'list_user2', context_ntiid, item1)
+        COHORT.update(usernames)
+        self._set_policy(context_ntiid)
+        list_url = '%s/users/@@list' % self._progress_url(context_ntiid)
+
+        res = self.testapp.get(list_url).json_body
+        assert_that(res, has_entries(TOTAL, 3, ITEM_COUNT, 3))
+        assert_that(res[ITEMS], has_entries(u'list_user2',
+                                            has_entries('AbsoluteProgress', 1)))
+
+        # Pages are taken from the sorted usernames
+        res = self.testapp.get(list_url, {'batchStart': 1,
+                                          'batchSize': 1}).json_body
+        assert_that(res, has_entries(TOTAL, 3, ITEM_COUNT, 1))
+        assert_that(sorted(res[ITEMS]), contains(u'list_user2'))
+
+        res = self.testapp.get(list_url, {'batchStart': 2,
+                                          'batchSize': 5}).json_body
+        assert_that(res, has_entries(TOTAL, 3, ITEM_COUNT, 1))
+        assert_that(sorted(res[ITEMS]), contains(u'list_user3'))
+
+        res = self.testapp.get(list_url, {'batchStart': 3,
+                                          'batchSize': 5}).json_body
+        assert_that(res, has_entries(TOTAL, 3, ITEM_COUNT, 0))
+
+        # One progress per line, in username order
+        res = self.testapp.get(list_url, {'format': 'ndjson',
+                                          'batchStart': 0,
+                                          'batchSize': 2})
+        assert_that(res.content_type, is_('application/x-ndjson'))
+        lines = [json.loads(x) for x in res.text.splitlines()]
+        assert_that([x['Username'] for x in lines],
+                    contains(u'list_user1', u'list_user2'))
+        assert_that(lines[1]['Progress'], has_entries('AbsoluteProgress', 1,
+                                                      'MaxPossibleProgress', 2))
+
+        res = self.testapp.get(list_url, {'format': 'ndjson'})
+        lines = [json.loads(x) for x in res.text.splitlines()]
+        assert_that(lines, has_length(3))
+
+
+class TestConditionalProgress(ApplicationLayerTest, CohortTestMixin):
+
+    layer = CompletionTestLayer
+
+    def setUp(self):
+        super(TestConditionalProgress, self).setUp()
+        self._register_cohort()
+
+    def tearDown(self):
+        self._unregister_cohort()
+        super(TestConditionalProgress, self).tearDown()
+
+    @WithSharedApplicationMockDS(users=True, testapp=True, default_authenticate=True)
+    def test_provider_versions(self):
+        username = u'conditional_user1'
+        with mock_dataserver.mock_db_trans(self.ds):
+            self._create_user(username)
+            context_ntiid, (item1, unused_item2) = self._create_context('conditional_container')
+            self._complete(username, context_ntiid, item1)
+        COHORT.add(username)
+        self._set_policy(context_ntiid)
+        user_url = '%s/users/%s' % (self._progress_url(context_ntiid), username)
+
+        res = self.testapp.get(user_url)
+        assert_that(res.json_body, has_entries('AbsoluteProgress', 1,
+                                               'MaxPossibleProgress', 2))
+        etag = res.headers.get('ETag')
+        assert_that(etag, not_none())
+        self.testapp.get(user_url, headers={'If-None-Match': etag}, status=304)
+
+        # New provider items change the provider version, so they are
+        # never hidden behind a 304
+        with mock_dataserver.mock_db_trans(self.ds):
+            admin = User.get_user('sjohnson@nextthought.com')
+            item3 = PersistentCompletableItem('ntiid3')
+            item3.containerId = 'conditional_container'
+            admin.addContainedObject(item3)
+            item3.ntiid = to_external_ntiid_oid(item3)
+            REQUIRED.append(item3.ntiid)
+        res = self.testapp.get(user_url, headers={'If-None-Match': etag})
+        assert_that(res.status_int, is_(200))
+        assert_that(res.json_body, has_entries('AbsoluteProgress', 1,
+                                               'MaxPossibleProgress', 3))
+
+        res = self.testapp.get('%s/@@details' % user_url)
+        etag = res.headers.get('ETag') or u'"unused"'
+        res = self.testapp.get('%s/@@details' % user_url,
+                               headers={'If-None-Match': etag})
+        assert_that(res.status_int, is_(200))
+
+
+class TestBatchProgress(ApplicationLayerTest, CohortTestMixin):
+
+    layer = CompletionTestLayer
+
+    def setUp(self):
+        super(TestBatchProgress, self).setUp()
+        self._register_cohort()
+
+    def tearDown(self):
+        self._unregister_cohort()
+        super(TestBatchProgress, self).tearDown()
+
+    @WithSharedApplicationMockDS(users=True, testapp=True, default_authenticate=True)
+    def test_batch_progress(self):
+        usernames = (u'batch_user1', u'batch_user2', u'batch_outsider')
+        with mock_dataserver.mock_db_trans(self.ds):
+            for username in usernames:
+                self._create_user(username)
+            context_ntiid, (item1, item2) = self._create_context('batch_container')
+            self._complete(u'batch_user1', context_ntiid, item1)
+            self._complete(u'batch_user1', context_ntiid, item2)
+            self._complete(u'batch_outsider', context_ntiid, item1)
+        COHORT.update(usernames[:2])
+        self._set_policy(context_ntiid)
+        progress_url = self._progress_url(context_ntiid)
+
+        # Valid, unknown and non-cohort users
+        res = self.testapp.post_json(progress_url,
+                                     {'usernames': [u'batch_user2',
+                                                    u'batch_user1',
+                                                    u'batch_unknown',
+                                                    u'batch_outsider']}).json_body
+        assert_that(res, has_entries(TOTAL, 2, ITEM_COUNT, 2))
+        assert_that(sorted(res[ITEMS]), contains(u'batch_user1', u'batch_user2'))
+        assert_that(res[ITEMS], has_entries(u'batch_user1',
+                                            has_entries('AbsoluteProgress', 2,
+                                                        'MaxPossibleProgress', 2),
+                                            u'batch_user2',
+                                            has_entries('AbsoluteProgress', 0)))
+        assert_that(res['Missing'], contains(u'batch_outsider', u'batch_unknown'))
+
+        # Comma separated names
+        res = self.testapp.post(progress_url + '?usernames=batch_user2,batch_unknown').json_body
+        assert_that(res, has_entries(TOTAL, 1,
+                                     'Missing', contains(u'batch_unknown')))
+        assert_that(sorted(res[ITEMS]), contains(u'batch_user2'))
+
+        # No users
+        res = self.testapp.post_json(progress_url, {'usernames': []}).json_body
+        assert_that(res, has_entries(TOTAL, 0,
+                                     'Missing', has_length(0)))
+
+        # A plain list of usernames
+        res = self.testapp.post_json(progress_url,
+                                     [u'batch_user1', u'batch_unknown']).json_body
+        assert_that(res, has_entries(TOTAL, 1,
+                                     'Missing', contains(u'batch_unknown')))
+        assert_that(sorted(res[ITEMS]), contains(u'batch_user1'))
+
+        # Invalid types
+        for body in ({'usernames': 5}, {'usernames': [u'batch_user1', 5]}, [5]):
+            res = self.testapp.post_json(progress_url, body, status=422).json_body
+            assert_that(res, has_entries('code', 'InvalidUsernamesError',
+                                         'field', 'usernames'))
+
+        # Too many users
+        names = [u'batch_user%s' % x for x in range(MAX_BATCH_USERS + 1)]
+        res = self.testapp.post_json(progress_url, {'usernames': names},
+                                     status=422).json_body
+        assert_that(res, has_entries('code', 'TooManyUsersError'))
+
+        # One progress per line
+        res = self.testapp.post_json(progress_url + '?format=ndjson',
+                                     {'usernames': [u'batch_user1',
+                                                    u'batch_outsider']})
+        assert_that(res.content_type, is_('application/x-ndjson'))
+        lines = [json.loads(x) for x in res.text.splitlines()]
+        assert_that([x['Username'] for x in lines], contains(u'batch_user1'))
+
+        # Only those who may list progress
+        outsider_environ = self._make_extra_environ(username=u'batch_outsider')
+        self.testapp.post_json(progress_url,
+                               {'usernames': [u'batch_outsider']},
+                               extra_environ=outsider_environ,
+                               status=403)
+
+
+class TestUserContextProgress(ApplicationLayerTest, CohortTestMixin):
+
+    layer = CompletionTestLayer
+
+    def setUp(self):
+        super(TestUserContextProgress, self).setUp()
+        self._register_cohort()
+
+    def tearDown(self):
+        self._unregister_cohort()
+        super(TestUserContextProgress, self).tearDown()
+
+    @WithSharedApplicationMockDS(users=True, testapp=True, default_authenticate=True)
+    def test_user_context_progress(self):
+        usernames = (u'context_user1', u'context_user2')
+        with mock_dataserver.mock_db_trans(self.ds):
+            for username in usernames:
+                self._create_user(username)
+            context_ntiid, (item1, unused_item2) = self._create_context('context_container')
+            self._complete(u'context_user1', context_ntiid, item1)
+        COHORT.update(usernames)
+        self._set_policy(context_ntiid)
+        url = '/dataserver2/users/%s/@@%s' % (u'context_user1', CONTEXT_PROGRESS_VIEW)
+
+        bogus_ntiid = u'tag:nextthought.com,2011-10:NTI-NTICourseInfo-bogus'
+        res = self.testapp.post_json(url, {'ntiids': [context_ntiid,
+                                                      bogus_ntiid]}).json_body
+        assert_that(res, has_entries(TOTAL, 1,
+                                     'Missing', contains(bogus_ntiid)))
+        assert_that(res[ITEMS], has_entries(context_ntiid,
+                                            has_entries('AbsoluteProgress', 1,
+                                                        'MaxPossibleProgress', 2)))
+
+        # Only the user and admins
+        other_environ = self._make_extra_environ(username=u'context_user2')
+        self.testapp.get(url, {'ntiids': context_ntiid},
+                         extra_environ=other_environ,
+                         status=403)
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+# pylint: disable=protected-access,too-many-public-methods,arguments-differ
+
+from hamcrest import is_
+from hamcrest import contains
+from hamcrest import has_item
+from hamcrest import has_length
+from hamcrest import assert_that
+
+import unittest
+
+from zope import component
+from zope import interface
+
+from zope.intid.interfaces import IIntIds
+
+from nti.app.contenttypes.completion.catalog import get_completion_contexts
+
+from nti.app.contenttypes.completion.registry import GLOBAL_SITE
+
+from nti.app.contenttypes.completion.registry import query_context_registry
+from nti.app.contenttypes.completion.registry import CompletionContextRegistry
+
+from nti.app.contenttypes.completion.tests import CompletionTestLayer
+
+from nti.app.contenttypes.completion.tests.models import PersistentCompletionContext
+
+from nti.app.testing.application_webtest import ApplicationLayerTest
+
+from nti.app.testing.decorators import WithSharedApplicationMockDS
+
+from nti.coremetadata.interfaces import IContained
+
+from nti.dataserver.tests import mock_dataserver
+
+from nti.dataserver.users.users import User
+
+
+class TestCompletionContextRegistry(unittest.TestCase):
+
+    def test_registry(self):
+        registry = CompletionContextRegistry()
+        assert_that(registry.register(1, u'alpha'), is_(True))
+        assert_that(registry.register(1, u'alpha'), is_(False))
+        registry.register(2, u'beta')
+        registry.register(3)
+        assert_that(registry, has_length(3))
+        assert_that(list(registry.documents((u'alpha',))), contains(1))
+        assert_that(list(registry.documents()), contains(1, 2, 3))
+        assert_that(registry.site_name(3), is_(GLOBAL_SITE))
+        assert_that(list(registry.iter_documents()), contains(1, 2, 3))
+        assert_that(list(registry.iter_documents(after=1)), contains(2, 3))
+        assert_that(list(registry.iter_documents((u'alpha', GLOBAL_SITE), 1)),
+                    contains(3))
+
+        # Moving sites
+        registry.register(1, u'beta')
+        assert_that(registry, has_length(3))
+        assert_that(list(registry.documents((u'alpha',))), has_length(0))
+        assert_that(list(registry.documents((u'beta',))), contains(1, 2))
+
+        assert_that(registry.unregister(2), is_(True))
+        assert_that(registry.unregister(2), is_(False))
+        assert_that(registry, has_length(2))
+        assert_that(2 in registry, is_(False))
+
+
+class TestRegisteredContexts(ApplicationLayerTest):
+
+    layer = CompletionTestLayer
+
+    @WithSharedApplicationMockDS(users=True, testapp=False)
+    def test_registered(self):
+        with mock_dataserver.mock_db_trans(self.ds):
+            completion_context = PersistentCompletionContext()
+            completion_context.containerId = 'container_id'
+            interface.alsoProvides(completion_context, IContained)
+            admin = User.get_user('sjohnson@nextthought.com')
+            admin.addContainedObject(completion_context)
+
+            intids = component.getUtility(IIntIds)
+            doc_id = intids.getId(completion_context)
+            registry = query_context_registry()
+            assert_that(doc_id in registry, is_(True))
+            assert_that(list(get_completion_contexts()),
+                        has_item(completion_context))
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Helpers to find the dataserver folder and the annotations we store on it
+and on completion contexts, and to report process memory use.
+
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import sys
+
+from zope import component
+
+from zope.annotation.interfaces import IAnnotations
+
+from nti.dataserver.interfaces import IDataserver
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None
+
+logger = __import__('logging').getLogger(__name__)
+
+
+def get_dataserver_folder():
+    """
+    Return the dataserver folder, or None without a dataserver.
+    """
+    dataserver = component.queryUtility(IDataserver)
+    return getattr(dataserver, 'dataserver_folder', None)
+
+
+def query_annotation(context, key):
+    """
+    Return the `key` annotation of the context without creating it.
+    """
+    annotations = IAnnotations(context, None) if context is not None else None
+    if annotations is None:
+        return None
+    return annotations.get(key)
+
+
+def get_annotation(context, key, factory):
+    """
+    Return the `key` annotation of the context, creating it with `factory`
+    and locating it in the context if needed. Returns None if the context
+    is not annotatable.
+    """
+    annotations = IAnnotations(context, None) if context is not None else None
+    if annotations is None:
+        return None
+    try:
+        result = annotations[key]
+    except KeyError:
+        result = annotations[key] = factory()
+        result.__name__ = key
+        result.__parent__ = context
+    return result
+
+
+def get_max_rss():
+    """
+    Return the maximum resident set size of this process in bytes, if
+    known. This is the high-water mark over the lifetime of the process,
+    not its current memory use.
+    """
+    if resource is None:
+        return None
+    result = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes
+    return result if sys.platform == 'darwin' else result * 1024
@@ -8,8 +8,14 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import absolute_import
 
+import hashlib
+import calendar
+import tempfile
+
 from pyramid import httpexceptions as hexc
 
+from pyramid.response import FileIter
+
 from pyramid.threadlocal import get_current_request
 
 from zope import component
@@ -63,11 +69,17 @@ from nti.dataserver.interfaces import IUser
 
 from nti.dataserver.users import User
 
+from nti.externalization.representation import to_json_representation
+
 from nti.links.links import Link
 
 from nti.traversal.traversal import find_interface
 
 
+#: Rendered NDJSON larger than this spills to disk
+_NDJSON_SPOOL_SIZE = 1024 * 1024
+
+
 def raise_error(data, tb=None,
                 factory=hexc.HTTPUnprocessableEntity,
                 request=None):
@@ -75,6 +87,61 @@ def raise_error(data, tb=None,
     raise_json_error(request, factory, data, tb)
 
 
+def render_ndjson(request, records):
+    """
+    Serialize each record as it is produced to a disk-spooled buffer so
+    worker memory stays flat regardless of the number of records. We
+    cannot lazily stream from the database since the transaction is
+    closed before the response body is iterated.
+    """
+    buf = tempfile.SpooledTemporaryFile(max_size=_NDJSON_SPOOL_SIZE)
+    for record in records:
+        line = to_json_representation(record)
+        buf.write(line.encode('utf-8') if not isinstance(line, bytes) else line)
+        buf.write(b'\n')
+    buf.seek(0)
+    response = request.response
+    response.content_type = 'application/x-ndjson'
+    response.app_iter = FileIter(buf)
+    return response
+
+
+class ConditionalViewMixin(object):
+    """
+    Answers conditional GET requests from a cheap version token, computed
+    before any of the (expensive) response is. Views without such a token
+    (e.g. some item provider cannot be versioned) are not conditional.
+    """
+
+    def not_modified(self, token, last_modified=None):
+        """
+        Set the validators derived from the given version token on our
+        response; return a 304 response if the client's copy is current,
+        otherwise None. A None token sets no validators.
+        """
+        if token is None:
+            return None
+        request = self.request
+        etag = hashlib.md5(repr(token).encode('utf-8')).hexdigest()
+        request.response.etag = etag
+        if last_modified is not None:
+            request.response.last_modified = last_modified
+        if request.headers.get('If-None-Match'):
+            is_current = etag in request.if_none_match
+        else:
+            since = request.if_modified_since
+            is_current = last_modified is not None \
+                     and since is not None \
+                     and int(last_modified) <= calendar.timegm(since.utctimetuple())
+        if not is_current:
+            return None
+        result = hexc.HTTPNotModified()
+        result.etag = etag
+        if last_modified is not None:
+            result.last_modified = last_modified
+        return result
+
+
 class CompletionContextMixin(object):
 
     @property
@@ -10,6 +10,12 @@ from __future__ import absolute_import
 
 from datetime import datetime
 
+from itertools import islice
+
+import transaction
+
+from BTrees.LLBTree import LLTreeSet
+
 from pyramid import httpexceptions as hexc
 
 from pyramid.view import view_config
@@ -21,23 +27,58 @@ from zope import component
 
 from zope.cachedescriptors.property import Lazy
 
+from zope.intid.interfaces import IIntIds
+
 from nti.app.base.abstract_views import AbstractAuthenticatedView
 
-from nti.app.contenttypes.completion.catalog import get_completion_contexts
+from nti.app.contenttypes.completion.adapters import shared_item_providers
+
+from nti.app.contenttypes.completion.build import get_build_state
+from nti.app.contenttypes.completion.build import query_build_state
+from nti.app.contenttypes.completion.build import get_item_providers
+from nti.app.contenttypes.completion.build import diff_user_completion
+from nti.app.contenttypes.completion.build import get_build_version
+from nti.app.contenttypes.completion.build import start_completion_build
+from nti.app.contenttypes.completion.build import process_completion_build
+
+from nti.app.contenttypes.completion.cache import query_progress_cache
+from nti.app.contenttypes.completion.cache import invalidate_request_snapshots
+
+from nti.app.contenttypes.completion import COMPLETION_PRINCIPALS_VIEW
+
+from nti.app.contenttypes.completion.catalog import get_catalog_rebuild
+from nti.app.contenttypes.completion.catalog import get_context_principal_counts
+from nti.app.contenttypes.completion.catalog import start_catalog_rebuild
+from nti.app.contenttypes.completion.catalog import iter_host_site_context_documents
+from nti.app.contenttypes.completion.catalog import process_catalog_rebuild
+from nti.app.contenttypes.completion.catalog import reset_context_completed_items
 from nti.app.contenttypes.completion.catalog import rebuild_completed_items_catalog
 
+from nti.app.contenttypes.completion.cleanup import DEFAULT_BATCH_SIZE
+
+from nti.app.contenttypes.completion.cleanup import user_exists
+from nti.app.contenttypes.completion.cleanup import query_cleanup_queue
+from nti.app.contenttypes.completion.cleanup import process_cleanup_queue
+from nti.app.contenttypes.completion.cleanup import remove_ghost_user_containers
+from nti.app.contenttypes.completion.cleanup import iter_indexed_ghost_usernames
+from nti.app.contenttypes.completion.cleanup import remove_indexed_completed_items
+
 from nti.app.contenttypes.completion.interfaces import ICompletedItemsContext
 from nti.app.contenttypes.completion.interfaces import IAwardedCompletedItemsContext
 from nti.app.contenttypes.completion.interfaces import ICompletionContextCohort
 
+from nti.app.contenttypes.completion.utils import get_max_rss
+
 from nti.app.contenttypes.completion.views import BUILD_COMPLETION_VIEW
 from nti.app.contenttypes.completion.views import RESET_COMPLETION_VIEW
 from nti.app.contenttypes.completion.views import USER_DATA_COMPLETION_VIEW
 from nti.app.contenttypes.completion.views import raise_error
+from nti.app.contenttypes.completion.views import render_ndjson
 from nti.app.contenttypes.completion.views import MessageFactory as _
 
 from nti.app.externalization.error import raise_json_error
 
+from nti.app.externalization.view_mixins import BatchingUtilsMixin
 from nti.app.externalization.view_mixins import ModeledContentUploadRequestUtilsMixin
 
 from nti.appserver.ugd_edit_views import UGDDeleteView
@@ -46,12 +87,12 @@ from nti.common.string import is_true
 
 from nti.contenttypes.completion.authorization import ACT_AWARD_PROGRESS
 
-from nti.contenttypes.completion.interfaces import ICompletedItemContainer
 from nti.contenttypes.completion.interfaces import ICompletableItemProvider
 from nti.contenttypes.completion.interfaces import IPrincipalCompletedItemContainer
 from nti.contenttypes.completion.interfaces import IPrincipalAwardedCompletedItemContainer
 from nti.contenttypes.completion.interfaces import ICompletableItem
 from nti.contenttypes.completion.interfaces import IAwardedCompletedItem
+from nti.contenttypes.completion.interfaces import ICompletionContext
 
 from nti.contenttypes.completion.utils import update_completion
 from nti.contenttypes.completion.utils import get_completable_items_for_user
@@ -73,6 +114,9 @@ from nti.links.links import Link
 from nti.ntiids.ntiids import find_object_with_ntiid
 
 
+#: The admin view to inspect and process the completed item cleanup queue
+CLEANUP_QUEUE_VIEW = u'CompletedItemCleanupQueue'
+
 ITEMS = StandardExternalFields.ITEMS
 TOTAL = StandardExternalFields.TOTAL
 MIMETYPE = StandardExternalFields.MIMETYPE
@@ -83,20 +127,227 @@ LINKS = StandardExternalFields.LINKS
 logger = __import__('logging').getLogger(__name__)
 
 
+def _memory_stats(start_max_rss):
+    """
+    The lifetime maximum RSS (in bytes) of this process and by how much
+    it grew since `start_max_rss`. The increase is only non-zero if the
+    request raised the process high-water mark; it is not the memory
+    used by the request.
+    """
+    max_rss = get_max_rss()
+    if max_rss is None:
+        return {}
+    return {'MaxRSS': max_rss,
+            'MaxRSSIncrease': max_rss - (start_max_rss or 0)}
+
+
+class _AdminParamsMixin(object):
+    """
+    Reads the params of the admin views from the (JSON) body or the query
+    string, case insensitively.
+    """
+
+    def readInput(self, value=None):
+        # pylint: disable=no-member
+        if self.request.body:
+            values = super(_AdminParamsMixin, self).readInput(value)
+        else:
+            values = self.request.params
+        return CaseInsensitiveDict(values)
+
+    @Lazy
+    def _params(self):
+        return self.readInput()
+
+
+class _BatchParamsMixin(_AdminParamsMixin):
+    """
+    The params of the admin views that process their work in chunks:
+    `batchSize`, `sites` and `restart`.
+    """
+
+    @Lazy
+    def batch_size(self):
+        value = self._params.get('batchSize') or self._params.get('batch_size')
+        if not value:
+            return None
+        try:
+            result = int(value)
+        except (TypeError, ValueError):
+            result = 0
+        if result <= 0:
+            raise_error({'message': _(u"Invalid batch size."),
+                         'code': 'InvalidBatchSizeError'})
+        return result
+
+    @Lazy
+    def sites(self):
+        sites = self._params.get('sites') or self._params.get('site') or ()
+        if not isinstance(sites, (list, tuple, set)):
+            sites = sites.split(',')
+        return {x.strip() for x in sites if x and x.strip()}
+
+    @property
+    def restart(self):
+        return is_true(self._params.get('restart'))
+
+
+def _catalog_rebuild_status(rebuild):
+    result = LocatedExternalDict()
+    if rebuild is not None:
+        result['Started'] = rebuild.started
+        result['Finished'] = rebuild.finished
+        result['Complete'] = rebuild.complete
+        result[ITEMS] = rebuild.status()
+        result[TOTAL] = result[ITEM_COUNT] = rebuild.count
+    return result
+
+
 @view_config(context=IDataserverFolder)
 @view_defaults(route_name='objects.generic.traversal',
                renderer='rest',
                request_method='POST',
                permission=nauth.ACT_NTI_ADMIN,
                name='RebuildCompletedItemsCatalog')
-class RebuildCompletedItemsCatalogView(AbstractAuthenticatedView):
+class RebuildCompletedItemsCatalogView(_BatchParamsMixin,
+                                       AbstractAuthenticatedView,
+                                       ModeledContentUploadRequestUtilsMixin):
+    """
+    Rebuild the completed items catalog. Without a `batchSize` the whole
+    catalog is rebuilt in this request. With a `batchSize`, at most that
+    many completion contexts are indexed per request and progress is
+    checkpointed; call repeatedly, one request at a time, until
+    `Complete`. Concurrent requests conflict and are retried serially.
+    `sites` restricts a chunk to some host sites. `restart` discards an
+    unfinished rebuild.
+    """
+
+    def _do_chunk(self):
+        rebuild = get_catalog_rebuild(self.context)
+        if rebuild is None or rebuild.complete or self.restart:
+            rebuild = start_catalog_rebuild(self.context)
+        max_rss = get_max_rss()
+        processed = process_catalog_rebuild(rebuild, self.sites,
+                                            self.batch_size)
+        result = _catalog_rebuild_status(rebuild)
+        result['Processed'] = processed
+        result.update(_memory_stats(max_rss))
+        return result
 
     def __call__(self):
-        seen = set()
+        if self.batch_size is not None:
+            return self._do_chunk()
+        seen = LLTreeSet()
+        max_rss = get_max_rss()
         items = rebuild_completed_items_catalog(seen)
         result = LocatedExternalDict()
         result[ITEMS] = items
         result[ITEM_COUNT] = result[TOTAL] = len(seen)
+        result.update(_memory_stats(max_rss))
+        return result
+
+
+@view_config(route_name='objects.generic.traversal',
+             renderer='rest',
+             context=IDataserverFolder,
+             request_method='GET',
+             permission=nauth.ACT_NTI_ADMIN,
+             name='RebuildCompletedItemsCatalog')
+class RebuildCompletedItemsCatalogStatusView(AbstractAuthenticatedView):
+    """
+    Report the progress of the current resumable catalog rebuild.
+    """
+
+    def __call__(self):
+        rebuild = get_catalog_rebuild(self.context)
+        if rebuild is None:
+            raise hexc.HTTPNotFound()
+        return _catalog_rebuild_status(rebuild)
+
+
+def _completion_build_status(build):
+    result = LocatedExternalDict()
+    result['Started'] = build.started
+    result['Finished'] = build.finished
+    result['Complete'] = build.complete
+    result['Workers'] = build.workers
+    result['Reset'] = build.reset
+    result['SkipCurrent'] = build.skip_current
+    result[ITEMS] = build.status()
+    result['UserCount'] = build.count
+    result['SkippedCount'] = build.skipped
+    return result
+
+
+def _cleanup_entry(entry, queued=None):
+    kind, key, site_name = entry
+    # User cleanups are keyed by (username, created time)
+    key, created = key if isinstance(key, tuple) else (key, None)
+    return {'Kind': kind,
+            'Key': key,
+            'CreatedTime': created,
+            'Site': site_name or None,
+            'Queued': queued}
+
+
+@view_config(route_name='objects.generic.traversal',
+             renderer='rest',
+             context=IDataserverFolder,
+             request_method='GET',
+             permission=nauth.ACT_NTI_ADMIN,
+             name=CLEANUP_QUEUE_VIEW)
+class CompletedItemCleanupQueueView(AbstractAuthenticatedView,
+                                    BatchingUtilsMixin):
+    """
+    Inspect the pending completed item cleanups.
+    """
+
+    _DEFAULT_BATCH_SIZE = 50
+    _DEFAULT_BATCH_START = 0
+
+    def __call__(self):
+        result = LocatedExternalDict()
+        queue = query_cleanup_queue(self.context)
+        total = len(queue) if queue is not None else 0
+        batch_size, batch_start = self._get_batch_size_start()
+        entries = ()
+        if queue is not None:
+            entries = islice(queue.items(batch_start + batch_size), batch_start, None)
+        result[ITEMS] = [_cleanup_entry(x, queued) for x, queued in entries]
+        result[TOTAL] = total
+        result[ITEM_COUNT] = len(result[ITEMS])
+        return result
+
+
+@view_config(context=IDataserverFolder)
+@view_defaults(route_name='objects.generic.traversal',
+               renderer='rest',
+               request_method='POST',
+               permission=nauth.ACT_NTI_ADMIN,
+               name=CLEANUP_QUEUE_VIEW)
+class ProcessCompletedItemCleanupQueueView(_BatchParamsMixin,
+                                           AbstractAuthenticatedView,
+                                           ModeledContentUploadRequestUtilsMixin):
+    """
+    Process (up to `batchSize`) pending completed item cleanups in this
+    request, or drop them all with `discard`. The queue is otherwise
+    drained in the background after the deleting transactions commit.
+    """
+
+    def __call__(self):
+        result = LocatedExternalDict()
+        queue = query_cleanup_queue(self.context)
+        if queue is None:
+            entries = ()
+        elif is_true(self._params.get('discard')):
+            count = queue.clear()
+            logger.warning("%s completed item cleanup(s) discarded", count)
+            entries = ()
+        else:
+            entries = process_cleanup_queue(queue, self.batch_size or DEFAULT_BATCH_SIZE)
+        result[ITEMS] = [_cleanup_entry(x) for x in entries]
+        result[ITEM_COUNT] = len(entries)
+        result[TOTAL] = len(queue) if queue is not None else 0
         return result
 
 
@@ -106,20 +357,69 @@ class RebuildCompletedItemsCatalogView(AbstractAuthenticatedView):
                request_method='POST',
                permission=nauth.ACT_NTI_ADMIN,
                name='RemoveGhostCompletedItemContainers')
-class RemoveGhostCompletedItemContainersView(AbstractAuthenticatedView):
+class RemoveGhostCompletedItemContainersView(_BatchParamsMixin,
+                                             AbstractAuthenticatedView,
+                                             ModeledContentUploadRequestUtilsMixin):
+    """
+    Remove the completed items of users that no longer exist. By default
+    the completion contexts of the given (or all) `sites` are walked; if
+    `indexed`, the ghost usernames are read from the principal index
+    instead. With a `batchSize`, at most that many contexts (or
+    usernames) are processed and committed per request; pass back the
+    returned `Cursor` until `Complete`.
+    """
+
+    @Lazy
+    def indexed(self):
+        # pylint: disable=no-member
+        return is_true(self._params.get('indexed'))
+
+    @Lazy
+    def cursor(self):
+        # pylint: disable=no-member
+        return self._params.get('cursor') or None
+
+    def _walk_contexts(self, memo):
+        cursor = self.cursor
+        if cursor is not None:
+            try:
+                cursor = int(cursor)
+            except (TypeError, ValueError):
+                raise_error({'message': _(u"Invalid cursor."),
+                             'code': 'InvalidCursorError'})
+        doc_ids = iter_host_site_context_documents(self.sites, cursor)
+        # Only the contexts of the batch are loaded
+        batch = list(islice(doc_ids, self.batch_size))
+        intids = component.getUtility(IIntIds)
+        items = set()
+        for doc_id in batch:
+            context = intids.queryObject(doc_id)
+            if ICompletionContext.providedBy(context):
+                items.update(remove_ghost_user_containers(context, memo))
+        complete = self.batch_size is None or next(doc_ids, None) is None
+        return items, None if complete or not batch else batch[-1]
+
+    def _walk_index(self, memo):
+        ghosts = iter_indexed_ghost_usernames(self.sites, self.cursor,
+                                              memo=memo)
+        # Consume before removing, which mutates the index
+        items = list(islice(ghosts, self.batch_size))
+        for username in items:
+            remove_indexed_completed_items(username, self.sites)
+        complete = self.batch_size is None or len(items) < self.batch_size
+        return items, None if complete or not items else items[-1]
 
     def __call__(self):
+        memo = {}
+        if self.indexed:
+            items, cursor = self._walk_index(memo)
+        else:
+            items, cursor = self._walk_contexts(memo)
         result = LocatedExternalDict()
-        result[ITEMS] = items = set()
-        for context in get_completion_contexts():
-            container = ICompletedItemContainer(context)
-            # pylint: disable=too-many-function-args
-            for username, user_container in list(container.items()):
-                if User.get_user(username) is None:
-                    items.add(username)
-                    user_container.clear()
         result[ITEMS] = sorted(items)
         result[ITEM_COUNT] = result[TOTAL] = len(items)
+        result['Cursor'] = cursor
+        result['Complete'] = cursor is None
         return result
 
 
@@ -129,25 +429,17 @@ class RemoveGhostCompletedItemContainersView(AbstractAuthenticatedView):
              name=RESET_COMPLETION_VIEW,
              permission=nauth.ACT_NTI_ADMIN,
              request_method='POST')
-class ResetCompletionDataView(AbstractAuthenticatedView,
+class ResetCompletionDataView(_AdminParamsMixin,
+                              AbstractAuthenticatedView,
                               ModeledContentUploadRequestUtilsMixin):
     """
     A view to remove completion data for a :class:`ICompletionContext`;
     probably only useful for testing purposes since we do not turn around
-    and rebuild data.
+    and rebuild data. Whole context resets drop the completed items of
+    every user at once (see :func:`reset_context_completed_items`) unless
+    `bulk` is false.
     """
 
-    def readInput(self, value=None):
-        if self.request.body:
-            values = super(ResetCompletionDataView, self).readInput(value)
-        else:
-            values = self.request.params
-        return CaseInsensitiveDict(values)
-
-    @Lazy
-    def _params(self):
-        return self.readInput()
-
     @Lazy
     def users(self):
         # pylint: disable=no-member
@@ -157,8 +449,32 @@ class ResetCompletionDataView(AbstractAuthenticatedView,
             result = ICompletionContextCohort(self.context.completion_context, ())
         return result
 
+    @property
+    def bulk(self):
+        # pylint: disable=no-member
+        param = self._params.get('bulk')
+        return self.context.user is None \
+           and (param is None or is_true(param))
+
+    def do_bulk_reset_completed(self):
+        # pylint: disable=no-member
+        completion_context = self.context.completion_context
+        if reset_context_completed_items(completion_context) is None:
+            return False
+        # No events were fired; nothing derived is current anymore
+        cache = query_progress_cache(completion_context)
+        if cache is not None:
+            cache.invalidate()
+        invalidate_request_snapshots(completion_context)
+        state = query_build_state(completion_context)
+        if state is not None:
+            state.clear()
+        return True
+
     def do_reset_completed(self):
         # pylint: disable=no-member,not-an-iterable
+        if self.bulk and self.do_bulk_reset_completed():
+            return
         logger.info('Clearing user completed item containers')
         for user in self.users:
             user_container = component.getMultiAdapter((user, self.context.completion_context),
@@ -176,10 +492,13 @@ class ResetCompletionDataView(AbstractAuthenticatedView,
              name=BUILD_COMPLETION_VIEW,
              permission=nauth.ACT_NTI_ADMIN,
              request_method='POST')
-class BuildCompletionDataView(ResetCompletionDataView):
+class BuildCompletionDataView(_BatchParamsMixin, ResetCompletionDataView):
     """
     A view to build completion data for a :class:`ICompletionContext`,
-    optionally resetting completed data.
+    optionally resetting completed data. With `skipCurrent`, cohort users
+    already built for the current requirements are skipped (unless
+    `force` or `reset` is given). With a `batchSize`, the build is
+    resumable and committed per request; see :meth:`_do_chunk`.
     """
 
     @property
@@ -192,26 +511,134 @@ class BuildCompletionDataView(ResetCompletionDataView):
         result = is_true(param) if param else default
         return result
 
+    @property
+    def force(self):
+        # pylint: disable=no-member
+        return is_true(self._params.get('force'))
+
+    def _int_param(self, name, default):
+        # pylint: disable=no-member
+        try:
+            return int(self._params.get(name, default))
+        except (TypeError, ValueError):
+            raise_error({'message': _(u"Invalid integer parameter ${name}.",
+                                      mapping={'name': name}),
+                         'field': name,
+                         'code': 'InvalidParameterError'})
+
     def build_completion_data(self, user, completable_items):
         for item in completable_items:
             # pylint: disable=no-member
             update_completion(item, item.ntiid, user,
                               self.context.completion_context)
 
+    def _do_chunk(self):
+        """
+        Build at most `batchSize` users of the `worker` partition (out of
+        `workers`) of the current resumable build, starting one if needed.
+        Call repeatedly, concurrently for distinct workers, until
+        `Complete`.
+        """
+        # pylint: disable=no-member
+        completion_context = self.context.completion_context
+        state = get_build_state(completion_context)
+        if state is None:
+            raise hexc.HTTPUnprocessableEntity()
+        build = state.current
+        if build is None or build.complete or self.restart:
+            workers = self._int_param('workers', 1)
+            build = start_completion_build(completion_context,
+                                           self.reset_completed,
+                                           self.skip_current,
+                                           max(1, workers))
+        worker = self._int_param('worker', 0)
+        if worker < 0 or worker >= build.workers:
+            raise_error({'message': _(u"Invalid worker."),
+                         'code': 'InvalidWorkerError'})
+        processed = process_completion_build(completion_context, build,
+                                             worker, self.batch_size)
+        result = _completion_build_status(build)
+        result['Processed'] = processed
+        return result
+
+    @property
+    def dry_run(self):
+        # pylint: disable=no-member
+        return is_true(self._params.get('dryRun') or self._params.get('dry_run'))
+
+    @Lazy
+    def skip_current(self):
+        # Opt-in; users are only skipped when building the whole cohort
+        # pylint: disable=no-member
+        param = self._params.get('skipCurrent') or self._params.get('skip_current')
+        return  is_true(param) \
+            and not self.reset_completed \
+            and not self.force \
+            and self.context.user is None
+
+    def _iter_diffs(self):
+        # pylint: disable=no-member,not-an-iterable
+        completion_context = self.context.completion_context
+        state = get_build_state(completion_context)
+        version = get_build_version(completion_context)
+        item_providers = get_item_providers(completion_context)
+        totals = {'Added': 0, 'Removed': 0, 'Changed': 0,
+                  'UserCount': 0, 'SkippedCount': 0}
+        for user in self.users:
+            if     self.skip_current \
+               and state is not None \
+               and state.is_current(user.username, version):
+                totals['SkippedCount'] += 1
+                yield {'Username': user.username, 'Skipped': True}
+                continue
+            diff = diff_user_completion(user, completion_context,
+                                        item_providers, self.reset_completed)
+            for key, value in diff.items():
+                totals[key] += value
+            totals['UserCount'] += 1
+            diff['Username'] = user.username
+            yield diff
+        yield {'Total': totals}
+
+    def _do_dry_run(self):
+        """
+        Stream, as NDJSON, how many completed items the build would add,
+        remove or change for each user, followed by the totals. Nothing
+        is written.
+        """
+        transaction.doom()
+        return render_ndjson(self.request, self._iter_diffs())
+
     def __call__(self):
+        # pylint: disable=no-member
+        if self.dry_run:
+            return self._do_dry_run()
+        if self.batch_size is not None and self.context.user is None:
+            return self._do_chunk()
+        completion_context = self.context.completion_context
+        state = get_build_state(completion_context)
+        version = get_build_version(completion_context)
+        skip_current = self.skip_current
         if self.reset_completed:
             self.do_reset_completed()
         item_providers = None
         item_count = 0
         user_count = 0
+        skipped_count = 0
         logger.info('Building completion data')
-        # pylint: disable=no-member,not-an-iterable
+        # pylint: disable=not-an-iterable
         for user in self.users:
+            if     skip_current \
+               and state is not None \
+               and state.is_current(user.username, version):
+                skipped_count += 1
+                continue
             user_count += 1
             # Attempt to re-use providers, which may have internal caching
             if item_providers is None:
-                item_providers = component.subscribers((self.context.completion_context,),
+                item_providers = component.subscribers((completion_context,),
                                                        ICompletableItemProvider)
+                item_providers = shared_item_providers(item_providers)
             completable_items = set()
             for item_provider in item_providers:
                 completable_items.update(item_provider.iter_items(user))
@@ -219,15 +646,70 @@ class BuildCompletionDataView(ResetCompletionDataView):
             # Close enough
             item_count = item_count or len(completable_items)
             self.build_completion_data(user, completable_items)
-        logger.info('Finished building completion data for %s users (items=~%s)',
+            if state is not None:
+                state.mark(user.username, version)
+        logger.info('Finished building completion data for %s users (items=~%s) (skipped=%s)',
                     user_count,
-                    item_count)
+                    item_count,
+                    skipped_count)
 
         result = LocatedExternalDict()
         result.__name__ = self.request.view_name
         result.__parent__ = self.request.context
         result[ITEM_COUNT] = item_count
         result['UserCount'] = user_count
+        result['SkippedCount'] = skipped_count
+        return result
+
+
+@view_config(route_name='objects.generic.traversal',
+             renderer='rest',
+             context=ICompletedItemsContext,
+             name=BUILD_COMPLETION_VIEW,
+             permission=nauth.ACT_NTI_ADMIN,
+             request_method='GET')
+class BuildCompletionDataStatusView(AbstractAuthenticatedView):
+    """
+    Report the progress of the current resumable completion data build.
+    """
+
+    def __call__(self):
+        # pylint: disable=no-member
+        state = query_build_state(self.context.completion_context)
+        build = getattr(state, 'current', None)
+        if build is None:
+            raise hexc.HTTPNotFound()
+        return _completion_build_status(build)
+
+
+@view_config(route_name='objects.generic.traversal',
+             renderer='rest',
+             context=ICompletedItemsContext,
+             name=COMPLETION_PRINCIPALS_VIEW,
+             permission=nauth.ACT_NTI_ADMIN,
+             request_method='GET')
+class CompletionPrincipalsView(AbstractAuthenticatedView):
+    """
+    List the users with completion data in the context, with their number
+    of completed items, straight from the catalog indexes. If `ghosts`,
+    only the users that no longer exist are listed.
+    """
+
+    def __call__(self):
+        # pylint: disable=no-member
+        counts = get_context_principal_counts(self.context.completion_context)
+        user = self.context.user
+        if user is not None:
+            counts = {k: v for k, v in counts.items() if k == user.username}
+        if is_true(self.request.params.get('ghosts')):
+            memo = {}
+            counts = {k: v for k, v in counts.items()
+                      if not user_exists(k, memo)}
+        result = LocatedExternalDict()
+        result.__name__ = self.request.view_name
+        result.__parent__ = self.request.context
+        result[ITEMS] = counts
+        result[ITEM_COUNT] = result[TOTAL] = len(counts)
         return result
 
 
@@ -16,10 +16,18 @@ from requests.structures import CaseInsensitiveDict
 
 from zope import component
 
+from zope.event import notify
+
 from nti.appserver.pyramid_authorization import has_permission
 
 from nti.app.base.abstract_views import AbstractAuthenticatedView
 
+from nti.app.contenttypes.completion.cache import get_required_state
+from nti.app.contenttypes.completion.cache import get_required_items_version
+
+from nti.app.contenttypes.completion.interfaces import CompletionContextRequirementsModifiedEvent
+
+from nti.app.contenttypes.completion.views import ConditionalViewMixin
 from nti.app.contenttypes.completion.views import CompletableItemsPathAdapter
 
 from nti.app.contenttypes.completion.views import COMPLETION_DEFAULT_VIEW_NAME
@@ -74,6 +82,9 @@ class AbstractCompletionRequiredView(AbstractAuthenticatedView):
         # Get the sub path ntiid if we're drilling in.
         return self.request.subpath[0] if self.request.subpath else ''
 
+    def notify_requirements_modified(self):
+        notify(CompletionContextRequirementsModifiedEvent(self.completion_context))
+
 
 @view_config(route_name='objects.generic.traversal',
              renderer='rest',
@@ -93,9 +104,9 @@ class CompletionDefaultView(AbstractCompletionRequiredView):
                                                         self.completion_context)
         possible_item_ntiids = set(x.ntiid for x in possible_items)
         result = LocatedExternalDict()
-        required_keys = self.completable_container.get_required_keys()
-        optional_keys = self.completable_container.get_optional_keys()
-        result[ITEMS] = result_items = possible_item_ntiids - set(required_keys) - set(optional_keys)
+        required_state = get_required_state(self.completion_context)
+        result[ITEMS] = result_items = {x for x in possible_item_ntiids
+                                        if required_state.is_default_state(x)}
         result[ITEM_COUNT] = len(result_items)
         result[TOTAL] = len(possible_item_ntiids)
         return result
@@ -191,6 +202,7 @@ class AbstractRequiredUpdateView(AbstractCompletionRequiredView,
     def _do_call(self):
         item = self._get_item()
         self._update_container(item)
+        self.notify_requirements_modified()
         result = LocatedExternalDict()
         keys = self._get_keys()
         result[ITEMS] = keys
@@ -288,6 +300,7 @@ class CompletionRequiredDeleteView(AbstractCompletionRequiredView):
         item_ntiid = self.item_ntiid
         # pylint: disable=too-many-function-args
         self.completable_container.remove_required_item(item_ntiid)
+        self.notify_requirements_modified()
         logger.info('Item no longer required for completion %s', item_ntiid)
         return hexc.HTTPNoContent()
 
@@ -305,6 +318,7 @@ class CompletionNotRequiredDeleteView(AbstractCompletionRequiredView):
         item_ntiid = self.item_ntiid
         # pylint: disable=too-many-function-args
         self.completable_container.remove_optional_item(item_ntiid)
+        self.notify_requirements_modified()
         logger.info('Item no longer not-required for completion %s', item_ntiid)
         return hexc.HTTPNoContent()
 
@@ -314,7 +328,8 @@ class CompletionNotRequiredDeleteView(AbstractCompletionRequiredView):
              context=CompletableItemsPathAdapter,
              permission=nauth.ACT_READ,
              request_method='GET')
-class CompletableItemsView(AbstractCompletionRequiredView):
+class CompletableItemsView(AbstractCompletionRequiredView,
+                           ConditionalViewMixin):
 
     @property
     def user(self):
@@ -335,6 +350,11 @@ class CompletableItemsView(AbstractCompletionRequiredView):
             if not has_permission(nauth.ACT_UPDATE, self.context, self.request):
                 raise hexc.HTTPForbidden()
 
+        token = get_required_items_version(user, self.completion_context)
+        not_modified = self.not_modified(token)
+        if not_modified is not None:
+            return not_modified
+
         # pylint: disable=no-member
         result = LocatedExternalDict()
         result.__parent__ = self.context.__parent__
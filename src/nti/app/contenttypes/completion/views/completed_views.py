@@ -20,6 +20,8 @@ from nti.app.base.abstract_views import AbstractAuthenticatedView
 
 from nti.app.contenttypes.completion.interfaces import ICompletedItemsContext
 
+from nti.app.contenttypes.completion.views import ConditionalViewMixin
+
 from nti.contenttypes.completion.authorization import ACT_VIEW_PROGRESS
 
 from nti.contenttypes.completion.interfaces import ICompletedItemProvider
@@ -39,7 +41,8 @@ logger = __import__('logging').getLogger(__name__)
              context=ICompletedItemsContext,
              permission=ACT_VIEW_PROGRESS,
              request_method='GET')
-class UserCompletedItems(AbstractAuthenticatedView):
+class UserCompletedItems(AbstractAuthenticatedView,
+                         ConditionalViewMixin):
 
     @property
     def user(self):
@@ -70,6 +73,13 @@ class UserCompletedItems(AbstractAuthenticatedView):
         if self.user is None:
             raise hexc.HTTPNotFound()
 
+        # pylint: disable=not-an-iterable
+        token = (self.user.username,
+                 tuple(x.last_modified for x in self.providers))
+        not_modified = self.not_modified(token, self._get_last_mod())
+        if not_modified is not None:
+            return not_modified
+
         results = LocatedExternalDict()
         results.__name__ = self.user.username
         results.__parent__ = self.context
@@ -82,5 +92,4 @@ class UserCompletedItems(AbstractAuthenticatedView):
         results[ITEMS] = items
         results[TOTAL] = results[ITEM_COUNT] = len(items)
         results['Username'] = self.user.username
-        self.request.response.last_modified = self._get_last_mod()
         return results
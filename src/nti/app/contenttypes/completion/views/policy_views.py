@@ -14,12 +14,16 @@ from pyramid.view import view_config
 
 from zope import interface
 
+from zope.event import notify
+
 from zope.container.contained import Contained
 
 from zope.traversing.interfaces import IPathAdapter
 
 from nti.app.base.abstract_views import AbstractAuthenticatedView
 
+from nti.app.contenttypes.completion.interfaces import CompletionContextRequirementsModifiedEvent
+
 from nti.app.contenttypes.completion.views import COMPLETION_POLICY_VIEW_NAME
 from nti.app.contenttypes.completion.views import DEFAULT_REQUIRED_POLICY_PATH_NAME
 
@@ -29,6 +33,7 @@ from nti.app.externalization.view_mixins import ModeledContentUploadRequestUtils
 
 from nti.appserver.ugd_edit_views import UGDPutView
 
+from nti.contenttypes.completion.interfaces import ICompletionContext
 from nti.contenttypes.completion.interfaces import ICompletableItemCompletionPolicy
 from nti.contenttypes.completion.interfaces import ICompletionContextCompletionPolicy
 from nti.contenttypes.completion.interfaces import ICompletableItemDefaultRequiredPolicy
@@ -36,6 +41,8 @@ from nti.contenttypes.completion.interfaces import ICompletionContextCompletionP
 
 from nti.dataserver import authorization as nauth
 
+from nti.traversal.traversal import find_interface
+
 logger = __import__('logging').getLogger(__name__)
 
 
@@ -67,6 +74,12 @@ class DefaultRequiredPolicyPutView(UGDPutView):
         completion_context = self.context.completion_context
         return ICompletableItemDefaultRequiredPolicy(completion_context)
 
+    def __call__(self):
+        result = super(DefaultRequiredPolicyPutView, self).__call__()
+        # pylint: disable=no-member
+        notify(CompletionContextRequirementsModifiedEvent(self.context.completion_context))
+        return result
+
 
 @view_config(route_name='objects.generic.traversal',
              renderer='rest',
@@ -101,6 +114,9 @@ class AbstractCompletionContextPolicyView(AbstractAuthenticatedView):
         # Get the sub path ntiid if we're drilling in.
         return self.request.subpath[0] if self.request.subpath else ''
 
+    def notify_requirements_modified(self):
+        notify(CompletionContextRequirementsModifiedEvent(self.completion_context))
+
 
 @view_config(route_name='objects.generic.traversal',
              renderer='rest',
@@ -147,6 +163,7 @@ class CompletionContextPolicyUpdateView(AbstractCompletionContextPolicyView,
         else:
             logger.info('Added completable policy for %s', item_ntiid)
             self.completion_container[item_ntiid] = new_policy
+        self.notify_requirements_modified()
         return new_policy
 
 
@@ -163,6 +180,14 @@ class CompletionPolicyPutView(UGDPutView):
     def _get_object_to_update(self):
         return self.context
 
+    def __call__(self):
+        result = super(CompletionPolicyPutView, self).__call__()
+        completion_context = find_interface(self.context, ICompletionContext,
+                                            strict=False)
+        if completion_context is not None:
+            notify(CompletionContextRequirementsModifiedEvent(completion_context))
+        return result
+
 
 @view_config(route_name='objects.generic.traversal',
              renderer='rest',
@@ -184,4 +209,5 @@ class CompletionPolicyDeleteView(AbstractCompletionContextPolicyView):
                 logger.info('Deleted completable policy for %s', item_ntiid)
             except KeyError:
                 pass
+        self.notify_requirements_modified()
         return hexc.HTTPNoContent()
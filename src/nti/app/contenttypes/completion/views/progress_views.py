@@ -8,52 +8,108 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import absolute_import
 
-from collections import Counter
+import heapq
 
-import math
+import six
 
 from pyramid import httpexceptions as hexc
 
 from pyramid.view import view_config
 from pyramid.view import view_defaults
 
+from requests.structures import CaseInsensitiveDict
+
 from zope import component
 
+from zope.annotation.interfaces import IAnnotations
+
 from zope.cachedescriptors.property import Lazy
 
 from nti.app.base.abstract_views import AbstractAuthenticatedView
 
+from nti.app.contenttypes.completion import CONTEXT_PROGRESS_VIEW
+from nti.app.contenttypes.completion import BUILD_PROGRESS_AGGREGATE_VIEW
+
 from nti.app.contenttypes.completion.adapters import CompletionContextProgressFactory
 
+from nti.app.contenttypes.completion.cache import get_progress_version
+from nti.app.contenttypes.completion.cache import query_progress_aggregate
+from nti.app.contenttypes.completion.cache import CompletionContextProgressAggregate
+
+from nti.app.contenttypes.completion.cohort import iter_cohort_progress
+from nti.app.contenttypes.completion.cohort import get_aggregate_token
+from nti.app.contenttypes.completion.cohort import is_current_aggregate
+from nti.app.contenttypes.completion.cohort import build_cohort_aggregate
+from nti.app.contenttypes.completion.cohort import reconcile_cohort_aggregate
+
+from nti.app.contenttypes.completion.progress import get_user_context_progress
+
 from nti.app.contenttypes.completion.interfaces import ICompletionContextCohort
+from nti.app.contenttypes.completion.interfaces import ICompletionContextProgressAggregate
 from nti.app.contenttypes.completion.interfaces import ICompletionContextUserProgress
 
+from nti.app.contenttypes.completion.views import ConditionalViewMixin
+
+from nti.app.contenttypes.completion.views import raise_error
+from nti.app.contenttypes.completion.views import render_ndjson
+from nti.app.contenttypes.completion.views import MessageFactory as _
+
+from nti.app.externalization.internalization import read_body_as_external_object
+
+from nti.app.externalization.view_mixins import BatchingUtilsMixin
+
+from nti.appserver.pyramid_authorization import has_permission
+
+from nti.common.string import is_true
+
 from nti.contenttypes.completion.authorization import ACT_LIST_PROGRESS
 from nti.contenttypes.completion.authorization import ACT_VIEW_PROGRESS
 
 from nti.contenttypes.completion.interfaces import IProgress
+from nti.contenttypes.completion.interfaces import ICompletionContext
 from nti.contenttypes.completion.interfaces import ICompletionContextProgress
 from nti.contenttypes.completion.interfaces import ICompletionContextCompletionPolicy
 from nti.contenttypes.completion.interfaces import ICompletableItemCompletionPolicy
 
+from nti.dataserver import authorization as nauth
+
+from nti.dataserver.authorization import is_admin
+
+from nti.dataserver.interfaces import IUser
 from nti.dataserver.interfaces import IPrincipal
+from nti.dataserver.interfaces import IEnumerableEntityContainer
+
+from nti.dataserver.users.entity import Entity
+
+from nti.dataserver.users.users import User
 
 from nti.externalization.externalization import to_external_object
 
 from nti.externalization.interfaces import LocatedExternalDict
 from nti.externalization.interfaces import StandardExternalFields
 
+from nti.ntiids.ntiids import find_object_with_ntiid
+
 ITEMS = StandardExternalFields.ITEMS
 TOTAL = StandardExternalFields.TOTAL
 ITEM_COUNT = StandardExternalFields.ITEM_COUNT
 
+#: The maximum number of users of a batch progress request
+MAX_BATCH_USERS = 500
+
 logger = __import__('logging').getLogger(__name__)
 
 
+def _principal_id(user):
+    return IPrincipal(user).id
+
+
 @view_defaults(route_name='objects.generic.traversal',
                renderer='rest',
                request_method='GET')
-class ProgressContextView(AbstractAuthenticatedView):
+class ProgressContextView(AbstractAuthenticatedView,
+                          BatchingUtilsMixin,
+                          ConditionalViewMixin):
 
     @Lazy
     def completion_context_policy(self):
@@ -61,48 +117,20 @@ class ProgressContextView(AbstractAuthenticatedView):
         return ICompletionContextCompletionPolicy(self.context.completion_context,
                                                   None)
 
-    @view_config(permission=ACT_VIEW_PROGRESS,
-                 context=ICompletionContextProgress)
-    def aggregate_stats(self):
-        if self.completion_context_policy is None:
-            raise hexc.HTTPNotFound()
+    @Lazy
+    def bucket_size(self):
+        try:
+            result = int(self.request.params.get('bucketSize', 5))
+        except (TypeError, ValueError):
+            result = 0
+        if result <= 0 or result > 100:
+            raise hexc.HTTPUnprocessableEntity()
+        return result
 
-        bucket_size = self.request.params.get('bucketSize', 5)
-        # pylint: disable=no-member
-        cohort = ICompletionContextCohort(self.context.completion_context, ())
-        total_students = 0
-        accumulated_progress = 0
-        count_started = 0
-        count_completed = 0
-        count_success = 0
-        distribution = Counter()
-        required_item_providers = None
-
-        for user in cohort:
-            # Attempt to re-use providers, which may have internal caching
-            progress_factory = CompletionContextProgressFactory(user,
-                                                                self.context.completion_context,
-                                                                required_item_providers)
-            progress = progress_factory()
-            if required_item_providers is None:
-                required_item_providers = progress_factory.required_item_providers
-
-            try:
-                percentage_complete = float(progress.AbsoluteProgress) / float(progress.MaxPossibleProgress)
-            except (TypeError, ZeroDivisionError, AttributeError):
-                percentage_complete = 0
-            bucketed = bucket_size * math.floor(percentage_complete * 100 / bucket_size)
-            distribution[bucketed] += 1
-            accumulated_progress += percentage_complete
-
-            if progress is not None:
-                if progress.AbsoluteProgress:
-                    count_started += 1
-                if progress.Completed:
-                    count_completed += 1
-                if getattr(progress.CompletedItem, 'Success', False):
-                    count_success += 1
-            total_students += 1
+    def _aggregate_stats(self, aggregate, stale=False):
+        bucket_size = self.bucket_size
+        total_students = aggregate.TotalUsers
+        accumulated_progress = aggregate.accumulated_progress()
 
         result = LocatedExternalDict()
         result.__name__ = self.request.view_name
@@ -112,14 +140,69 @@ class ProgressContextView(AbstractAuthenticatedView):
         result['AbsoluteProgress'] = accumulated_progress
         result['PercentageProgress'] = accumulated_progress / total_students if total_students else 0.0
         result['TotalUsers'] = total_students
-        result['CountHasProgress'] = count_started
-        result['CountCompleted'] = count_completed
-        result['CountSuccess'] = count_success
-        result['ProgressDistribution'] = {k/100.0: distribution[k]
-                                          for k in range(0, 101, bucket_size)}
-
+        result['CountHasProgress'] = aggregate.CountHasProgress
+        result['CountCompleted'] = aggregate.CountCompleted
+        result['CountSuccess'] = aggregate.CountSuccess
+        result['ProgressDistribution'] = aggregate.distribution(bucket_size)
+        result['Stale'] = stale
         return result
 
+    @view_config(permission=ACT_VIEW_PROGRESS,
+                 context=ICompletionContextProgress)
+    def aggregate_stats(self):
+        """
+        Cohort progress statistics, served from the incrementally maintained
+        :class:`ICompletionContextProgressAggregate`; nothing is computed or
+        written here. Progress changes are folded in as they happen and the
+        aggregate is rebuilt when the requirements are modified. Statistics
+        built for other requirements (e.g. changed provider items) or
+        another cohort size are returned as `Stale` until rebuilt with
+        :meth:`build_aggregate`. A 202 is returned if they were never built.
+        """
+        if self.completion_context_policy is None:
+            raise hexc.HTTPNotFound()
+        # pylint: disable=no-member
+        completion_context = self.context.completion_context
+        cohort = ICompletionContextCohort(completion_context, ())
+        if IAnnotations(completion_context, None) is None:
+            # Not annotatable; aggregate in volatile counters
+            aggregate = CompletionContextProgressAggregate()
+            build_cohort_aggregate(aggregate, completion_context, None, cohort)
+            return self._aggregate_stats(aggregate)
+        aggregate = query_progress_aggregate(completion_context)
+        if aggregate is None:
+            raise_error({'message': _(u"Progress statistics are not built yet."),
+                         'code': 'ProgressAggregateNotBuiltError'},
+                        factory=hexc.HTTPAccepted)
+        stale = not is_current_aggregate(aggregate, completion_context) \
+             or len(cohort) != aggregate.TotalUsers
+        return self._aggregate_stats(aggregate, stale)
+
+    @view_config(permission=nauth.ACT_NTI_ADMIN,
+                 context=ICompletionContextProgress,
+                 request_method='POST',
+                 name=BUILD_PROGRESS_AGGREGATE_VIEW)
+    def build_aggregate(self):
+        """
+        (Re)build the cohort progress statistics: an O(students) pass if
+        they were built for other requirements or `refresh` is given;
+        otherwise only the users that enrolled or dropped are reconciled.
+        """
+        if self.completion_context_policy is None:
+            raise hexc.HTTPNotFound()
+        # pylint: disable=no-member
+        completion_context = self.context.completion_context
+        cohort = ICompletionContextCohort(completion_context, ())
+        aggregate = ICompletionContextProgressAggregate(completion_context, None)
+        if aggregate is None:
+            raise hexc.HTTPUnprocessableEntity()
+        token = get_aggregate_token(completion_context)
+        if    not is_current_aggregate(aggregate, completion_context, token) \
+           or is_true(self.request.params.get('refresh')):
+            build_cohort_aggregate(aggregate, completion_context, token, cohort)
+        else:
+            reconcile_cohort_aggregate(aggregate, completion_context, cohort)
+        return self._aggregate_stats(aggregate)
 
     @view_config(permission=ACT_VIEW_PROGRESS,
                  context=ICompletionContextUserProgress)
@@ -129,6 +212,10 @@ class ProgressContextView(AbstractAuthenticatedView):
             raise hexc.HTTPNotFound()
         if self.completion_context_policy is None:
             raise hexc.HTTPNotFound()
+        not_modified = self.not_modified(get_progress_version(self.context.user,
+                                                              self.context.completion_context))
+        if not_modified is not None:
+            return not_modified
         progress = component.queryMultiAdapter((self.context.user, self.context.completion_context),
                                                IProgress)
         return progress if progress is not None else hexc.HTTPNoContent()
@@ -143,6 +230,7 @@ class ProgressContextView(AbstractAuthenticatedView):
             raise hexc.HTTPNotFound()
         if self.completion_context_policy is None:
             raise hexc.HTTPNotFound()
+        # Not conditional; the per-item progress has no cheap validator
         progress = component.queryMultiAdapter((self.context.user, self.context.completion_context),
                                                IProgress)
 
@@ -183,13 +271,30 @@ class ProgressContextView(AbstractAuthenticatedView):
         return result
 
 
+    @property
+    def _wants_ndjson(self):
+        return self.request.params.get('format') == 'ndjson' \
+            or 'application/x-ndjson' in self.request.headers.get('Accept', '')
+
+    def _iter_progress(self, users):
+        # pylint: disable=no-member
+        return iter_cohort_progress(self.context.completion_context, users)
+
+    def _render_ndjson(self, users):
+        return render_ndjson(self.request,
+                             ({'Username': IPrincipal(user).id,
+                               'Progress': to_external_object(progress)}
+                              for user, progress in self._iter_progress(users)))
+
     @view_config(permission=ACT_LIST_PROGRESS,
                  context=ICompletionContextUserProgress,
                  name='list')
     def list_users(self):
         """
         This is probably really expensive.  Adapt the completion context
-        to an IEntityEnumerable
+        to an IEntityEnumerable. Users are sorted by username and may be
+        paged with `batchStart` and `batchSize`; `format=ndjson` renders one
+        progress per line.
         """
         # pylint: disable=no-member
         if self.context.user is not None:
@@ -197,27 +302,167 @@ class ProgressContextView(AbstractAuthenticatedView):
         if self.completion_context_policy is None:
             raise hexc.HTTPNotFound()
 
-        result = LocatedExternalDict()
-        result.__name__ = self.request.view_name
-        result.__parent__ = self.request.context
-
         # We could support subsets (e.g. course scopes, groups, etc)
         # by adding a layer of indirection here that was able to produce
         # ICompletionContextCohorts for a given name provided as a query param
         users = ICompletionContextCohort(self.context.completion_context,
                                          ())
+        total = len(users)
+        batch_size, batch_start = self._get_batch_size_start()
+        if batch_size is not None and batch_start is not None:
+            # Only keep the users up to the page rather than sorting
+            # the whole cohort
+            users = heapq.nsmallest(batch_start + batch_size, users,
+                                    key=_principal_id)[batch_start:]
+        else:
+            users = sorted(users, key=_principal_id)
+
+        if self._wants_ndjson:
+            return self._render_ndjson(users)
+
+        result = LocatedExternalDict()
+        result.__name__ = self.request.view_name
+        result.__parent__ = self.request.context
         items = {}
-        required_item_providers = None
+        for user, progress in self._iter_progress(users):
+            items[IPrincipal(user).id] = progress
+        result[ITEMS] = items
+        result[ITEM_COUNT] = len(items)
+        result[TOTAL] = total
+        return result
 
+    def _batch_params(self):
+        if self.request.body:
+            values = read_body_as_external_object(self.request,
+                                                  expected_type=(dict, list))
+        else:
+            values = self.request.params
+        if isinstance(values, list):
+            # A plain list of usernames
+            values = {'usernames': values}
+        return CaseInsensitiveDict(values)
+
+    def _check_batch_size(self, count):
+        if count > MAX_BATCH_USERS:
+            raise_error({'message': _(u"Too many users; at most ${max} per request.",
+                                      mapping={'max': MAX_BATCH_USERS}),
+                         'code': 'TooManyUsersError'})
+
+    def _batch_usernames(self, values):
+        names = values.get('usernames') or values.get('users') or ()
+        if isinstance(names, six.string_types):
+            names = names.split(',')
+        if     not isinstance(names, (list, tuple)) \
+            or not all(isinstance(x, six.string_types) for x in names):
+            raise_error({'message': _(u"Invalid usernames."),
+                         'field': 'usernames',
+                         'code': 'InvalidUsernamesError'})
+        names = [x.strip() for x in names if x.strip()]
+        self._check_batch_size(len(names))
+        return names
+
+    def _batch_users(self, values):
+        """
+        Return the cohort users named by the `usernames` and the members
+        of the `entity` container, along with the names we could not use.
+        At most :data:`MAX_BATCH_USERS` users are allowed.
+        """
+        names = self._batch_usernames(values)
+        users = [User.get_user(x) for x in names]
+        missing = [x for x, user in zip(names, users) if user is None]
+        users = [x for x in users if x is not None]
+        entity_name = values.get('entity')
+        if entity_name:
+            container = IEnumerableEntityContainer(Entity.get_entity(entity_name),
+                                                   None)
+            if container is None:
+                raise_error({'message': _(u"Invalid entity container."),
+                             'code': 'InvalidEntityContainerError'})
+            users.extend(x for x in container.iter_entities() if IUser.providedBy(x))
+            self._check_batch_size(len(users))
+        # pylint: disable=no-member
+        cohort = ICompletionContextCohort(self.context.completion_context, ())
+        result = {}
         for user in users:
-            # Attempt to re-use providers, which may have internal caching
-            progress_factory = CompletionContextProgressFactory(user,
-                                                                self.context.completion_context,
-                                                                required_item_providers)
-
-            items[IPrincipal(user).id] = progress_factory()
-            if required_item_providers is None:
-                required_item_providers = progress_factory.required_item_providers
+            username = IPrincipal(user).id
+            if user in cohort:
+                result[username] = user
+            else:
+                missing.append(username)
+        return [result[x] for x in sorted(result)], missing
+
+    @view_config(permission=ACT_LIST_PROGRESS,
+                 context=ICompletionContextProgress,
+                 request_method='POST')
+    def batch_progress(self):
+        """
+        The progress of many users of the cohort in one request; the
+        required items and policy are resolved once for the batch. Users
+        are given as a list of `usernames` and/or an `entity` whose
+        members are used. `format=ndjson` renders one progress per line.
+        """
+        if self.completion_context_policy is None:
+            raise hexc.HTTPNotFound()
+        users, missing = self._batch_users(self._batch_params())
+        if self._wants_ndjson:
+            return self._render_ndjson(users)
+
+        result = LocatedExternalDict()
+        result.__name__ = self.request.view_name
+        result.__parent__ = self.request.context
+        items = {}
+        for user, progress in self._iter_progress(users):
+            items[IPrincipal(user).id] = progress
         result[ITEMS] = items
-        result[TOTAL] = result[ITEM_COUNT] = len(items)
+        result[ITEM_COUNT] = result[TOTAL] = len(items)
+        result['Missing'] = sorted(set(missing))
+        return result
+
+
+@view_config(route_name='objects.generic.traversal',
+             renderer='rest',
+             context=IUser,
+             permission=nauth.ACT_READ,
+             request_method=('GET', 'POST'),
+             name=CONTEXT_PROGRESS_VIEW)
+class UserContextProgressView(AbstractAuthenticatedView):
+    """
+    The progress of a user in each of the completion contexts given by
+    the `ntiids` param (or body). Only the user and admins may fetch it,
+    and only for the contexts they can read; the others are `Missing`.
+    """
+
+    def _ntiids(self):
+        if self.request.body:
+            values = read_body_as_external_object(self.request)
+        else:
+            values = self.request.params
+        ntiids = CaseInsensitiveDict(values).get('ntiids') or ()
+        if not isinstance(ntiids, (list, tuple, set)):
+            ntiids = ntiids.split(',')
+        return [x.strip() for x in ntiids if x and x.strip()]
+
+    def __call__(self):
+        if self.remoteUser != self.context and not is_admin(self.remoteUser):
+            raise hexc.HTTPForbidden()
+        ntiids = []
+        contexts = []
+        missing = []
+        for ntiid in self._ntiids():
+            context = find_object_with_ntiid(ntiid)
+            if      ICompletionContext.providedBy(context) \
+                and has_permission(nauth.ACT_READ, context, self.request):
+                ntiids.append(ntiid)
+                contexts.append(context)
+            else:
+                missing.append(ntiid)
+        progress = get_user_context_progress(self.context, contexts)
+        result = LocatedExternalDict()
+        result.__name__ = self.request.view_name
+        result.__parent__ = self.request.context
+        result[ITEMS] = items = {}
+        for ntiid, (unused_context, context_progress) in zip(ntiids, progress):
+            items[ntiid] = context_progress
+        result[ITEM_COUNT] = result[TOTAL] = len(items)
+        result['Missing'] = missing
         return result